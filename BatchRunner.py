@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PlanCache import normalize_question
+from offload import to_thread
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Batch execution of questions
+# A batch de-duplicates its questions, takes one schema snapshot that every question of the batch uses, probes each
+# value-index column once and runs the remaining pipelines concurrently. The batch in progress is exposed to the nodes
+# through the current_batch context variable, which follows the work into tasks and worker threads.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+current_batch = contextvars.ContextVar("current_batch", default=None)
+
+
+class BatchContext:
+    """
+    Work shared by the questions of one batch.
+
+    Attributes:
+        snapshot (dict): The schema snapshot (fingerprint, schema, graph) taken when the batch started.
+        indexed (set): The (table, column) pairs of the value index already brought up to date in this batch.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.indexed = set()
+        self.lock = threading.Lock()
+
+    def ensure_indexed(self, value_index, table_name, columns):
+        """Brings the value index of the columns up to date, once per column for the whole batch."""
+        for column_name in columns:
+            key = (table_name, column_name)
+            with self.lock:
+                if key in self.indexed:
+                    continue
+                self.indexed.add(key)
+            value_index.ensure_indexed(table_name, column_name)
+
+
+class BatchRunner:
+    """
+    Answers a list of questions with one WorkflowManager.
+
+    Attributes:
+        workflow_manager (WorkflowManager): The runtime answering the questions.
+        parallelism (int): Questions answered at the same time.
+        tenant (str): The tenant whose database answers the questions, None for the default database. Its runtime is
+                      held for the whole batch.
+    """
+
+    def __init__(self, workflow_manager, parallelism=8, tenant=None):
+        self.workflow_manager = workflow_manager
+        self.parallelism = parallelism
+        self.tenant = tenant
+
+    @staticmethod
+    def plan(questions):
+        """
+        Returns the indices of the questions to run and, for every question, the index of the question it duplicates
+        (its own index for the first occurrence of a normalized question).
+        """
+        first = {}
+        owners = []
+        for i, question in enumerate(questions):
+            owners.append(first.setdefault(normalize_question(question), i))
+        return sorted(set(owners)), owners
+
+    @staticmethod
+    def _context(runtime):
+        return BatchContext(runtime.db_manager.schema_cache.get())
+
+    @staticmethod
+    def _item(index, question, result, error, elapsed, duplicate_of=None):
+        return {
+            "index": index,
+            "question": question,
+            "result": result,
+            "error": error,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "duplicate_of": duplicate_of,
+        }
+
+    @classmethod
+    def _assemble(cls, questions, owners, outcomes):
+        """Expands the outcomes of the unique questions to every input position, in input order."""
+        items = []
+        for i, question in enumerate(questions):
+            result, error, elapsed = outcomes[owners[i]]
+            items.append(cls._item(i, question, result, error, elapsed,
+                                   duplicate_of=owners[i] if owners[i] != i else None))
+        return items
+
+    def run(self, questions, uuid_prefix="batch"):
+        """
+        Answers the questions on a pool of parallelism threads.
+
+        Returns:
+            list[dict]: One item per question in input order with 'index', 'question', 'result' (the output of
+                        run_sql_agent, None on failure), 'error' (None on success), 'elapsed_ms' and 'duplicate_of'
+                        (the index of the identical question whose answer was reused, otherwise None).
+        """
+        unique, owners = self.plan(questions)
+        with self.workflow_manager.runtime(self.tenant) as runtime:
+            token = current_batch.set(self._context(runtime))
+            try:
+                def answer(i):
+                    start = time.perf_counter()
+                    try:
+                        result = self.workflow_manager.run_sql_agent(questions[i], f"{uuid_prefix}-{i}", self.tenant)
+                        return result, None, time.perf_counter() - start
+                    except Exception as e:
+                        return None, str(e), time.perf_counter() - start
+
+                with ThreadPoolExecutor(max_workers=self.parallelism) as executor:
+                    futures = {i: executor.submit(contextvars.copy_context().run, answer, i) for i in unique}
+                    outcomes = {i: future.result() for i, future in futures.items()}
+            finally:
+                current_batch.reset(token)
+        return self._assemble(questions, owners, outcomes)
+
+    async def arun(self, questions, uuid_prefix="batch"):
+        """
+        Async variant of run: the pipelines run as tasks on the event loop, at most parallelism at a time.
+        """
+        unique, owners = self.plan(questions)
+        semaphore = asyncio.Semaphore(self.parallelism)
+        async with self.workflow_manager.aruntime(self.tenant) as runtime:
+            token = current_batch.set(await to_thread(self._context, runtime))
+            try:
+                async def answer(i):
+                    async with semaphore:
+                        start = time.perf_counter()
+                        try:
+                            result = await self.workflow_manager.arun_sql_agent(questions[i], f"{uuid_prefix}-{i}",
+                                                                                self.tenant)
+                            return i, (result, None, time.perf_counter() - start)
+                        except Exception as e:
+                            return i, (None, str(e), time.perf_counter() - start)
+
+                outcomes = dict(await asyncio.gather(*(answer(i) for i in unique)))
+            finally:
+                current_batch.reset(token)
+        return self._assemble(questions, owners, outcomes)
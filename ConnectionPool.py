@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Connection pooling
+# Engines are created with a bounded QueuePool; every call borrows its own connection for the duration of the call and
+# returns it to the pool. PoolMetrics counts checkouts through pool events and measures how long callers wait for a
+# connection when the pool is exhausted.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+def is_memory_sqlite(db_url):
+    url = make_url(db_url)
+    return url.get_backend_name() == "sqlite" and (url.database in (None, "", ":memory:")
+                                                   or url.query.get("mode") == "memory")
+
+
+def pool_options(db_url, pool_size=5, max_overflow=10, pool_recycle=1800, pool_timeout=30.0):
+    """
+    Returns the create_engine() pool arguments for a database URL.
+    In-memory SQLite databases live in a single connection per thread (SingletonThreadPool), which takes no sizing.
+    """
+    if is_memory_sqlite(db_url):
+        return {}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_recycle': pool_recycle,
+        'pool_timeout': pool_timeout,
+    }
+
+
+class PoolMetrics:
+    """
+    Pool usage counters of one engine.
+
+    Attributes:
+        engine: The SQLAlchemy engine being measured.
+        capacity (int): pool_size + max_overflow, or None for pools without a bound.
+        checked_out (int): Connections currently borrowed from the pool.
+        checkouts (int): Connections handed out since start.
+        waits (int): Calls to connect() that found the pool exhausted and had to wait.
+        wait_time (float): Total seconds spent waiting in those calls.
+        max_wait (float): Longest single wait in seconds.
+    """
+
+    def __init__(self, engine, capacity=None):
+        self.engine = engine
+        self.capacity = capacity
+        self.checked_out = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.lock = threading.Lock()
+        event.listen(engine, "checkout", self._on_checkout)
+        event.listen(engine, "checkin", self._on_checkin)
+
+    @classmethod
+    def create_engine(cls, db_url, echo=False, **pool_kwargs):
+        """
+        Creates a pooled engine for db_url and returns it with its metrics.
+        """
+        options = pool_options(db_url, **pool_kwargs)
+        engine = create_engine(db_url, echo=echo, **options)
+        capacity = options['pool_size'] + options['max_overflow'] if options else None
+        return engine, cls(engine, capacity)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checked_out += 1
+            self.checkouts += 1
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    @contextmanager
+    def connect(self):
+        """
+        Borrows a connection for the duration of the block, recording the wait if the pool was exhausted.
+        """
+        saturated = self.capacity is not None and self.checked_out >= self.capacity
+        start = time.perf_counter()
+        connection = self.engine.connect()
+        if saturated:
+            waited = time.perf_counter() - start
+            with self.lock:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    def snapshot(self):
+        pool = self.engine.pool
+        return {
+            'checked_out': self.checked_out,
+            'capacity': self.capacity,
+            'pool_size': pool.size() if hasattr(pool, 'checkedout') else None,
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_time_ms': round(self.wait_time * 1000, 3),
+            'max_wait_ms': round(self.max_wait * 1000, 3),
+        }
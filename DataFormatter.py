@@ -1,12 +1,103 @@
 import json
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
 from LLMManager import LLMManager
 from graph_instructions import graph_instructions
+from ResultSet import to_columns
+from downsampling import DEFAULT_POINT_BUDGETS, lttb, bin_2d, reservoir_sample, split_budget
+from VisualizationRules import column_label
+from Telemetry import telemetry
+from offload import to_thread
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Columnar helpers
+# The formatters work on one NumPy array per result column: labels and x values are factorized once and the series
+# are filled by a single scatter into a (label x value) grid, so formatting is linear in the number of rows.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+def factorize(values):
+    """
+    Encodes an array as integer codes.
+
+    Returns:
+        tuple: The distinct values in order of first appearance and the code of every element.
+    """
+    keys = np.asarray(values, dtype=object)
+    distinct, first, inverse = np.unique(keys.astype(str), return_index=True, return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty(len(order), dtype=np.intp)
+    rank[order] = np.arange(len(order))
+    return keys[first[order]], rank[inverse.ravel()]
+
+
+def as_floats(values):
+    """Converts a column to float64; None becomes NaN."""
+    return np.asarray(values, dtype=object).astype(float)
+
+
+def as_strings(values):
+    return np.asarray(values, dtype=object).astype(str)
+
+
+def nullable(values):
+    """Converts a float array to a list with None in place of NaN (NaN is not valid JSON)."""
+    result = values.astype(object)
+    result[np.isnan(values)] = None
+    return result.tolist()
+
+
+def pivot(row_codes, column_codes, values, n_rows, n_columns):
+    """
+    Scatters values into an (n_rows x n_columns) float grid, NaN for empty cells.
+    When a cell occurs more than once the last value wins.
+    """
+    grid = np.full((n_rows, n_columns), np.nan)
+    grid[row_codes, column_codes] = values
+    return grid
+
+
+def plottable(x, y):
+    """Mask of the points where both coordinates are present."""
+    return ~(np.isnan(x) | np.isnan(y))
+
+
+def points(x, y, ids):
+    return [{"x": x_value, "y": y_value, "id": id_value}
+            for x_value, y_value, id_value in zip(x.tolist(), y.tolist(), ids.tolist())]
+
+
+def is_label(value):
+    """A label is a string that is neither a number nor a date (contains no '/')."""
+    return isinstance(value, str) and not value.replace(".", "").isdigit() and "/" not in value
+
+
+def split_label_column(columns):
+    """
+    Returns (labels, x, y) for three-column results: the first column holds the labels if all its values look like
+    labels, otherwise the second one does.
+    """
+    first, second, third = columns
+    if np.frompyfunc(is_label, 1, 1)(first).all():
+        return first, second, third
+    return second, first, third
 
 
 class DataFormatter:
-    def __init__(self):
-        self.llm_manager = LLMManager()
+    def __init__(self, llm_manager=None, point_budgets=None, scatter_method="bin", labels_from_names=True):
+        """
+        Args:
+            llm_manager (LLMManager): Used for axis labels and the chart types without a dedicated formatter.
+            point_budgets (dict): Maximum points per chart type ('line', 'scatter'), see
+                                  downsampling.DEFAULT_POINT_BUDGETS. Larger series are downsampled.
+            scatter_method (str): 'bin' (2-D binning, keeps outliers) or 'reservoir' (uniform sample).
+            labels_from_names (bool): Label the value axis with the column name or SQL alias ("total_sales" becomes
+                                      "Total Sales") and only ask the LLM for unnamed expressions.
+        """
+        self.llm_manager = llm_manager if llm_manager is not None else LLMManager()
+        self.point_budgets = {**DEFAULT_POINT_BUDGETS, **(point_budgets or {})}
+        self.scatter_method = scatter_method
+        self.labels_from_names = labels_from_names
 
     
     def format_data_for_visualization(self, state: dict) -> dict:
@@ -39,65 +130,107 @@ class DataFormatter:
         
         return self._format_other_visualizations(visualization, question, sql_query, results)
     
-    def _format_line_data(self, results, question):
+    async def aformat_data_for_visualization(self, state: dict) -> dict:
+        """Async variant of format_data_for_visualization, offloaded to a thread."""
+        return await to_thread(self.format_data_for_visualization, state)
+
+    @staticmethod
+    def _columns(results):
+        """
+        Returns the column names and the results as a list of NumPy object arrays, one per column. ResultSets are read
+        column by column, row dictionaries and tuples are transposed once.
+        """
         if isinstance(results, str):
             results = eval(results)
+        names, values = to_columns(results)
+        if not values:
+            raise ValueError("No results to format")
+        return names, [np.asarray(column_values, dtype=object) for column_values in values]
+
+    @staticmethod
+    def _sample(columns, n=2):
+        """Returns the first n rows as tuples (the data shown to the labeling prompts)."""
+        return list(zip(*(column[:n].tolist() for column in columns)))
+
+    def _label(self, name, prompt, question, columns) -> str:
+        """Returns the label of a value column: its name when that is informative, otherwise the LLM's."""
+        label = column_label(name) if self.labels_from_names else None
+        if label is not None:
+            telemetry.count("eda_chart_labels_total", method="name")
+            return label
+        telemetry.count("eda_chart_labels_total", method="llm")
+        return self.llm_manager.invoke(prompt, parser=None, task="label", question=question,
+                                       data=str(self._sample(columns))).strip()
 
-        if len(results[0]) == 2:
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Downsampling
+    # Line charts keep the x positions selected by LTTB on each series, scatter plots keep one point per 2-D bin (or a
+    # uniform sample). The payload carries a "meta" entry with the original and the returned point counts.
+    # -----------------------------------------------------------------------------------------------------------------------------
 
-            x_values = [str(row[0]) for row in results]
-            y_values = [float(row[1]) for row in results]
+    def _line_indices(self, grid):
+        """
+        Returns the x positions to keep for a (series x positions) grid: the union of the LTTB selections of every
+        series, each computed on the positions where that series has a value.
+        """
+        budget = self.point_budgets["line"]
+        if grid.shape[1] <= budget:
+            return np.arange(grid.shape[1]), None
+
+        threshold = max(3, budget // len(grid))
+        keep = []
+        for series in grid:
+            present = np.flatnonzero(~np.isnan(series))
+            keep.append(present[lttb(present.astype(float), series[present], threshold)])
+        return np.unique(np.concatenate(keep)), "lttb"
+
+    def _scatter_indices(self, x, y, budget):
+        if len(x) <= budget:
+            return np.arange(len(x)), None
+        if self.scatter_method == "reservoir":
+            return reservoir_sample(len(x), budget), "reservoir"
+        return bin_2d(x, y, budget), "bin"
+
+    @staticmethod
+    def _meta(original, returned, method):
+        return {"originalPointCount": int(original), "pointCount": int(returned), "downsampled": method is not None,
+                "method": method}
+
+    def _format_line_data(self, results, question):
+        names, columns = self._columns(results)
+
+        if len(columns) == 2:
+
+            y = as_floats(columns[1])
+            keep, method = self._line_indices(y[np.newaxis, :])
+            x_values = as_strings(columns[0])[keep].tolist()
+            y_values = nullable(y[keep])
 
             # Use LLM to get a relevant label
             prompt = ChatPromptTemplate.from_messages([
                 ("system", "You are a data labeling expert. Given a question and some data, provide a concise and relevant label for the data series."),
                 ("human", "Question: {question}\n Data (first few rows): {data}\n\nProvide a concise label for this y axis. For example, if the data is the sales figures over time, the label could be 'Sales'. If the data is the population growth, the label could be 'Population'. If the data is the revenue trend, the label could be 'Revenue'."),
             ])
-            label = self.llm_manager.invoke(prompt, parser=None , question=question, data=str(results[:2]))
+            label = self._label(names[1], prompt, question, columns)
 
             formatted_data = {
                 "xValues": x_values,
                 "yValues": [
                     {
                         "data": y_values,
-                        "label": label.strip()
+                        "label": label
                     }
-                ]
+                ],
+                "meta": self._meta(len(y), len(keep), method)
             }
-        elif len(results[0]) == 3:
-
-            # Group data by label
-            data_by_label = {}
-            x_values = []
+        elif len(columns) == 3:
 
-            # Get a list of unique labels
-            labels = list(set(item2 for item1, item2, item3 in results 
-                              if isinstance(item2, str) and not item2.replace(".", "").isdigit() and "/" not in item2))
-            
-            # If labels are not in the second position, check the first position
-            if not labels:
-                labels = list(set(item1 for item1, item2, item3 in results 
-                                  if isinstance(item1, str) and not item1.replace(".", "").isdigit() and "/" not in item1))
-
-            for item1, item2, item3 in results:
-                # Determine which item is the label (string not convertible to float and not containing "/")
-                if isinstance(item1, str) and not item1.replace(".", "").isdigit() and "/" not in item1:
-                    label, x, y = item1, item2, item3
-                else:
-                    x, label, y = item1, item2, item3
-                    
-
-                if str(x) not in x_values:
-                    x_values.append(str(x))
-                if label not in data_by_label:
-                    data_by_label[label] = []
-                data_by_label[label].append(float(y))
-                print(labels)
-                for other_label in labels:
-                    if other_label != label:
-                        if other_label not in data_by_label:
-                            data_by_label[other_label] = []
-                        data_by_label[other_label].append(None)
+            # One series per label, one point per x value; cells without a row stay None
+            labels, x, y = split_label_column(columns)
+            label_keys, label_codes = factorize(labels)
+            x_keys, x_codes = factorize(as_strings(x))
+            grid = pivot(label_codes, x_codes, as_floats(y), len(label_keys), len(x_keys))
+            keep, method = self._line_indices(grid)
 
             # Create yValues array
             y_values = [
@@ -105,13 +238,14 @@ class DataFormatter:
                     "data": data,
                     "label": label
                 }
-                for label, data in data_by_label.items()
+                for label, data in zip(label_keys.tolist(), nullable(grid[:, keep]))
             ]
 
             formatted_data = {
-                "xValues": x_values,
+                "xValues": x_keys[keep].tolist(),
                 "yValues": y_values,
-                "yAxisLabel": ""
+                "yAxisLabel": "",
+                "meta": self._meta(len(x_keys), len(keep), method)
             }
 
             # Use LLM to get a relevant label for the y-axis
@@ -119,44 +253,55 @@ class DataFormatter:
                 ("system", "You are a data labeling expert. Given a question and some data, provide a concise and relevant label for the y-axis."),
                 ("human", "Question: {question}\n Data (first few rows): {data}\n\nProvide a concise label for the y-axis. For example, if the data represents sales figures over time for different categories, the label could be 'Sales'. If it's about population growth for different groups, it could be 'Population'."),
             ])
-            y_axis_label = self.llm_manager.invoke(prompt, parser=None ,question=question, data=str(results[:2]))
-
             # Add the y-axis label to the formatted data
-            formatted_data["yAxisLabel"] = y_axis_label.strip()
+            formatted_data["yAxisLabel"] = self._label(names[2], prompt, question, columns)
+        else:
+            raise ValueError("Unexpected data format in results")
 
         return {"formatted_data_for_visualization": formatted_data}
 
     def _format_scatter_data(self, results):
-        if isinstance(results, str):
-            results = eval(results)
+        _, columns = self._columns(results)
 
         formatted_data = {"series": []}
         
-        if len(results[0]) == 2:
+        if len(columns) == 2:
+            x, y = as_floats(columns[0]), as_floats(columns[1])
+            keep = plottable(x, y)
+            x, y = x[keep], y[keep]
+            sample, method = self._scatter_indices(x, y, self.point_budgets["scatter"])
             formatted_data["series"].append({
-                "data": [
-                    {"x": float(x), "y": float(y), "id": i+1}
-                    for i, (x, y) in enumerate(results)
-                ],
+                "data": points(x[sample], y[sample], sample + 1),
                 "label": "Data Points"
             })
-        elif len(results[0]) == 3:
-            entities = {}
-            for item1, item2, item3 in results:
-                # Determine which item is the label (string not convertible to float and not containing "/")
-                if isinstance(item1, str) and not item1.replace(".", "").isdigit() and "/" not in item1:
-                    label, x, y = item1, item2, item3
-                else:
-                    x, label, y = item1, item2, item3
-                if label not in entities:
-                    entities[label] = []
-                entities[label].append({"x": float(x), "y": float(y), "id": len(entities[label])+1})
-            
-            for label, data in entities.items():
+            formatted_data["meta"] = self._meta(len(x), len(sample), method)
+        elif len(columns) == 3:
+            labels, x, y = split_label_column(columns)
+            x, y = as_floats(x), as_floats(y)
+            keep = plottable(x, y)
+            label_keys, label_codes = factorize(labels[keep])
+            x, y = x[keep], y[keep]
+
+            # Sort the rows by label once (stable, so each series keeps the result order) and cut it into series.
+            # The point budget is shared between the series in proportion to their size, see split_budget.
+            order = np.argsort(label_codes, kind='stable')
+            counts = np.bincount(label_codes, minlength=len(label_keys))
+            x, y = x[order], y[order]
+            shares = split_budget(counts, self.point_budgets["scatter"])
+            total, method = 0, None
+
+            start = 0
+            for label, count, share in zip(label_keys.tolist(), counts.tolist(), shares.tolist()):
+                series_x, series_y = x[start:start + count], y[start:start + count]
+                sample, series_method = self._scatter_indices(series_x, series_y, share)
                 formatted_data["series"].append({
-                    "data": data,
+                    "data": points(series_x[sample], series_y[sample], sample + 1),
                     "label": label
                 })
+                total += len(sample)
+                method = method or series_method
+                start += count
+            formatted_data["meta"] = self._meta(len(order), total, method)
         else:
             raise ValueError("Unexpected data format in results")                
 
@@ -164,31 +309,28 @@ class DataFormatter:
 
 
     def _format_bar_data(self, results, question):
-        if isinstance(results, str):
-            results = eval(results)
+        names, columns = self._columns(results)
 
-        if len(results[0]) == 2:
+        if len(columns) == 2:
             # Simple bar chart with one series
-            labels = [str(row[0]) for row in results]
-            data = [float(row[1]) for row in results]
+            labels = as_strings(columns[0]).tolist()
+            data = nullable(as_floats(columns[1]))
             
             # Use LLM to get a relevant label
             prompt = ChatPromptTemplate.from_messages([
                 ("system", "You are a data labeling expert. Given a question and some data, provide a concise and relevant label for the data series."),
                 ("human", "Question: {question}\nData (first few rows): {data}\n\nProvide a concise label for this y axis. For example, if the data is the sales figures for products, the label could be 'Sales'. If the data is the population of cities, the label could be 'Population'. If the data is the revenue by region, the label could be 'Revenue'."),
             ])
-            label = self.llm_manager.invoke(prompt, parser=None,question=question, data=str(results[:2]))
+            label = self._label(names[1], prompt, question, columns)
             
             values = [{"data": data, "label": label}]
-        elif len(results[0]) == 3:
-            # Grouped bar chart with multiple series
-            categories = set(row[1] for row in results)
-            labels = list(categories)
-            entities = set(row[0] for row in results)
-            values = []
-            for entity in entities:
-                entity_data = [float(row[2]) for row in results if row[0] == entity]
-                values.append({"data": entity_data, "label": str(entity)})
+        elif len(columns) == 3:
+            # Grouped bar chart with one series per entity (first column) over the categories (second column)
+            entity_keys, entity_codes = factorize(columns[0])
+            category_keys, category_codes = factorize(columns[1])
+            grid = pivot(entity_codes, category_codes, as_floats(columns[2]), len(entity_keys), len(category_keys))
+            labels = category_keys.tolist()
+            values = [{"data": data, "label": str(entity)} for entity, data in zip(entity_keys.tolist(), nullable(grid))]
         else:
             raise ValueError("Unexpected data format in results")
 
@@ -205,7 +347,7 @@ class DataFormatter:
             ("system", "You are a Data expert who formats data according to the required needs. You are given the question asked by the user, it's sql query, the result of the query and the format you need to format it in."),
             ("human", 'For the given question: {question}\n\nSQL query: {sql_query}\n\Result: {results}\n\nUse the following example to structure the data: {instructions}. Just give the json string. Do not format it'),
         ])
-        response = self.llm_manager.invoke(prompt,parser=None, question=question, sql_query=sql_query, results=results, instructions=instructions)
+        response = self.llm_manager.invoke(prompt, parser=None, task="visualize", question=question, sql_query=sql_query, results=results, instructions=instructions)
             
         try:
             formatted_data_for_visualization = json.loads(response)
@@ -10,54 +10,189 @@ def session(engine):
     session.rollback()
 """
 
-from sqlalchemy import create_engine, inspect
-from sqlalchemy.orm import  declarative_base , Session
+import threading
+from sqlalchemy import inspect
 from sqlalchemy import text
+from ConnectionPool import PoolMetrics
+from QueryGuard import QueryGuard, QueryError
 from State import column , foreign_relation
-import networkx as nx
+from SchemaCache import SchemaCache
+from ValueIndex import ValueIndex
+from SQLValidator import SQLValidator
+from ResultSet import ColumnBatch, ResultSet
+from ResultCache import DataVersions, ResultCache
+from Telemetry import telemetry
+from offload import to_thread
+import time
 
 class DatabaseManager:
     # -----------------------------------------------------------------------------------------------------------------------------
     # Setup SQLAlchemy
     # -----------------------------------------------------------------------------------------------------------------------------
 
-    def __init__(self, db_url="sqlite:///chinook.db"):
+    def __init__(self, db_url="sqlite:///chinook.db", cache_dir=".eda_cache", validation_mode="static",
+                 batch_size=5000, max_rows=100000, max_bytes=64 * 1024 * 1024,
+                 pool_size=5, max_overflow=10, pool_recycle=1800, pool_timeout=30.0, read_replica_url=None, echo=False,
+                 max_query_cost=None, on_cost_exceeded="limit", guard_row_limit=1000, statement_timeout=30.0,
+                 result_cache_bytes=64 * 1024 * 1024, result_cache_spill=False, result_cache_stale=0.0,
+                 result_cache_ttl=None, data_version_hook=None, data_version_interval=1.0):
+        """
+        Args:
+            pool_size, max_overflow, pool_recycle, pool_timeout: Sizing of the connection pool of every engine.
+            read_replica_url (str): Optional replica that serves execute_query/stream_query. Query validation,
+                                    schema introspection and value indexing always use the primary, so a query is
+                                    checked against the schema it was written for even while the replica lags.
+            echo (bool): Log every statement (SQLAlchemy echo), off by default as it is costly on the hot path.
+            max_query_cost, on_cost_exceeded, guard_row_limit, statement_timeout: Guardrails of execute_query,
+                                    see QueryGuard.
+            result_cache_bytes (int): Memory budget of the result cache of execute_query, 0 disables the cache.
+            result_cache_spill (bool): Spill evicted results to cache_dir instead of dropping them.
+            result_cache_stale (float): Stale-while-revalidate window in seconds, see ResultCache.
+            result_cache_ttl (float): Maximum age of a cached result.
+            data_version_hook (callable): hook(tables) -> {table: token} used instead of the built-in data versions.
+            data_version_interval (float): Seconds the data versions are trusted before they are read again.
+        """
         self.db_url = db_url
+        self.read_replica_url = read_replica_url
         self.graph = None
+        self._inspector = None
+        self.validation_mode = validation_mode  # "static" (never runs the query) or "execute" (runs it)
+        # Limits of execute_query/stream_query, results beyond them are truncated
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
         try:
-            self.engine = create_engine(self.db_url,echo=True)
-            self.Session = Session(bind=self.engine)
-            self.Base = declarative_base()
-            self.inspector = inspect(self.engine)
-            self.graph = nx.DiGraph()
+            # No shared Session: every call borrows its own pooled connection (see connect())
+            pool_kwargs = dict(pool_size=pool_size, max_overflow=max_overflow, pool_recycle=pool_recycle,
+                               pool_timeout=pool_timeout)
+            self.engine, self.primary_pool = PoolMetrics.create_engine(self.db_url, echo=echo, **pool_kwargs)
+            if read_replica_url:
+                self.read_engine, self.replica_pool = PoolMetrics.create_engine(read_replica_url, echo=echo,
+                                                                                **pool_kwargs)
+            else:
+                self.read_engine, self.replica_pool = self.engine, None
+            self.schema_cache = SchemaCache(self.engine, self._introspect_schema, cache_dir=cache_dir)
+            self.value_index = ValueIndex(self.engine, cache_dir=cache_dir)
+            self.query_guard = QueryGuard(self.read_engine, max_cost=max_query_cost, on_exceed=on_cost_exceeded,
+                                          row_limit=guard_row_limit, timeout=statement_timeout)
+            self.validator = SQLValidator(self.engine, lambda: self.get_schema()['schema'], connect=self.connect)
+            # Results are read from the read engine, so their data versions are too
+            self.result_cache = None
+            if result_cache_bytes:
+                namespace = f"{self.read_engine.url.render_as_string(hide_password=True)}:{max_rows}:{max_bytes}"
+                self.result_cache = ResultCache(
+                    DataVersions(self.read_engine, hook=data_version_hook, check_interval=data_version_interval),
+                    namespace=namespace, max_bytes=result_cache_bytes,
+                    spill_dir=cache_dir if result_cache_spill else None, stale_while_revalidate=result_cache_stale,
+                    ttl=result_cache_ttl, fold_case=self.read_engine.dialect.name != "mysql")
         except Exception as e:
             raise Exception(f"Error connecting to database: {e}")
         
+    @property
+    def inspector(self):
+        """A catalog inspector of the primary engine. Created on first use, as creating one connects to the database."""
+        if self._inspector is None:
+            self._inspector = inspect(self.engine)
+        return self._inspector
+
     def get_db_type(self):
         return self.engine.dialect.name
+
+    def connect(self, read_only=False):
+        """
+        Returns a context manager that borrows a pooled connection for one call.
+        Read-only work goes to the read replica when one is configured.
+        """
+        pool = self.replica_pool if read_only and self.replica_pool is not None else self.primary_pool
+        return pool.connect()
+
+    def pool_metrics(self):
+        """
+        Returns the connection pool counters of the primary (and replica) engine: connections checked out, total
+        checkouts, waits on an exhausted pool and the time spent waiting.
+        """
+        metrics = {'primary': self.primary_pool.snapshot()}
+        if self.replica_pool is not None:
+            metrics['replica'] = self.replica_pool.snapshot()
+        return metrics
     
+    def memory_bytes(self):
+        """
+        Returns the approximate memory held for this database: cached results, the schema snapshot and an in-memory
+        value index. Connections and the SQLAlchemy engine itself are not counted.
+        """
+        size = self.schema_cache.memory_bytes() + self.value_index.memory_bytes()
+        if self.result_cache is not None:
+            size += self.result_cache.memory_bytes
+        return size
+
+    def close(self):
+        """
+        Closes every connection of this manager: both connection pools, the value index and the result cache.
+        The manager must not be used afterwards.
+        """
+        if self.result_cache is not None:
+            self.result_cache.close()
+        self.value_index.close()
+        if self.read_engine is not self.engine:
+            self.read_engine.dispose()
+        self.engine.dispose()
+        self._inspector = None
+
     def get_schema(self):
         """
-        Extracts the database schema, including table names, column names,
+        Returns the database schema, including table names, column names,
         data types, primary keys, and foreign keys.
 
+        The schema is served from the schema cache and is only re-introspected
+        when the database fingerprint changes or refresh_schema() is called.
+
         Returns:
             dict: A dictionary representing the database schema.  The keys are
                   table names, and the values are dictionaries containing
                   column information and foreign key relationships.
         """
+        return {'schema': self.schema_cache.get_schema()}
+
+    def get_schema_graph(self):
+        """
+        Returns the cached directed graph (NetworkX) of tables, columns and foreign key relationships.
+        """
+        return {'graph': self.schema_cache.get_graph()}
+
+    def refresh_schema(self):
+        """
+        Forces a re-introspection of the database and replaces the cached schema and schema graph.
+        """
+        self.schema_cache.refresh()
+
+    def schema_fingerprint(self):
+        """
+        Returns the fingerprint of the cached schema snapshot.
+        """
+        return self.schema_cache.get()['fingerprint']
+
+    def _introspect_schema(self):
+        """
+        Extracts the database schema from the catalog and builds the schema graph from it.
+        Used as the loader of the schema cache, so it always reads the live catalog.
+
+        Returns:
+            tuple: The schema dictionary and the NetworkX graph built from it.
+        """
+        inspector = inspect(self.engine)  # a fresh inspector, the old one memoises catalog results
         schema = {}
 
-        for table_name in self.inspector.get_table_names():
+        for table_name in inspector.get_table_names():
             schema[table_name] = {
                 'columns': [],
-                'primary_key': self.inspector.get_pk_constraint(table_name),
+                'primary_key': inspector.get_pk_constraint(table_name),
                 'foreign_keys': []
             }
 
         # Stores the details of the columns in the table (Basically Summary of the column)
 
-            for columns in self.inspector.get_columns(table_name):
+            for columns in inspector.get_columns(table_name):
                 schema[table_name]['columns'].append(column(name = columns['name'],
                                                              type = str(columns['type']),
                                                              nullable = columns['nullable'],
@@ -66,22 +201,21 @@ class DatabaseManager:
 
         # Stores the foreign key relationships for the table with other tables
             
-            for fk in self.inspector.get_foreign_keys(table_name):
+            for fk in inspector.get_foreign_keys(table_name):
                 schema[table_name]['foreign_keys'].append(foreign_relation(constrained_column = fk['constrained_columns'],
                                                                           referenced_table = fk['referred_table'],
                                                                           referenced_column = fk['referred_columns']))
 
-        return {'schema':schema}
+        return schema, self._build_schema_graph(schema)
 
     # -----------------------------------------------------------------------------------------------------------------------------
     # Setup graph and extract the relationships between tables 
     # The graph is a directed graph which allows the llm to understand the relationships between tables better
     # -----------------------------------------------------------------------------------------------------------------------------
 
-    def get_schema_graph(self):
+    def _build_schema_graph(self, schema_dict):
+        import networkx as nx
         graph = nx.DiGraph()
-        schema_dict = self.get_schema() 
-        schema_dict = schema_dict['schema']
 
         for table_name, table_data in schema_dict.items():
             graph.add_node(table_name, type="table", **table_data)
@@ -96,34 +230,164 @@ class DatabaseManager:
                 graph.add_edge(table_name, fk.referenced_table, relationship="foreign_key",
                                 constrained_columns=fk.constrained_column,  # Store as list
                                 referred_columns=fk.referenced_column) 
-        return {'graph':graph}
+        return graph
+
+    def check_query(self, query):
+        """
+        Validates a query and reports how it was validated.
+
+        In "static" mode (the default) the query is never executed: it is checked against the cached schema and then
+        with the dialect's EXPLAIN, see SQLValidator. In "execute" mode the query is fully executed as before.
+
+        Returns:
+            dict: 'valid' (bool), 'message' (str), 'strategy' (str) and 'latency_ms' (float).
+        """
+        if self.validation_mode == "static":
+            return self.validator.validate(query)
+
+        start = time.perf_counter()
+        message, valid = self._execute_for_validation(query)
+        return {'valid': valid, 'message': message, 'strategy': "execute",
+                'latency_ms': (time.perf_counter() - start) * 1000}
 
     def validate_query(self,query):
+        result = self.check_query(query)
+        return result['message'], result['valid']
+
+    def _execute_for_validation(self, query):
         try:
-            with self.Session as session:
-                session.execute(text(query))
-                session.commit()
-                print("Query is valid")
+            with self.connect() as connection:
+                connection.execute(text(query))
+                connection.commit()
                 return "Query is valid", True
-            
+
         except Exception as e:
-            session.rollback()
             return str(e) , False
     
 
-    def execute_query(self,query):
+    def stream_query(self, query, batch_size=None, max_rows=None, max_bytes=None, cancel_event=None,
+                     guard_report=None):
+        """
+        Executes a read-only query with a server-side cursor and yields the result in fixed-size ColumnBatch objects.
+
+        Streaming stops once max_rows rows or roughly max_bytes bytes have been produced; the last batch then has
+        truncated=True. The limits default to the ones given to the DatabaseManager, None disables a limit.
+        The query first passes the cost check of the query guard and runs under its statement timeout. When the guard
+        added a LIMIT and the result reaches it, the last batch has truncated=True as well.
+
+        Args:
+            query (str): The SQL query.
+            batch_size (int): Number of rows per batch.
+            max_rows (int): Maximum number of rows to produce.
+            max_bytes (int): Approximate maximum size of the produced values.
+            cancel_event (threading.Event): Set it from another thread to interrupt the query.
+            guard_report (dict): Receives the 'action' and 'cost' of the query guard's check.
+
+        Yields:
+            ColumnBatch: The next batch of rows.
+
+        Raises:
+            QueryRejected, QueryTimeout, QueryCancelled: When the guard stops the query.
+        """
+        batch_size = batch_size or self.batch_size
+        max_rows = max_rows if max_rows is not None else self.max_rows
+        max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+
+        with self.connect(read_only=True) as connection, self.query_guard.bounded(connection, cancel_event):
+            checked = self.query_guard.check(connection, query)
+            if guard_report is not None:
+                guard_report.update(action=checked['action'], cost=checked['cost'])
+            guard_limit = None
+            if checked['action'] == "limit":
+                guard_limit = self.query_guard.row_limit
+                telemetry.event("query_limited", cost=checked['cost'], row_limit=guard_limit)
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+                text(checked['query']))
+            if not result.returns_rows:
+                return
+
+            columns = list(result.keys())
+            row_count = 0
+            byte_count = 0
+            for rows in result.partitions(batch_size):
+                batch = ColumnBatch.from_rows(columns, rows)
+
+                if max_rows is not None and row_count + batch.num_rows > max_rows:
+                    batch = batch.slice(max_rows - row_count)
+                    batch.truncated = True
+                row_count += batch.num_rows
+                if guard_limit is not None and row_count >= guard_limit:
+                    # The added LIMIT cut the result (or it happens to have exactly that many rows)
+                    batch.truncated = True
+
+                if max_bytes is not None:
+                    byte_count += self._estimate_bytes(batch)
+                    if byte_count > max_bytes:
+                        batch.truncated = True
+
+                yield batch
+                if batch.truncated:
+                    break
+            else:
+                if not row_count:
+                    # An empty result still carries its column names
+                    yield ColumnBatch.from_rows(columns, [])
+
+    @staticmethod
+    def _estimate_bytes(batch):
+        size = 0
+        for values in batch.data:
+            for value in values:
+                size += len(value) if isinstance(value, (str, bytes)) else 8
+        return size
+
+    def execute_query(self, query, cancel_event=None, use_cache=True):
+        """
+        Executes a read-only query and returns a ResultSet, a list-compatible sequence of row dictionaries backed by
+        the columnar batches of stream_query(). Check ResultSet.truncated to see whether a limit was hit.
+        The result is served from the result cache while the tables it reads are unchanged (use_cache=False runs the
+        query regardless). Cached ResultSets are shared between callers and must not be modified.
+
+        Failures are returned as {'error': message, 'error_type': type}, the type being 'cost_exceeded', 'timeout',
+        'cancelled' (see QueryGuard) or 'database'.
+        """
+        if use_cache and self.result_cache is not None:
+            return self.result_cache.fetch(query, lambda: self._execute(query, cancel_event))
+        return self._execute(query, cancel_event)
+
+    def _execute(self, query, cancel_event=None):
+        start = time.perf_counter()
         try:
-            with self.Session as session: # creating a Session instance
-                result = session.execute(text(query))
-                
-                if result.returns_rows:
-                    columns = result.keys()
-                    rows = result.fetchall()
-                    data = [dict(zip(columns, row)) for row in rows]
-                    session.commit()
-                    return data
-        
+            results = ResultSet()
+            guard_report = {}
+            for batch in self.stream_query(query, cancel_event=cancel_event, guard_report=guard_report):
+                results.append(batch)
+            results.guard_action = guard_report.get('action', "allow")
+            results.cost = guard_report.get('cost')
+            telemetry.record_query(time.perf_counter() - start, len(results), "ok", results.truncated,
+                                   guard_action=results.guard_action, cost=results.cost)
+            return results
+
+        except QueryError as e:
+            error = e.to_dict()
         except Exception as e:
-            return {'error': str(e)}
+            error = {'error': str(e), 'error_type': "database"}
+        telemetry.record_query(time.perf_counter() - start, 0, error['error_type'])
+        return error
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Async variants
+    # The sync drivers are offloaded to the default thread pool so that the event loop is never blocked on the database
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    async def avalidate_query(self, query):
+        return await to_thread(self.validate_query, query)
+
+    async def acheck_query(self, query):
+        return await to_thread(self.check_query, query)
 
-    
\ No newline at end of file
+    async def aexecute_query(self, query):
+        # Cancelling the awaiting task (e.g. a request timeout) interrupts the query running in the worker thread, and
+        # the cancellation only completes once the thread has let go of its connection
+        cancel_event = threading.Event()
+        return await to_thread(self.execute_query, query, cancel_event, on_cancel=cancel_event.set)
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from pydantic import BaseModel
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Response cache for LLMManager.invoke
+# An in-memory LRU tier sits in front of an on-disk SQLite tier. Entries are keyed on everything that determines the
+# response: model, temperature, rendered messages and the structured output schema.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+def make_cache_key(model, temperature, messages, parser=None) -> str:
+    """
+    Builds the cache key of an LLM call from the model settings, the rendered messages and the output schema.
+    """
+    if parser is None:
+        parser_schema = None
+    elif isinstance(parser, type) and issubclass(parser, BaseModel):
+        parser_schema = parser.model_json_schema()
+    else:
+        parser_schema = parser if isinstance(parser, dict) else repr(parser)
+
+    payload = {
+        'model': model,
+        'temperature': temperature,
+        'messages': [(message.type, message.content) for message in messages],
+        'parser': parser_schema,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two tier (memory LRU + SQLite on disk) cache of LLM responses with TTLs and size limits.
+
+    Structured responses are stored as JSON and rebuilt with the parser they were requested with, so a cached
+    ParsedQuestion comes back as a ParsedQuestion.
+
+    Attributes:
+        ttl (Optional[float]): Seconds an entry stays valid. None keeps entries until they are evicted.
+        max_memory_entries (int): Size of the in-memory LRU tier.
+        max_disk_entries (int): Size of the on-disk tier, least recently used entries are evicted first.
+        path (Optional[str]): Location of the SQLite file, None when the disk tier is disabled.
+    """
+
+    def __init__(self, cache_dir=None, ttl=7 * 24 * 3600, max_memory_entries=512, max_disk_entries=50000):
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.lock = threading.RLock()
+        self.memory = OrderedDict()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+        self.path = None
+        self.conn = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.path = os.path.join(cache_dir, "llm-cache.sqlite")
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                     key TEXT PRIMARY KEY, value TEXT, expires_at REAL, last_access REAL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+            self.conn.commit()
+
+    def get(self, key, parser=None):
+        """
+        Returns the cached response for the key, or None on a miss.
+
+        Args:
+            key (str): The cache key, see make_cache_key().
+            parser: The structured output parser of the call, used to rebuild pydantic responses.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return self._decode(value, parser)
+                del self.memory[key]
+
+            if self.conn is not None:
+                row = self.conn.execute("SELECT value, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at is None or expires_at > now:
+                        self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                        self.conn.commit()
+                        self._remember(key, value, expires_at)
+                        self.stats['disk_hits'] += 1
+                        return self._decode(value, parser)
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.conn.commit()
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, response):
+        """
+        Stores a response (a string, a pydantic model or a JSON-serializable structure) under the key.
+        """
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl is not None else None
+        value = self._encode(response)
+
+        with self.lock:
+            self._remember(key, value, expires_at)
+            self.stats['writes'] += 1
+
+            if self.conn is not None:
+                self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, value, expires_at, now))
+                count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_disk_entries:
+                    self.conn.execute("""DELETE FROM responses WHERE key IN
+                                         (SELECT key FROM responses ORDER BY last_access LIMIT ?)""",
+                                      (count - self.max_disk_entries,))
+                    self.stats['evictions'] += count - self.max_disk_entries
+                self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM responses")
+                self.conn.commit()
+
+    def _remember(self, key, value, expires_at):
+        self.memory[key] = (value, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    @staticmethod
+    def _encode(response):
+        if isinstance(response, BaseModel):
+            return json.dumps({'kind': 'pydantic', 'value': response.model_dump(mode="json")})
+        if isinstance(response, str):
+            return json.dumps({'kind': 'text', 'value': response})
+        return json.dumps({'kind': 'json', 'value': response})
+
+    @staticmethod
+    def _decode(value, parser):
+        entry = json.loads(value)
+        if entry['kind'] == 'pydantic' and isinstance(parser, type) and issubclass(parser, BaseModel):
+            return parser.model_validate(entry['value'])
+        return entry['value']
@@ -1,19 +1,43 @@
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from dotenv import load_dotenv
+from LLMCache import LLMResponseCache, make_cache_key
+from ModelRouter import ModelRouter
+from Telemetry import telemetry
+from token_counter import count_tokens
 import os
+import time
 
 os.getenv("OPENAI_API_KEY")
 class LLMManager:
-    def __init__(self):
-        self.llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+    def __init__(self, cache_dir=".eda_cache", llm=None, router=None):
+        # llm can be any chat model with the same interface, e.g. StubLLM.StubChatModel for local runs.
+        # Each call names a task class that the router maps to a model, see ModelRouter (EDA_MODEL_ROUTES).
+        self.router = router if router is not None else ModelRouter.from_env(llm=llm)
+        self.cache = LLMResponseCache(cache_dir=cache_dir)
 
-    def invoke(self, prompt: ChatPromptTemplate, parser=None , **kwargs) -> str:
+    @property
+    def llm(self):
+        """The chat model of the default route."""
+        return self.router.default.chat_model()
+
+    @llm.setter
+    def llm(self, llm):
+        self.router.default.llm = llm
+
+    def _cache_key(self, task, messages, parser):
+        # Keyed on the primary model of the route, also when the answer came from its fallback
+        route = self.router.route(task)
+        return make_cache_key(route.name, route.temperature, messages, parser)
+
+    def invoke(self, prompt: ChatPromptTemplate, parser=None , use_cache=True, task=None, **kwargs) -> str:
         """
         Invokes the language model with the given prompt and optional parser.
         Args:
             prompt (ChatPromptTemplate): The prompt template to format and send to the language model.
             parser: An optional parser for structured output. If None, regular text output is used.
+            use_cache (bool): If False the response cache is bypassed (neither read nor written) for this call.
+            task (str): The task class of the call ('parse', 'generate_sql', 'fix', 'label', 'summarize' or
+                        'visualize'), which selects the model route. None uses the default route.
             **kwargs: Additional keyword arguments to format the prompt.
         Returns:
             str: The response from the language model. If a parser is provided, the structured output is returned.
@@ -22,17 +46,64 @@ class LLMManager:
             Exception: If an error occurs during the invocation of the language model.
         """
         messages = prompt.format_messages(**kwargs)
+        start = time.perf_counter()
+
+        if use_cache:
+            key = self._cache_key(task, messages, parser)
+            cached = self.cache.get(key, parser)
+            if cached is not None:
+                self._record(task, self.router.route(task), messages, None, cached, start, cache_hit=True)
+                return cached
+
         try:
-            if parser is not None:
-                # Use structured output with the provided parser
-                new_llm = self.llm.with_structured_output(parser)
-                response = new_llm.invoke(messages)
-                return response
-            else:
-                # Use regular text output
-                response = self.llm.invoke(messages)
-                return response.content
-                
+            message, response, route = self.router.call(task, messages, parser)
+
         except Exception as e:
             raise Exception(f"Error during LLM invocation: {e}")
-    
\ No newline at end of file
+
+        self._record(task, route, messages, message, response, start, cache_hit=False)
+        if use_cache and response is not None:
+            self.cache.put(key, response)
+        return response
+
+    async def ainvoke(self, prompt: ChatPromptTemplate, parser=None , use_cache=True, task=None, **kwargs) -> str:
+        """
+        Async variant of invoke(). Awaits the language model instead of blocking the calling thread,
+        so one worker can keep many prompts in flight. Takes the same arguments and shares the response cache.
+        """
+        messages = prompt.format_messages(**kwargs)
+        start = time.perf_counter()
+
+        if use_cache:
+            key = self._cache_key(task, messages, parser)
+            cached = self.cache.get(key, parser)
+            if cached is not None:
+                self._record(task, self.router.route(task), messages, None, cached, start, cache_hit=True)
+                return cached
+
+        try:
+            message, response, route = await self.router.acall(task, messages, parser)
+
+        except Exception as e:
+            raise Exception(f"Error during LLM invocation: {e}")
+
+        self._record(task, route, messages, message, response, start, cache_hit=False)
+        if use_cache and response is not None:
+            self.cache.put(key, response)
+        return response
+
+    def _record(self, task, route, messages, message, response, start, cache_hit):
+        """
+        Reports the call to the telemetry. Token counts come from the provider's usage metadata when the response
+        carries it, otherwise they are counted with token_counter.
+        """
+        usage = getattr(message, "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens")
+        if prompt_tokens is None:
+            prompt_tokens = count_tokens("\n".join(str(m.content) for m in messages))
+        completion_tokens = usage.get("output_tokens")
+        if completion_tokens is None:
+            completion_tokens = count_tokens(response.model_dump_json() if hasattr(response, "model_dump_json")
+                                             else response)
+        telemetry.record_llm(route.name, time.perf_counter() - start, prompt_tokens, completion_tokens, cache_hit,
+                             task=task or "default")
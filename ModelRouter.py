@@ -0,0 +1,265 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from Telemetry import telemetry
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Tiered model routing
+# Every LLM call names a task class. The router maps the task to a route: a model and endpoint (any OpenAI-compatible
+# base_url, or a chat model object such as StubLLM.StubChatModel) with its own timeout, max tokens and retry policy.
+# A route with a latency SLO and a fallback route hedges: when the primary has not answered within the SLO the
+# fallback is started too and the first answer wins. A failing primary also falls back.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+TASKS = ("parse", "generate_sql", "fix", "label", "summarize", "visualize")
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+
+class ModelRoute:
+    """
+    A model endpoint and the call policy used for it.
+
+    Attributes:
+        model (str): Model name sent to the endpoint.
+        base_url (Optional[str]): OpenAI-compatible endpoint, None for the OpenAI API. Local servers (vLLM, llama.cpp,
+                                  Ollama, ...) work as long as they speak the chat completions API.
+        api_key (Optional[str]): Key for the endpoint, OPENAI_API_KEY when None.
+        temperature (float): Sampling temperature.
+        timeout (Optional[float]): Seconds one attempt may take.
+        max_tokens (Optional[int]): Completion token limit.
+        max_retries (int): Attempts made after the first one fails, waiting retry_backoff * 2 ** n seconds in between.
+        latency_slo (Optional[float]): Seconds after which the fallback route is started as well.
+        fallback (Optional[ModelRoute]): Route used when this one is too slow or fails.
+        llm: A ready chat model (invoke, ainvoke, with_structured_output) used instead of building a ChatOpenAI.
+             The timeout of such a model is only enforced on async calls.
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, base_url=None, api_key=None, temperature=0, timeout=60.0,
+                 max_tokens=None, max_retries=2, retry_backoff=0.5, latency_slo=None, fallback=None, llm=None):
+        self.model = model
+        self.base_url = base_url
+        self.api_key = api_key
+        self.temperature = temperature
+        self.timeout = timeout
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.latency_slo = latency_slo
+        self.fallback = fallback
+        self.llm = llm
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, base=None):
+        """
+        Builds a route from a dict of the constructor arguments. Missing settings are taken from base (another route);
+        'fallback' may itself be such a dict.
+        """
+        settings = {}
+        if base is not None:
+            settings = {name: getattr(base, name) for name in ("model", "base_url", "api_key", "temperature",
+                                                                "timeout", "max_tokens", "max_retries",
+                                                                "retry_backoff")}
+        settings.update({name: value for name, value in config.items() if name != "fallback"})
+        route = cls(**settings)
+        if config.get("fallback"):
+            route.fallback = cls.from_config(config["fallback"], base=route)
+        return route
+
+    @property
+    def name(self) -> str:
+        return getattr(self.llm, "model_name", None) or self.model
+
+    def chat_model(self):
+        """Returns the chat model of the route, building the ChatOpenAI client on first use."""
+        if self.llm is None:
+            with self.lock:
+                if self.llm is None:
+                    from langchain_openai import ChatOpenAI
+                    # Retries are made by the router so that they follow the route's policy
+                    self.llm = ChatOpenAI(model=self.model, temperature=self.temperature, base_url=self.base_url,
+                                          api_key=self.api_key, timeout=self.timeout, max_tokens=self.max_tokens,
+                                          max_retries=0)
+        return self.llm
+
+
+class ModelRouter:
+    """
+    Maps task classes to routes and performs the calls.
+
+    Attributes:
+        default (ModelRoute): Used for tasks without a route of their own (and for calls without a task).
+        routes (dict): Task class to ModelRoute.
+    """
+
+    def __init__(self, default=None, routes=None, hedge_workers=16):
+        self.default = default if default is not None else ModelRoute()
+        self.routes = dict(routes or {})
+        self.hedge_workers = hedge_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, llm=None):
+        """
+        Builds a router from a config such as
+            {"default": {"model": "gpt-4o-mini"},
+             "routes": {"generate_sql": {"model": "gpt-4o", "latency_slo": 8, "fallback": {"model": "gpt-4o-mini"}},
+                        "label": {"base_url": "http://localhost:8080/v1", "model": "qwen2.5-1.5b", "max_tokens": 16}}}
+        Task routes inherit the settings of the default route that they do not override. llm, if given, is the chat
+        model of the default route.
+        """
+        default = ModelRoute.from_config(config.get("default", {}))
+        default.llm = llm if llm is not None else default.llm
+        routes = {}
+        for task, route_config in (config.get("routes") or {}).items():
+            if task not in TASKS:
+                raise ValueError(f"Unknown task class {task!r}, expected one of {TASKS}")
+            routes[task] = ModelRoute.from_config(route_config, base=default)
+        return cls(default, routes)
+
+    @classmethod
+    def from_env(cls, llm=None):
+        """
+        Builds the router from EDA_MODEL_ROUTES (a JSON config as for from_config, or the path of a JSON file).
+        Without it every task uses one gpt-4o-mini route (or llm).
+        """
+        config = os.getenv("EDA_MODEL_ROUTES")
+        if not config:
+            return cls(ModelRoute(llm=llm))
+        if not config.lstrip().startswith("{"):
+            with open(config) as f:
+                config = f.read()
+        return cls.from_config(json.loads(config), llm=llm)
+
+    def route(self, task=None) -> ModelRoute:
+        return self.routes.get(task, self.default)
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Calls
+    # Each returns (message, response, route): the raw chat message (None for structured output), the parsed
+    # response and the route that answered
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def _call_once(route, messages, parser):
+        model = route.chat_model()
+        if parser is not None:
+            return None, model.with_structured_output(parser).invoke(messages), route
+        message = model.invoke(messages)
+        return message, message.content, route
+
+    @staticmethod
+    async def _acall_once(route, messages, parser):
+        model = route.chat_model()
+        if parser is not None:
+            return None, await model.with_structured_output(parser).ainvoke(messages), route
+        message = await model.ainvoke(messages)
+        return message, message.content, route
+
+    def _call_with_retries(self, route, messages, parser):
+        for attempt in range(route.max_retries + 1):
+            try:
+                return self._call_once(route, messages, parser)
+            except Exception:
+                if attempt == route.max_retries:
+                    raise
+                telemetry.count("eda_llm_retries_total", model=route.name)
+                time.sleep(route.retry_backoff * 2 ** attempt)
+
+    async def _acall_with_retries(self, route, messages, parser):
+        for attempt in range(route.max_retries + 1):
+            try:
+                return await asyncio.wait_for(self._acall_once(route, messages, parser), route.timeout)
+            except Exception:
+                if attempt == route.max_retries:
+                    raise
+                telemetry.count("eda_llm_retries_total", model=route.name)
+                await asyncio.sleep(route.retry_backoff * 2 ** attempt)
+
+    def _hedge_executor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.hedge_workers, thread_name_prefix="llm-hedge")
+        return self.executor
+
+    @staticmethod
+    def _fell_back(task, route, reason):
+        telemetry.count("eda_llm_fallbacks_total", task=task or "default", reason=reason)
+        telemetry.event("llm_fallback", task=task or "default", reason=reason, model=route.name,
+                        fallback=route.fallback.name)
+
+    def call(self, task, messages, parser=None):
+        """Sends the messages along the route of the task, with retries, hedging and fallback."""
+        route = self.route(task)
+        if route.fallback is None:
+            return self._call_with_retries(route, messages, parser)
+
+        if route.latency_slo is None:
+            try:
+                return self._call_with_retries(route, messages, parser)
+            except Exception:
+                self._fell_back(task, route, "error")
+                return self._call_with_retries(route.fallback, messages, parser)
+
+        executor = self._hedge_executor()
+        primary = executor.submit(contextvars.copy_context().run, self._call_with_retries, route, messages, parser)
+        try:
+            return primary.result(timeout=route.latency_slo)
+        except FutureTimeout:
+            self._fell_back(task, route, "slo")
+        except Exception:
+            self._fell_back(task, route, "error")
+            return self._call_with_retries(route.fallback, messages, parser)
+
+        # The primary keeps running; whichever answers first wins
+        secondary = executor.submit(contextvars.copy_context().run, self._call_with_retries, route.fallback,
+                                    messages, parser)
+        pending = {primary, secondary}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def acall(self, task, messages, parser=None):
+        """Async variant of call(); the losing request of a hedge is cancelled."""
+        route = self.route(task)
+        if route.fallback is None:
+            return await self._acall_with_retries(route, messages, parser)
+
+        primary = asyncio.ensure_future(self._acall_with_retries(route, messages, parser))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=route.latency_slo)
+            if primary in done:
+                pending = set()
+                if primary.exception() is None:
+                    return primary.result()
+                self._fell_back(task, route, "error")
+                return await self._acall_with_retries(route.fallback, messages, parser)
+
+            self._fell_back(task, route, "slo")
+            pending.add(asyncio.ensure_future(self._acall_with_retries(route.fallback, messages, parser)))
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Question-to-SQL plan cache
+# Stores the validated SQL and the chosen visualization of a question so that a repeated question can skip
+# parse_question, get_unique_nouns, generate_sql and validate_sql and go straight to execute_sql.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question so that trivially different spellings share a plan
+    ("  What are the Top artists? " -> "what are the top artists").
+    """
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?.! ")
+
+
+class PlanCache:
+    """
+    Persistent cache of workflow plans keyed on the normalized question and the schema fingerprint.
+
+    A plan holds the validated SQL query, the chosen visualization with its reason and the shape of the result
+    (column names) the visualization was chosen for. Pinned plans are never evicted by the size limit, but every plan
+    is dropped once the schema fingerprint it was created under is no longer current.
+
+    Attributes:
+        max_entries (int): Maximum number of unpinned plans, least recently used plans are evicted first.
+        path (str): Location of the SQLite file, ":memory:" when no cache directory is given. The file name carries
+                    a hash of the database URL: plans under another fingerprint are dropped, so databases sharing a
+                    cache directory must not share a file.
+    """
+
+    def __init__(self, cache_dir=None, max_entries=5000, database=""):
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.current_fingerprint = None
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'invalidations': 0}
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            key = hashlib.sha256(database.encode()).hexdigest()[:16]
+            self.path = os.path.join(cache_dir, f"plan-cache-{key}.sqlite")
+        else:
+            self.path = ":memory:"
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS plans (
+                                 key TEXT PRIMARY KEY, question TEXT, fingerprint TEXT, sql_query TEXT,
+                                 visualization TEXT, visualization_reason TEXT, result_columns TEXT,
+                                 pinned INTEGER DEFAULT 0, hits INTEGER DEFAULT 0, created_at REAL, last_access REAL)""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS plans_last_access ON plans (last_access)")
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(question, fingerprint):
+        return hashlib.sha256(f"{fingerprint}\x00{normalize_question(question)}".encode()).hexdigest()
+
+    def get(self, question, fingerprint):
+        """
+        Returns the plan stored for the question under the given schema fingerprint, or None on a miss.
+
+        Returns:
+            dict: The keys 'sql_query', 'visualization', 'visualization_reason' and 'result_columns'.
+        """
+        with self.lock:
+            self.invalidate_stale(fingerprint)
+            row = self.conn.execute("""SELECT sql_query, visualization, visualization_reason, result_columns
+                                       FROM plans WHERE key = ?""", (self.make_key(question, fingerprint),)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+
+            self.conn.execute("UPDATE plans SET hits = hits + 1, last_access = ? WHERE key = ?",
+                              (time.time(), self.make_key(question, fingerprint)))
+            self.conn.commit()
+            self.stats['hits'] += 1
+            return {
+                'sql_query': row[0],
+                'visualization': row[1],
+                'visualization_reason': row[2],
+                'result_columns': json.loads(row[3]),
+            }
+
+    def put(self, question, fingerprint, sql_query, visualization, visualization_reason, result_columns):
+        """
+        Stores (or replaces) the plan of a question. The pinned flag of an existing plan is kept.
+        """
+        now = time.time()
+        key = self.make_key(question, fingerprint)
+        with self.lock:
+            self.conn.execute("""INSERT INTO plans (key, question, fingerprint, sql_query, visualization,
+                                                    visualization_reason, result_columns, created_at, last_access)
+                                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                 ON CONFLICT (key) DO UPDATE SET
+                                     sql_query = excluded.sql_query, visualization = excluded.visualization,
+                                     visualization_reason = excluded.visualization_reason,
+                                     result_columns = excluded.result_columns, last_access = excluded.last_access""",
+                              (key, normalize_question(question), fingerprint, sql_query, visualization,
+                               visualization_reason, json.dumps(list(result_columns)), now, now))
+            self.stats['writes'] += 1
+
+            count = self.conn.execute("SELECT COUNT(*) FROM plans WHERE pinned = 0").fetchone()[0]
+            if count > self.max_entries:
+                self.conn.execute("""DELETE FROM plans WHERE key IN
+                                     (SELECT key FROM plans WHERE pinned = 0 ORDER BY last_access LIMIT ?)""",
+                                  (count - self.max_entries,))
+                self.stats['evictions'] += count - self.max_entries
+            self.conn.commit()
+
+    def pin(self, question, fingerprint, pinned=True):
+        """
+        Protects the plan of a question from size-based eviction (or removes the protection with pinned=False).
+
+        Returns:
+            bool: True if a plan was found for the question.
+        """
+        with self.lock:
+            cursor = self.conn.execute("UPDATE plans SET pinned = ? WHERE key = ?",
+                                       (int(pinned), self.make_key(question, fingerprint)))
+            self.conn.commit()
+            return cursor.rowcount > 0
+
+    def evict(self, question):
+        """
+        Removes the plans of a question under every schema fingerprint, pinned or not.
+        """
+        with self.lock:
+            cursor = self.conn.execute("DELETE FROM plans WHERE question = ?", (normalize_question(question),))
+            self.conn.commit()
+            return cursor.rowcount
+
+    def invalidate_stale(self, fingerprint):
+        """
+        Drops every plan that was created under a different schema fingerprint.
+        Only runs a DELETE when the fingerprint differs from the last one seen.
+        """
+        with self.lock:
+            if fingerprint == self.current_fingerprint:
+                return 0
+            cursor = self.conn.execute("DELETE FROM plans WHERE fingerprint IS NOT ?", (fingerprint,))
+            self.conn.commit()
+            self.current_fingerprint = fingerprint
+            self.stats['invalidations'] += cursor.rowcount
+            return cursor.rowcount
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM plans")
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,273 @@
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+from SQLValidator import TOKEN_PATTERN, table_references, tokenize_sql
+
+logger = logging.getLogger("eda.query_guard")
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Query cost guardrails
+# Before a generated query runs, its plan is fetched with the dialect's EXPLAIN and turned into a cost estimate; queries
+# over the threshold are rejected or get a LIMIT. While it runs, the statement is bounded by a timeout (SQLite progress
+# handler, PostgreSQL statement_timeout, MySQL max_execution_time) and can be cancelled from another thread.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+# Estimated rows of a table whose size cannot be read
+DEFAULT_TABLE_ROWS = 1000
+
+# SQLite calls the progress handler every this many virtual machine instructions
+SQLITE_PROGRESS_STEPS = 10000
+
+
+class QueryError(Exception):
+    """
+    A query stopped by the guard. error_type is what the workflow routes on.
+    """
+    error_type = "database"
+
+    def to_dict(self):
+        return {'error': str(self), 'error_type': self.error_type}
+
+
+class QueryRejected(QueryError):
+    error_type = "cost_exceeded"
+
+
+class QueryTimeout(QueryError):
+    error_type = "timeout"
+
+
+class QueryCancelled(QueryError):
+    error_type = "cancelled"
+
+
+def strip_statement_end(query: str) -> str:
+    """
+    Removes what follows the last token of the statement: whitespace, semicolons and comments. A clause appended to
+    "SELECT ... -- note" would otherwise end up inside the comment.
+    """
+    end = 0
+    for match in TOKEN_PATTERN.finditer(query):
+        if match.lastgroup not in ("space", "comment") and match.group() != ";":
+            end = match.end()
+    return query[:end]
+
+
+def has_top_level_limit(query: str) -> bool:
+    """
+    Tells whether the outer query already bounds its rows: LIMIT, FETCH FIRST / NEXT, or TOP right after SELECT
+    (or SELECT DISTINCT). A column or alias named top does not count.
+    """
+    tokens = tokenize_sql(query)
+    words = [value.upper() if kind == "word" else None for kind, value in tokens]
+    depth = 0
+    for i, (kind, value) in enumerate(tokens):
+        if kind == "punct" and value == "(":
+            depth += 1
+        elif kind == "punct" and value == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word":
+            word = words[i]
+            if word == "LIMIT":
+                return True
+            if word == "FETCH" and i + 1 < len(tokens) and words[i + 1] in ("FIRST", "NEXT"):
+                return True
+            if word == "TOP" and i > 0 and (words[i - 1] == "SELECT"
+                                            or (words[i - 1] == "DISTINCT" and i > 1 and words[i - 2] == "SELECT")):
+                return True
+    return False
+
+
+class QueryGuard:
+    """
+    Estimates, bounds and cancels read-only queries.
+
+    Attributes:
+        engine: The SQLAlchemy engine the queries run on (its dialect selects the EXPLAIN and timeout mechanism).
+        max_cost (float): Estimated cost above which a query is limited or rejected, None disables the check.
+            On SQLite the cost is the estimated number of rows visited, on PostgreSQL/MySQL the planner's total cost.
+        on_exceed (str): 'limit' adds LIMIT row_limit to an expensive query without one (and rejects it otherwise),
+            'reject' always rejects it.
+        row_limit (int): The LIMIT added to expensive queries.
+        timeout (float): Seconds a statement may run, None disables the timeout.
+    """
+
+    def __init__(self, engine, max_cost=None, on_exceed="limit", row_limit=1000, timeout=30.0):
+        self.engine = engine
+        self.dialect = engine.dialect.name
+        self.max_cost = max_cost
+        self.on_exceed = on_exceed
+        self.row_limit = row_limit
+        self.timeout = timeout
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Cost estimation
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def estimate_cost(self, connection, query: str) -> float:
+        """
+        Returns the estimated cost of the query from its plan, or None for dialects without a supported EXPLAIN.
+        """
+        statement = strip_statement_end(query)
+        if self.dialect == "sqlite":
+            plan = connection.execute(text("EXPLAIN QUERY PLAN " + statement)).fetchall()
+            # The plan names tables by their alias in the query
+            aliases = {alias.lower(): name for name, alias in table_references(tokenize_sql(statement)) if alias}
+            return self._sqlite_cost(connection, plan, aliases)
+        if self.dialect == "postgresql":
+            plan = connection.execute(text("EXPLAIN (FORMAT JSON) " + statement)).scalar()
+            plan = json.loads(plan) if isinstance(plan, str) else plan
+            return float(plan[0]['Plan']['Total Cost'])
+        if self.dialect == "mysql":
+            plan = json.loads(connection.execute(text("EXPLAIN FORMAT=JSON " + statement)).scalar())
+            return float(plan['query_block'].get('cost_info', {}).get('query_cost', 0))
+        return None
+
+    def _sqlite_cost(self, connection, plan, aliases=None):
+        """
+        Turns an EXPLAIN QUERY PLAN into the estimated number of rows visited. Loops under the same parent are nested
+        (a join), so their factors multiply: a SCAN visits the whole table (or the whole of a covering index), an
+        index SEARCH about log2 of it. Temporary b-trees (ORDER BY, GROUP BY, DISTINCT) add a sort of the rows
+        produced so far.
+
+        Args:
+            aliases (dict): Lower-cased alias -> table name of the query, the plan refers to aliased tables by alias.
+        """
+        aliases = aliases or {}
+        loops = {}
+        sizes = {}
+        for node_id, parent, _, detail in plan:
+            words = detail.split()
+            if not words:
+                continue
+            factor = None
+            if detail.startswith("SCAN CONSTANT ROW"):
+                factor = 1
+            elif words[0] in ("SCAN", "SEARCH") and len(words) > 1:
+                # SQLite before 3.36 writes "SCAN TABLE name AS alias"
+                table = words[2] if words[1] == "TABLE" and len(words) > 2 else words[1]
+                table = aliases.get(table.lower(), table)
+                if table not in sizes:
+                    sizes[table] = self._sqlite_table_rows(connection, table)
+                rows = sizes[table]
+                factor = rows if words[0] == "SCAN" else math.log2(rows + 1) + 1
+            elif detail.startswith("USE TEMP B-TREE"):
+                produced = loops.get(parent, 1)
+                factor = math.log2(produced + 1) + 1
+            if factor is not None:
+                loops[parent] = loops.get(parent, 1) * factor
+        return float(sum(loops.values()))
+
+    @staticmethod
+    def _sqlite_table_rows(connection, table):
+        # The largest rowid is read from the end of the table b-tree, no scan needed
+        quoted = '"' + table.replace('"', '""') + '"'
+        try:
+            rows = connection.execute(text(f"SELECT MAX(rowid) FROM {quoted}")).scalar()
+        except Exception:
+            return DEFAULT_TABLE_ROWS  # views, CTEs and WITHOUT ROWID tables
+        return rows or 0
+
+    def check(self, connection, query: str) -> dict:
+        """
+        Applies the cost threshold to a query.
+
+        Returns:
+            dict: 'query' (the query to run, possibly with an added LIMIT), 'cost' (float or None) and 'action'
+                  ('allow' or 'limit').
+
+        Raises:
+            QueryRejected: If the query is over the threshold and cannot be limited.
+        """
+        if self.max_cost is None:
+            return {'query': query, 'cost': None, 'action': "allow"}
+
+        cost = self.estimate_cost(connection, query)
+        if cost is None or cost <= self.max_cost:
+            return {'query': query, 'cost': cost, 'action': "allow"}
+
+        if self.on_exceed == "limit" and not has_top_level_limit(query):
+            limited = f"{strip_statement_end(query)}\nLIMIT {int(self.row_limit)}"
+            return {'query': limited, 'cost': cost, 'action': "limit"}
+
+        raise QueryRejected(f"Query rejected: estimated cost {cost:,.0f} exceeds the limit of {self.max_cost:,.0f}")
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Timeouts and cancellation
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    @contextmanager
+    def bounded(self, connection, cancel_event=None):
+        """
+        Runs the block with the statement timeout applied to the connection. Setting cancel_event from another thread
+        interrupts the running statement. Database errors caused by the timeout or the cancellation are re-raised as
+        QueryTimeout / QueryCancelled.
+        """
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        cancel_event = cancel_event or threading.Event()
+        finished = threading.Event()
+        driver_connection = connection.connection.driver_connection
+        watcher = None
+
+        if self.dialect == "sqlite":
+            def progress():
+                return int(cancel_event.is_set() or (deadline is not None and time.monotonic() > deadline))
+            driver_connection.set_progress_handler(progress, SQLITE_PROGRESS_STEPS)
+        else:
+            if self.timeout and self.dialect == "postgresql":
+                connection.execute(text(f"SET LOCAL statement_timeout = {int(self.timeout * 1000)}"))
+            elif self.timeout and self.dialect == "mysql":
+                connection.execute(text(f"SET SESSION max_execution_time = {int(self.timeout * 1000)}"))
+            watcher = threading.Thread(target=self._watch, args=(connection, cancel_event, finished), daemon=True)
+            watcher.start()
+
+        try:
+            yield
+        except Exception as e:
+            if cancel_event.is_set():
+                raise QueryCancelled("Query cancelled") from e
+            if deadline is not None and time.monotonic() >= deadline or self._is_timeout_error(e):
+                raise QueryTimeout(f"Query exceeded the {self.timeout:g}s statement timeout") from e
+            raise
+        finally:
+            finished.set()
+            if self.dialect == "sqlite":
+                driver_connection.set_progress_handler(None, 0)
+            elif self.timeout and self.dialect == "mysql":
+                # The connection may just have been killed: a failing reset must not replace the error of the query,
+                # and the connection must not go back to the pool with the timeout still set
+                try:
+                    connection.execute(text("SET SESSION max_execution_time = 0"))
+                except Exception as e:
+                    logger.warning("Could not reset the statement timeout, discarding the connection: %s", e)
+                    connection.invalidate()
+            if watcher is not None:
+                watcher.join()
+
+    def _watch(self, connection, cancel_event, finished):
+        """
+        Waits for a cancellation while the statement runs and asks the server to abort it.
+        """
+        while not finished.is_set():
+            if cancel_event.wait(0.05):
+                try:
+                    if self.dialect == "postgresql":
+                        connection.connection.driver_connection.cancel()
+                    elif self.dialect == "mysql":
+                        thread_id = connection.connection.driver_connection.thread_id()
+                        with self.engine.connect() as killer:
+                            killer.execute(text(f"KILL QUERY {int(thread_id)}"))
+                except Exception as e:
+                    logger.warning("Could not cancel the running query: %s", e)
+                return
+
+    @staticmethod
+    def _is_timeout_error(error) -> bool:
+        message = str(error).lower()
+        return "statement timeout" in message or "max_execution_time" in message or "3024" in message
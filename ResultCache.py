@@ -0,0 +1,371 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import bindparam, text
+
+from ResultSet import ResultSet
+from SQLValidator import referenced_tables, tokenize_sql
+from Telemetry import telemetry
+
+logger = logging.getLogger("eda.result_cache")
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Query result cache
+# Results are keyed on the normalized SQL text and stored with a data-version token of every table the query reads. A
+# lookup compares the stored tokens with the current ones, so a cached result is served exactly as long as none of its
+# tables changed. Tokens come from cheap catalog reads (see DATA_VERSION_QUERIES) or from a user-supplied hook, and are
+# re-read at most every check_interval seconds.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+# Per-table change tokens. SQLite has none, its token is the database-wide PRAGMA data_version (see DataVersions).
+# Postgres: the cumulative tuple counters plus the relation file node, which changes on TRUNCATE. The counters are
+# flushed by the backends at the end of their transactions, with up to a second of delay.
+# MySQL: the last modification time and the row estimate of the table (kept in memory by InnoDB).
+DATA_VERSION_QUERIES = {
+    "postgresql": """
+        SELECT relname, concat_ws(':', n_tup_ins, n_tup_upd, n_tup_del, pg_relation_filenode(relid))
+        FROM pg_stat_all_tables
+        WHERE schemaname = current_schema() AND relname IN :tables
+    """,
+    "mysql": """
+        SELECT table_name, CONCAT_WS(':', COALESCE(update_time, create_time), table_rows)
+        FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name IN :tables
+    """,
+}
+
+# Queries calling these return something different on every run
+NONDETERMINISTIC = {"RANDOM", "RAND", "NOW", "CURRENT_TIMESTAMP", "CURRENT_DATE", "CURRENT_TIME", "LOCALTIME",
+                    "LOCALTIMESTAMP", "SYSDATE", "UUID", "GEN_RANDOM_UUID", "CLOCK_TIMESTAMP", "NEXTVAL"}
+IDENTIFIER_QUOTES = {"double": '"{}"', "backtick": "`{}`", "bracket": "[{}]"}
+
+
+def normalize_sql(query: str, fold_case=True):
+    """
+    Returns the normalized text of a query and the tables it reads, or None if the query should not be cached.
+    Whitespace and comments are dropped and unquoted words are lower-cased (fold_case=False keeps them, for MySQL
+    servers with case-sensitive table names), so "SELECT  Name FROM artists;" and "select name from artists" share
+    one entry. String literals and quoted identifiers are kept as they are.
+    """
+    try:
+        tokens = tokenize_sql(query)
+    except ValueError:
+        return None
+    while tokens and tokens[-1] == ("punct", ";"):
+        tokens.pop()
+    if not tokens or any(kind == "word" and value.upper() in NONDETERMINISTIC for kind, value in tokens):
+        return None
+    if any(kind == "string" and value.lower() in ("'now'", "'localtime'") for kind, value in tokens):
+        return None  # SQLite date('now')
+
+    if fold_case:
+        tokens = [(kind, value.lower() if kind == "word" else value) for kind, value in tokens]
+    text_parts = [IDENTIFIER_QUOTES[kind].format(value) if kind in IDENTIFIER_QUOTES else value for kind, value in tokens]
+    return " ".join(text_parts), sorted(set(referenced_tables(tokens)))
+
+
+def estimate_bytes(results: ResultSet) -> int:
+    """Approximate memory taken by the values of a result: string lengths, 8 bytes for anything else."""
+    size = 0
+    for batch in results.iter_batches():
+        for values in batch.data:
+            for value in values:
+                size += len(value) if isinstance(value, (str, bytes)) else 8
+    return size
+
+
+class DataVersions:
+    """
+    Reads the data-version token of tables.
+
+    Attributes:
+        engine: The engine of the database whose data is cached.
+        hook (Optional[callable]): hook(tables) -> {table: token}. Replaces the built-in tokens, e.g. with a version
+                                   counter bumped by the ETL job. A table without a token makes the query uncacheable.
+        check_interval (float): Seconds a token is trusted before it is read again. This bounds how long a change made
+                                by another process can go unnoticed.
+    """
+
+    def __init__(self, engine, hook=None, check_interval=1.0):
+        self.engine = engine
+        self.hook = hook
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.tokens = {}  # table -> (token, time read)
+        self.connection = None
+
+    def get(self, tables) -> dict:
+        """
+        Returns the token of every table, or None when one of them has no token (nothing is cached for it then).
+        """
+        now = time.monotonic()
+        with self.lock:
+            known = {table: self.tokens[table] for table in tables if table in self.tokens}
+        if len(known) == len(tables) and all(now - read_at < self.check_interval for _, read_at in known.values()):
+            return {table: token for table, (token, _) in known.items()}
+
+        tokens = self._read(tables)
+        if tokens is None or any(table not in tokens for table in tables):
+            return None
+        with self.lock:
+            self.tokens.update({table: (tokens[table], now) for table in tables})
+        return {table: tokens[table] for table in tables}
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def _read(self, tables):
+        if self.hook is not None:
+            return self.hook(tables)
+        dialect = self.engine.dialect.name
+        try:
+            if dialect == "sqlite":
+                return self._read_sqlite(tables)
+            query = DATA_VERSION_QUERIES.get(dialect)
+            if query is None:
+                return None
+            with self.engine.connect() as connection:
+                rows = connection.execute(text(query).bindparams(bindparam("tables", expanding=True)),
+                                          {"tables": list(tables)}).fetchall()
+            # CTE names and views have no row of their own, they get the token of the query's real tables. A query
+            # that only reads views is not cached, as the tables behind them are unknown.
+            tokens = {str(name): str(token) for name, token in rows}
+            if tables and not tokens:
+                return None
+            real = ":".join(tokens[name] for name in sorted(tokens))
+            return {table: tokens.get(table, real) for table in tables}
+        except Exception as e:
+            logger.warning("Error reading data versions: %s", e)
+            return None
+
+    def _read_sqlite(self, tables):
+        """
+        SQLite counts commits per database, not per table: PRAGMA data_version on a connection of its own changes
+        whenever any other connection (or process) commits. Every table gets that counter as its token. The maximum
+        rowid would be per table but misses updates and deletes, so it is not used.
+        """
+        database = self.engine.url.database
+        if not database or database == ":memory:":
+            return None  # an in-memory database only lives in the pool's connection
+        with self.lock:
+            if self.connection is None:
+                uri = f"{Path(database).resolve().as_uri()}?mode=ro"
+                self.connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        return {table: str(version) for table in tables}
+
+
+class ResultCache:
+    """
+    Memory-bounded LRU cache of query results with optional spill to disk and stale-while-revalidate.
+
+    Attributes:
+        versions (DataVersions): Source of the table tokens results are validated against.
+        namespace (str): Mixed into every key, it identifies the database and the row limits the results were read with.
+        max_bytes (int): Memory budget, see estimate_bytes(). Least recently used results are evicted first (to disk
+                         when spill_dir is set). Results larger than a quarter of the budget are not cached.
+        spill_dir (Optional[str]): Directory of the disk tier.
+        max_disk_bytes (int): Size limit of the disk tier.
+        stale_while_revalidate (float): Seconds after it was stored during which a result whose tables changed is still
+                                        returned at once, while a background thread re-runs the query. 0 disables it.
+        ttl (Optional[float]): Maximum age of a result even when its tokens still match.
+        fold_case (bool): See normalize_sql().
+    """
+
+    def __init__(self, versions, namespace="", max_bytes=64 * 1024 * 1024, spill_dir=None,
+                 max_disk_bytes=512 * 1024 * 1024, stale_while_revalidate=0.0, ttl=None, fold_case=True,
+                 refresh_workers=2):
+        self.versions = versions
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self.ttl = ttl
+        self.fold_case = fold_case
+        self.refresh_workers = refresh_workers
+        self.lock = threading.RLock()
+        self.memory = OrderedDict()  # key -> entry dict (result, versions, size, stored_at)
+        self.memory_bytes = 0
+        self.inflight = {}  # key -> Future of the run that everyone asking for the key waits on
+        self.executor = None
+        self.stats = {'hits': 0, 'stale_hits': 0, 'disk_hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0,
+                      'spills': 0}
+
+        self.path = None
+        self.conn = None
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+            self.path = os.path.join(spill_dir, "result-cache.sqlite")
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("""CREATE TABLE IF NOT EXISTS results (
+                                     key TEXT PRIMARY KEY, versions TEXT, value BLOB, size INTEGER, stored_at REAL,
+                                     last_access REAL)""")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+            self.conn.commit()
+
+    def fetch(self, query: str, run):
+        """
+        Returns the result of a query from the cache, or from run() (which executes it) on a miss.
+
+        Args:
+            query (str): The SQL query.
+            run (callable): Executes the query and returns a ResultSet or an error dict. Errors are never cached.
+        """
+        normalized = normalize_sql(query, self.fold_case)
+        versions = self.versions.get(normalized[1]) if normalized is not None else None
+        if versions is None:
+            self._lookup("bypassed")
+            return run()
+
+        key = hashlib.sha256(f"{self.namespace}\x00{normalized[0]}".encode()).hexdigest()
+        entry = self._get(key)
+        if entry is not None:
+            age = time.time() - entry['stored_at']
+            if entry['versions'] == versions and (self.ttl is None or age < self.ttl):
+                self._lookup("hits")
+                return entry['result']
+            if age < self.stale_while_revalidate:
+                self._lookup("stale_hits")
+                self._refresh(key, versions, run)
+                return entry['result']
+
+        self._lookup("misses")
+        return self._run_once(key, versions, run)
+
+    def _lookup(self, outcome):
+        with self.lock:
+            self.stats[outcome] += 1
+        telemetry.count("eda_result_cache_lookups_total", result=outcome)
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Running queries
+    # Concurrent requests for the same key share one execution. The versions are read before the query runs, so a
+    # change that commits while it runs leaves the entry with the old token and the next lookup runs the query again.
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _run_once(self, key, versions, run):
+        with self.lock:
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            result = run()
+            if isinstance(result, ResultSet):
+                self._put(key, result, versions)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+
+    def _refresh(self, key, versions, run):
+        with self.lock:
+            if key in self.inflight:
+                return
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.refresh_workers, thread_name_prefix="result-refresh")
+        self.executor.submit(self._background_run, key, versions, run)
+
+    def _background_run(self, key, versions, run):
+        try:
+            self._run_once(key, versions, run)
+        except Exception as e:
+            logger.warning("Error refreshing a cached result: %s", e)
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Storage tiers
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _get(self, key):
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry
+            if self.conn is None:
+                return None
+            row = self.conn.execute("SELECT versions, value, size, stored_at FROM results WHERE key = ?",
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.conn.commit()
+            self.stats['disk_hits'] += 1
+        entry = {'versions': json.loads(row[0]), 'result': pickle.loads(row[1]), 'size': row[2], 'stored_at': row[3]}
+        self._remember(key, entry)
+        return entry
+
+    def _put(self, key, result, versions):
+        size = estimate_bytes(result)
+        if size > self.max_bytes // 4:
+            return
+        self._remember(key, {'versions': versions, 'result': result, 'size': size, 'stored_at': time.time()})
+
+    def _remember(self, key, entry):
+        with self.lock:
+            previous = self.memory.pop(key, None)
+            if previous is not None:
+                self.memory_bytes -= previous['size']
+            self.memory[key] = entry
+            self.memory_bytes += entry['size']
+            while self.memory_bytes > self.max_bytes and len(self.memory) > 1:
+                evicted_key, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= evicted['size']
+                self.stats['evictions'] += 1
+                self._spill(evicted_key, evicted)
+
+    def _spill(self, key, entry):
+        if self.conn is None:
+            return
+        self.conn.execute("""INSERT OR REPLACE INTO results (key, versions, value, size, stored_at, last_access)
+                             VALUES (?, ?, ?, ?, ?, ?)""",
+                          (key, json.dumps(entry['versions'], sort_keys=True),
+                           pickle.dumps(entry['result'], protocol=pickle.HIGHEST_PROTOCOL), entry['size'],
+                           entry['stored_at'], time.time()))
+        self.stats['spills'] += 1
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        while total > self.max_disk_bytes:
+            row = self.conn.execute("SELECT key, size FROM results ORDER BY last_access LIMIT 1").fetchone()
+            self.conn.execute("DELETE FROM results WHERE key = ?", (row[0],))
+            total -= row[1]
+        self.conn.commit()
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM results")
+                self.conn.commit()
+
+    def close(self):
+        """Drops the memory tier and closes the disk tier and the data version connection."""
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            executor, self.executor = self.executor, None
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        self.versions.close()
@@ -0,0 +1,156 @@
+from bisect import bisect_right
+from collections.abc import Sequence
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Columnar query results
+# Query results are streamed from the database in fixed-size ColumnBatch objects. A ResultSet keeps those batches and
+# still behaves like the list of row dictionaries the nodes used to receive, so existing consumers keep working while
+# new ones can read whole columns or iterate batch by batch.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+class ColumnBatch:
+    """
+    A fixed-size slice of a query result stored column by column.
+
+    Attributes:
+        columns (list[str]): The column names.
+        data (list[list]): One list of values per column, all of length num_rows.
+        truncated (bool): True on the last batch of a result that was cut short by a row or byte limit.
+    """
+
+    __slots__ = ("columns", "data", "truncated")
+
+    def __init__(self, columns, data, truncated=False):
+        self.columns = list(columns)
+        self.data = data
+        self.truncated = truncated
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        columns = list(columns)
+        data = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+        return cls(columns, data)
+
+    @property
+    def num_rows(self):
+        return len(self.data[0]) if self.data else 0
+
+    def rows(self):
+        """Yields the rows of the batch as tuples."""
+        return zip(*self.data)
+
+    def slice(self, stop):
+        return ColumnBatch(self.columns, [values[:stop] for values in self.data], self.truncated)
+
+    def __getstate__(self):
+        return self.columns, self.data, self.truncated
+
+    def __setstate__(self, state):
+        self.columns, self.data, self.truncated = state
+
+
+class ResultSet(Sequence):
+    """
+    Sequence of row dictionaries backed by ColumnBatch objects.
+
+    Attributes:
+        columns (list[str]): The column names.
+        batches (list[ColumnBatch]): The batches in result order.
+        truncated (bool): True if the result was cut short by a row or byte limit, or by the LIMIT the query guard
+                          added to an expensive query.
+        guard_action (str): What the query guard did with the query, 'allow' or 'limit' (see QueryGuard.check).
+        cost (float): The cost the query guard estimated for the query, None when it was not estimated.
+    """
+
+    def __init__(self, columns=(), batches=(), truncated=False):
+        self.columns = list(columns)
+        self.batches = []
+        self.offsets = []
+        self.row_count = 0
+        self.truncated = truncated
+        self.guard_action = "allow"
+        self.cost = None
+        for batch in batches:
+            self.append(batch)
+
+    def append(self, batch: ColumnBatch):
+        if not self.columns:
+            self.columns = list(batch.columns)
+        if batch.num_rows:
+            self.offsets.append(self.row_count)
+            self.batches.append(batch)
+            self.row_count += batch.num_rows
+        self.truncated = self.truncated or batch.truncated
+
+    def iter_batches(self):
+        return iter(self.batches)
+
+    def iter_rows(self):
+        """Yields every row as a tuple, batch by batch."""
+        for batch in self.batches:
+            yield from batch.rows()
+
+    def column(self, name_or_index):
+        """Returns all values of one column as a list."""
+        index = name_or_index if isinstance(name_or_index, int) else self.columns.index(name_or_index)
+        values = []
+        for batch in self.batches:
+            values.extend(batch.data[index])
+        return values
+
+    def head(self, n):
+        """Returns the first n rows as dictionaries without materializing the rest."""
+        rows = []
+        for row in self.iter_rows():
+            if len(rows) >= n:
+                break
+            rows.append(dict(zip(self.columns, row)))
+        return rows
+
+    def to_records(self):
+        return [dict(zip(self.columns, row)) for row in self.iter_rows()]
+
+    def __len__(self):
+        return self.row_count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.row_count))]
+        if index < 0:
+            index += self.row_count
+        if not 0 <= index < self.row_count:
+            raise IndexError("ResultSet index out of range")
+        position = bisect_right(self.offsets, index) - 1
+        batch = self.batches[position]
+        row = index - self.offsets[position]
+        return {column: values[row] for column, values in zip(self.columns, batch.data)}
+
+    def __iter__(self):
+        for row in self.iter_rows():
+            yield dict(zip(self.columns, row))
+
+    def __eq__(self, other):
+        if isinstance(other, ResultSet):
+            return self.columns == other.columns and list(self.iter_rows()) == list(other.iter_rows())
+        if isinstance(other, list):
+            return self.to_records() == other
+        return False
+
+    def __repr__(self):
+        return repr(self.to_records())
+
+
+def to_columns(results):
+    """
+    Returns (column names, list of value lists) for a ResultSet, a list of row dictionaries or a list of row tuples.
+    """
+    if isinstance(results, ResultSet):
+        return list(results.columns), [results.column(i) for i in range(len(results.columns))]
+    if not results:
+        return [], []
+    if isinstance(results[0], dict):
+        columns = list(results[0].keys())
+        return columns, [[row.get(column) for row in results] for column in columns]
+    columns = [f"column_{i}" for i in range(len(results[0]))]
+    return columns, [list(values) for values in zip(*results)]
@@ -0,0 +1,145 @@
+import re
+from decimal import Decimal
+
+import numpy as np
+
+from ResultSet import ResultSet, to_columns
+from token_counter import count_tokens
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Token-budgeted digest of query results
+# format_results and choose_visualization only need the shape of a result, not every row, so large results are
+# replaced in their prompts by a digest: row count, column types, numeric ranges, top categories and sample rows.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+TEMPORAL_PATTERN = re.compile(r"^\d{4}-\d{2}(-\d{2})?([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def profile_column(values, top_k=5):
+    """
+    Profiles one column with vectorized NumPy operations.
+
+    Returns:
+        dict: 'type' ('numeric', 'temporal', 'text' or 'empty'), 'nulls' and either min/max/mean (numeric),
+              min/max (temporal) or the number of distinct values and the top_k most frequent ones (text).
+    """
+    array = np.asarray(values, dtype=object)
+    present = array[array != None]  # noqa: E711 -- element-wise comparison
+    profile = {'nulls': int(len(array) - len(present))}
+    if len(present) == 0:
+        profile['type'] = 'empty'
+        return profile
+
+    first = present[0]
+    if isinstance(first, (int, float, Decimal)) and not isinstance(first, bool):
+        try:
+            numbers = present.astype(float)
+            profile.update(type='numeric', min=round(float(numbers.min()), 4), max=round(float(numbers.max()), 4),
+                           mean=round(float(numbers.mean()), 4))
+            return profile
+        except (TypeError, ValueError):
+            pass
+
+    strings = present.astype(str)
+    distinct, counts = np.unique(strings, return_counts=True)  # sorted, so ISO dates are in chronological order
+    if TEMPORAL_PATTERN.match(strings[0]) and TEMPORAL_PATTERN.match(strings[-1]):
+        profile.update(type='temporal', min=str(distinct[0]), max=str(distinct[-1]))
+        return profile
+
+    order = np.argsort(-counts, kind='stable')[:top_k]
+    profile.update(type='text', distinct=int(len(distinct)),
+                   top=[(str(distinct[i]), int(counts[i])) for i in order])
+    return profile
+
+
+class ResultSummarizer:
+    """
+    Replaces large query results in prompts by a digest that fits in a token budget.
+
+    Attributes:
+        token_budget (int): Maximum estimated tokens of what is put in the prompt.
+        sample_rows (int): Number of head and tail rows included in the digest (reduced to fit the budget).
+        top_k (int): Number of most frequent values listed for text columns.
+    """
+
+    def __init__(self, token_budget=1500, sample_rows=5, top_k=5):
+        self.token_budget = token_budget
+        self.sample_rows = sample_rows
+        self.top_k = top_k
+
+    def estimate_raw_tokens(self, results):
+        """
+        Estimates the tokens the full results would take in a prompt from the first rows, without rendering them all.
+        """
+        if isinstance(results, ResultSet):
+            head = results.head(100)
+        else:
+            head = list(results[:100])
+        if not head:
+            return count_tokens(results)
+        return count_tokens(head) * len(results) // len(head)
+
+    def summarize(self, results):
+        """
+        Returns what should be put in the prompt for the results and a token report.
+
+        Results that fit the budget are returned unchanged (as row dictionaries). Larger results are replaced by a
+        digest; the number of sample rows and listed categories is reduced until the digest fits.
+
+        Returns:
+            tuple: The prompt text (or rows) and {'raw_tokens', 'summary_tokens', 'summarized'}.
+        """
+        if isinstance(results, (str, dict)) or not results:
+            tokens = count_tokens(results)
+            return results, {'raw_tokens': tokens, 'summary_tokens': tokens, 'summarized': False}
+
+        raw_tokens = self.estimate_raw_tokens(results)
+        if raw_tokens <= self.token_budget:
+            rows = results.to_records() if isinstance(results, ResultSet) else results
+            return rows, {'raw_tokens': raw_tokens, 'summary_tokens': raw_tokens, 'summarized': False}
+
+        columns, values = to_columns(results)
+        profiles = [profile_column(column_values, self.top_k) for column_values in values]
+        truncated = getattr(results, 'truncated', False)
+
+        sample_rows, top_k = self.sample_rows, self.top_k
+        while True:
+            digest = self._render(results, columns, values, profiles, truncated, sample_rows, top_k)
+            summary_tokens = count_tokens(digest)
+            if summary_tokens <= self.token_budget or (sample_rows == 0 and top_k == 1):
+                break
+            if sample_rows > 0:
+                sample_rows -= 1
+            else:
+                top_k = max(1, top_k - 1)
+
+        return digest, {'raw_tokens': raw_tokens, 'summary_tokens': summary_tokens, 'summarized': True}
+
+    @staticmethod
+    def _render(results, columns, values, profiles, truncated, sample_rows, top_k):
+        row_count = len(results)
+        lines = [f"Result digest: {row_count} rows" + (" (truncated by the row limit)" if truncated else "")]
+        lines.append("Columns:")
+        for name, profile in zip(columns, profiles):
+            if profile['type'] == 'numeric':
+                detail = f"min {profile['min']}, max {profile['max']}, mean {profile['mean']}"
+            elif profile['type'] == 'temporal':
+                detail = f"from {profile['min']} to {profile['max']}"
+            elif profile['type'] == 'text':
+                top = ", ".join(f"{value} ({count})" for value, count in profile['top'][:top_k])
+                detail = f"{profile['distinct']} distinct; most frequent: {top}"
+            else:
+                detail = "all null"
+            nulls = f", {profile['nulls']} nulls" if profile['nulls'] else ""
+            lines.append(f"- {name} ({profile['type']}): {detail}{nulls}")
+
+        if sample_rows:
+            head = [dict(zip(columns, (column_values[i] for column_values in values)))
+                    for i in range(min(sample_rows, row_count))]
+            tail_start = max(sample_rows, row_count - sample_rows)
+            tail = [dict(zip(columns, (column_values[i] for column_values in values)))
+                    for i in range(tail_start, row_count)]
+            lines.append(f"First rows: {head}")
+            if tail:
+                lines.append(f"Last rows: {tail}")
+        return "\n".join(lines)
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import pickle
+import time
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Prebuilt runtime snapshots
+# A snapshot directory holds what a fresh worker would otherwise build from the database before its first answer: the
+# schema snapshot (schema dictionary and schema graph, see SchemaCache) and the value index. Build it once, e.g. in the
+# image build or a deploy job, and point the workers at it (WorkflowManager(snapshot=...) or EDA_SNAPSHOT):
+#
+#   python RuntimeSnapshot.py --db-url sqlite:///chinook.db --output snapshots/chinook
+#
+# A snapshot is only loaded into the database (URL and dialect) it was built from, and only trusted while the schema
+# fingerprint of the database matches the one it was built under; otherwise the schema is re-introspected and the
+# value index re-probed as usual.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+SNAPSHOT_VERSION = 1
+MANIFEST = "manifest.json"
+SCHEMA_FILE = "schema.pkl"
+VALUES_FILE = "values.sqlite"
+
+
+def save_snapshot(db_manager, path, index_values=True) -> dict:
+    """
+    Writes the schema snapshot and value index of a DatabaseManager to a directory.
+
+    Args:
+        index_values (bool): Index every text column first, so that workers never index on the request path.
+
+    Returns:
+        dict: The manifest of the snapshot.
+    """
+    os.makedirs(path, exist_ok=True)
+    snapshot = db_manager.schema_cache.get()
+    if index_values:
+        db_manager.value_index.build(snapshot['schema'])
+
+    with open(os.path.join(path, SCHEMA_FILE), "wb") as f:
+        pickle.dump(snapshot, f)
+    values_path = os.path.join(path, VALUES_FILE)
+    if os.path.exists(values_path):
+        os.remove(values_path)
+    db_manager.value_index.save(values_path)
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "database": db_manager.engine.url.render_as_string(hide_password=True),
+        "dialect": db_manager.get_db_type(),
+        "fingerprint": snapshot['fingerprint'],
+        "tables": len(snapshot['schema']),
+    }
+    with open(os.path.join(path, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_snapshot(db_manager, path) -> dict:
+    """
+    Installs a snapshot written by save_snapshot() into a DatabaseManager.
+
+    Returns:
+        dict: 'trusted' (the snapshot matches the database) and 'load_ms'. A snapshot of another database is not
+              installed at all and reports trusted False.
+
+    Raises:
+        ValueError: If the directory holds no snapshot or one of another format version.
+    """
+    start = time.perf_counter()
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"No runtime snapshot in {path}")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Runtime snapshot {path} has version {manifest.get('version')}, expected {SNAPSHOT_VERSION}")
+
+    # The values of another database are of no use, even under the same schema
+    database = db_manager.engine.url.render_as_string(hide_password=True)
+    if manifest["database"] != database or manifest["dialect"] != db_manager.get_db_type():
+        print(f"Runtime snapshot {path} was built from {manifest['database']}, not {database}, it is not loaded")
+        return {"trusted": False, "load_ms": round((time.perf_counter() - start) * 1000, 3)}
+
+    with open(os.path.join(path, SCHEMA_FILE), "rb") as f:
+        db_manager.schema_cache.install(pickle.load(f))
+
+    fingerprint = db_manager.schema_cache.fingerprint()
+    trusted = fingerprint is not None and fingerprint == manifest["fingerprint"]
+    if not trusted:
+        print(f"Runtime snapshot {path} was built for another schema, it will be refreshed from the database")
+    db_manager.value_index.load(os.path.join(path, VALUES_FILE), trusted=trusted)
+
+    report = {"trusted": trusted, "load_ms": round((time.perf_counter() - start) * 1000, 3)}
+    print(f"Loaded runtime snapshot {path} ({manifest['tables']} tables) in {report['load_ms']} ms")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a runtime snapshot for fast worker start-up.")
+    parser.add_argument("--db-url", default=os.getenv("EDA_DB_URL", "sqlite:///chinook.db"))
+    parser.add_argument("--output", required=True, help="Snapshot directory.")
+    parser.add_argument("--no-values", action="store_true", help="Do not index every text column up front.")
+    args = parser.parse_args()
+
+    from DatabaseManager import DatabaseManager
+    manifest = save_snapshot(DatabaseManager(args.db_url, cache_dir=None), args.output,
+                             index_values=not args.no_values)
+    print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,455 @@
+import difflib
+import re
+
+from SQLValidator import TOKEN_PATTERN, CLAUSE_KEYWORDS, opens_function_call
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Local, schema-aware SQL repair
+# The database error of an invalid query is classified (unknown column or table, ambiguous column, quoting, a function
+# of another dialect) and the query is edited in place: identifiers are fuzzy-matched against the cached schema,
+# ambiguous columns are qualified, quotes are normalized and functions are rewritten for the dialect. fix_sql only asks
+# the LLM when none of this applies or the repaired query is still invalid.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+# Minimum difflib similarity for an identifier to be replaced by a schema name. Typos and separators (artsts,
+# customerid) score above it, names that only share a prefix (InvoiceYear / InvoiceDate, TotalSales / Total) below:
+# those are a different meaning rather than a misspelling, and are left to the LLM.
+MATCH_CUTOFF = 0.85
+
+ERROR_PATTERNS = [
+    # SQLite (and the static pass of SQLValidator)
+    ("no_such_column", re.compile(r"no such column: (?P<name>[^\s\]]+)", re.I)),
+    ("no_such_table", re.compile(r"no such table: (?P<name>[^\s\]]+)", re.I)),
+    ("ambiguous_column", re.compile(r"ambiguous column name: (?P<name>[^\s\]]+)", re.I)),
+    ("function", re.compile(r"no such function: (?P<name>\w+)", re.I)),
+    # PostgreSQL
+    ("no_such_column", re.compile(r'column "?(?P<name>[^"\s]+)"? does not exist', re.I)),
+    ("no_such_table", re.compile(r'relation "(?P<name>[^"]+)" does not exist', re.I)),
+    ("ambiguous_column", re.compile(r'column reference "(?P<name>[^"]+)" is ambiguous', re.I)),
+    ("function", re.compile(r"function (?P<name>[\w.]+)\(.*?\) does not exist", re.I)),
+    # MySQL
+    ("no_such_column", re.compile(r"Unknown column '(?P<name>[^']+)'", re.I)),
+    ("no_such_table", re.compile(r"Table '(?:[^'.]+\.)?(?P<name>[^'.]+)' doesn't exist", re.I)),
+    ("ambiguous_column", re.compile(r"Column '(?P<name>[^']+)' in [\w ]+ is ambiguous", re.I)),
+    ("function", re.compile(r"FUNCTION (?:\w+\.)?(?P<name>\w+) does not exist", re.I)),
+    # Anything else that failed to parse may be a quote of another dialect
+    ("quoting", re.compile(r"syntax error|unrecognized token|You have an error in your SQL syntax", re.I)),
+]
+
+IDENTIFIER_KINDS = ("word", "double", "backtick", "bracket")
+PLAIN_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Date format directives of strftime (SQLite) in the other dialects
+STRFTIME_TO_POSTGRESQL = {"%Y": "YYYY", "%m": "MM", "%d": "DD", "%H": "HH24", "%M": "MI", "%S": "SS", "%j": "DDD"}
+STRFTIME_TO_MYSQL = {"%M": "%i", "%S": "%s"}
+
+
+def classify_error(message: str) -> dict:
+    """
+    Returns the kind of a database error ('no_such_column', 'no_such_table', 'ambiguous_column', 'function',
+    'quoting' or 'other') and the identifier it names, if any.
+    """
+    for kind, pattern in ERROR_PATTERNS:
+        match = pattern.search(message or "")
+        if match:
+            return {'kind': kind, 'name': match.groupdict().get('name')}
+    return {'kind': "other", 'name': None}
+
+
+def sql_tokens(query: str) -> list[tuple]:
+    """
+    Tokenizes the query like SQLValidator.tokenize_sql but keeps the position of every token, as
+    (kind, value, start, end) tuples, so that single tokens can be replaced without reformatting the query.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind, value = match.lastgroup, match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind in ("double", "backtick"):
+            value = value[1:-1].replace(value[0] * 2, value[0])
+        elif kind == "bracket":
+            value = value[1:-1]
+        elif kind == "other":
+            kind = "punct"
+        tokens.append((kind, value, match.start(), match.end()))
+    return tokens
+
+
+def apply_edits(query: str, edits) -> str:
+    """Applies (start, end, replacement) edits to the query."""
+    for start, end, replacement in sorted(set(edits), reverse=True):
+        query = query[:start] + replacement + query[end:]
+    return query
+
+
+def closest(name: str, candidates, cutoff=MATCH_CUTOFF):
+    """Returns the candidate closest to name (case-insensitive), or None if none is similar enough."""
+    by_lower = {}
+    for candidate in candidates:
+        by_lower.setdefault(candidate.lower(), candidate)
+    if name.lower() in by_lower:
+        return by_lower[name.lower()]
+    matches = difflib.get_close_matches(name.lower(), list(by_lower), n=1, cutoff=cutoff)
+    return by_lower[matches[0]] if matches else None
+
+
+def split_arguments(tokens, query, open_index):
+    """
+    Returns the source text of the top-level arguments of the call whose "(" is tokens[open_index], and the index of
+    its closing ")", or (None, None) if the parentheses do not close.
+    """
+    depth = 0
+    arguments = []
+    start = tokens[open_index][3]
+    for i in range(open_index, len(tokens)):
+        kind, value, token_start, token_end = tokens[i]
+        if kind != "punct":
+            continue
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+            if depth == 0:
+                argument = query[start:token_start].strip()
+                if argument or arguments:
+                    arguments.append(argument)
+                return arguments, i
+        elif value == "," and depth == 1:
+            arguments.append(query[start:token_start].strip())
+            start = token_end
+    return None, None
+
+
+def _convert_format(literal, directives):
+    # Only literal formats can be converted
+    if not (literal.startswith("'") and literal.endswith("'")):
+        return None
+    text = literal
+    for directive, replacement in directives.items():
+        text = text.replace(directive, replacement)
+    return text
+
+
+def _date_part(part, argument):
+    """EXTRACT(YEAR FROM x) style date parts for SQLite."""
+    formats = {"YEAR": "%Y", "MONTH": "%m", "DAY": "%d", "HOUR": "%H", "MINUTE": "%M", "SECOND": "%S"}
+    if part.upper() not in formats:
+        return None
+    return f"CAST(strftime('{formats[part.upper()]}', {argument}) AS INTEGER)"
+
+
+def _extract_sqlite(args):
+    match = re.match(r"^\s*(\w+)\s+FROM\s+(.+)$", args[0], re.I | re.S) if len(args) == 1 else None
+    return _date_part(match.group(1), match.group(2)) if match else None
+
+
+def _strftime_postgresql(args):
+    if len(args) != 2:
+        return None
+    fmt = _convert_format(args[0], STRFTIME_TO_POSTGRESQL)
+    return f"TO_CHAR({args[1]}, {fmt})" if fmt else None
+
+
+def _strftime_mysql(args):
+    if len(args) != 2:
+        return None
+    fmt = _convert_format(args[0], STRFTIME_TO_MYSQL)
+    return f"DATE_FORMAT({args[1]}, {fmt})" if fmt else None
+
+
+def _to_char_sqlite(args):
+    if len(args) != 2:
+        return None
+    fmt = _convert_format(args[1], {value: key for key, value in STRFTIME_TO_POSTGRESQL.items()})
+    return f"strftime({fmt}, {args[0]})" if fmt else None
+
+
+def _unary(template):
+    return lambda args: template.format(*args) if len(args) == 1 else None
+
+
+def _binary(template):
+    return lambda args: template.format(*args) if len(args) == 2 else None
+
+
+# Function name -> rewrite of its arguments (list of source strings) for the dialect that lacks it. A rewrite returns
+# None when it does not apply to the arguments.
+FUNCTION_REWRITES = {
+    "sqlite": {
+        "YEAR": lambda args: _date_part("YEAR", args[0]) if len(args) == 1 else None,
+        "MONTH": lambda args: _date_part("MONTH", args[0]) if len(args) == 1 else None,
+        "DAY": lambda args: _date_part("DAY", args[0]) if len(args) == 1 else None,
+        "EXTRACT": _extract_sqlite,
+        "TO_CHAR": _to_char_sqlite,
+        "NOW": lambda args: "CURRENT_TIMESTAMP" if not args else None,
+        "CONCAT": lambda args: "(" + " || ".join(args) + ")" if args else None,
+        "LEN": _unary("LENGTH({0})"),
+        "ISNULL": _binary("IFNULL({0}, {1})"),
+        "NVL": _binary("IFNULL({0}, {1})"),
+    },
+    "postgresql": {
+        "YEAR": _unary("EXTRACT(YEAR FROM {0})"),
+        "MONTH": _unary("EXTRACT(MONTH FROM {0})"),
+        "DAY": _unary("EXTRACT(DAY FROM {0})"),
+        "STRFTIME": _strftime_postgresql,
+        "IFNULL": _binary("COALESCE({0}, {1})"),
+        "ISNULL": _binary("COALESCE({0}, {1})"),
+        "NVL": _binary("COALESCE({0}, {1})"),
+        "LEN": _unary("LENGTH({0})"),
+    },
+    "mysql": {
+        "STRFTIME": _strftime_mysql,
+        "ISNULL": _binary("IFNULL({0}, {1})"),
+        "NVL": _binary("IFNULL({0}, {1})"),
+        "LEN": _unary("LENGTH({0})"),
+    },
+}
+
+
+class SQLRepair:
+    """
+    Repairs common errors of generated queries without calling the LLM.
+
+    Attributes:
+        dialect (str): The SQLAlchemy dialect name of the database ('sqlite', 'postgresql' or 'mysql').
+        cutoff (float): Minimum similarity (0..1) for fuzzy identifier matches.
+    """
+
+    def __init__(self, dialect, cutoff=MATCH_CUTOFF):
+        self.dialect = dialect
+        self.cutoff = cutoff
+
+    def repair(self, query: str, error_message: str, schema: dict):
+        """
+        Attempts one repair of the query for the error.
+
+        Args:
+            query (str): The invalid query.
+            error_message (str): The error reported by the validator or the database.
+            schema (dict): Table name to table data (see DatabaseManager.get_schema).
+
+        Returns:
+            dict: 'query' (the repaired query), 'kind' (the error class) and 'fix' (a description of the edit),
+                  or None if the error could not be repaired locally.
+        """
+        error = classify_error(error_message)
+        try:
+            tokens = sql_tokens(query)
+        except Exception:
+            return None
+
+        repairs = {
+            "no_such_column": self._fix_column,
+            "no_such_table": self._fix_table,
+            "ambiguous_column": self._fix_ambiguous,
+            "function": self._fix_function,
+        }
+        result = None
+        if error['kind'] in repairs and error['name']:
+            result = repairs[error['kind']](query, tokens, error['name'], schema)
+        if result is None:
+            # Identifiers quoted for another dialect cause all kinds of parse and lookup errors
+            result = self._fix_quoting(query, tokens)
+            error['kind'] = "quoting" if result is not None else error['kind']
+        if result is None or result[0] == query:
+            return None
+        return {'query': result[0], 'kind': error['kind'], 'fix': result[1]}
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Helpers
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def quote(self, name: str) -> str:
+        """Returns the identifier as it must be written in the dialect."""
+        needs_quotes = not PLAIN_IDENTIFIER.match(name) or (self.dialect == "postgresql" and name != name.lower())
+        if not needs_quotes:
+            return name
+        if self.dialect == "mysql":
+            return "`" + name.replace("`", "``") + "`"
+        return '"' + name.replace('"', '""') + '"'
+
+    @staticmethod
+    def _is_keyword(token):
+        return token[0] == "word" and token[1].upper() in CLAUSE_KEYWORDS
+
+    def _from_items(self, tokens) -> list[tuple]:
+        """
+        Returns the tables referenced after FROM / JOIN as (token index of the name, name, alias or None) tuples, in
+        order of appearance. FROM within function arguments (EXTRACT(YEAR FROM x)) is skipped.
+        """
+        items = []
+        calls = []  # one flag per open parenthesis, True for the argument list of a function call
+        i = 0
+        while i < len(tokens):
+            if tokens[i][0] == "punct" and tokens[i][1] in "()":
+                if tokens[i][1] == "(":
+                    calls.append(opens_function_call(tokens, i))
+                elif calls:
+                    calls.pop()
+                i += 1
+                continue
+            if not (tokens[i][0] == "word" and tokens[i][1].upper() in ("FROM", "JOIN")) or (calls and calls[-1]):
+                i += 1
+                continue
+            i += 1
+            while i < len(tokens) and tokens[i][0] in IDENTIFIER_KINDS and not self._is_keyword(tokens[i]):
+                while i + 2 < len(tokens) and tokens[i + 1][1] == "." and tokens[i + 2][0] in IDENTIFIER_KINDS:
+                    i += 2
+                position, name, alias = i, tokens[i][1], None
+                i += 1
+                if i < len(tokens) and tokens[i][0] == "word" and tokens[i][1].upper() == "AS":
+                    i += 1
+                if i < len(tokens) and tokens[i][0] in IDENTIFIER_KINDS and not self._is_keyword(tokens[i]):
+                    alias = tokens[i][1]
+                    i += 1
+                items.append((position, name, alias))
+                if i + 1 < len(tokens) and tokens[i][1] == "," and tokens[i + 1][0] in IDENTIFIER_KINDS:
+                    i += 1
+                    continue
+                break
+        return items
+
+    def _aliases(self, tokens, schema) -> dict:
+        """
+        Returns the tables referenced after FROM / JOIN as lower-cased alias (or table name) -> schema table name,
+        in order of appearance. Names that are not in the schema (CTEs, subquery aliases) map to None.
+        """
+        tables = {name.lower(): name for name in schema}
+        aliases = {}
+        for _, name, alias in self._from_items(tokens):
+            # An aliased table can only be referred to by its alias
+            if alias is not None:
+                aliases[alias.lower()] = tables.get(name.lower())
+            else:
+                aliases.setdefault(name.lower(), tables.get(name.lower()))
+        return aliases
+
+    @staticmethod
+    def _columns(schema, table) -> list:
+        return [col.name for col in schema[table]['columns']] if table in schema else []
+
+    @staticmethod
+    def _references(tokens, name, qualifier=None):
+        """
+        Yields the indices of the identifier tokens naming name (case-insensitive), optionally only those qualified
+        by qualifier ("qualifier.name"). Function names and output aliases ("AS name") are skipped.
+        """
+        for i, token in enumerate(tokens):
+            if token[0] not in IDENTIFIER_KINDS or token[1].lower() != name.lower():
+                continue
+            if i + 1 < len(tokens) and tokens[i + 1][1] == "(" and tokens[i + 1][0] == "punct":
+                continue
+            if i > 0 and tokens[i - 1][0] == "word" and tokens[i - 1][1].upper() == "AS":
+                continue
+            qualified = i >= 2 and tokens[i - 1][1] == "." and tokens[i - 1][0] == "punct"
+            if qualifier is None or (qualified and tokens[i - 2][1].lower() == qualifier.lower()):
+                yield i
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Repairs
+    # Each returns (repaired query, description) or None
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _fix_column(self, query, tokens, name, schema):
+        qualifier, _, column_name = name.rpartition(".")
+        aliases = self._aliases(tokens, schema)
+        referenced = [table for table in dict.fromkeys(aliases.values()) if table is not None]
+        # Only column positions are renamed: not a table after FROM / JOIN, nor the qualifier of "name.column"
+        tables = {position for position, _, _ in self._from_items(tokens)}
+        positions = [i for i in self._references(tokens, column_name, qualifier or None)
+                     if i not in tables and not (i + 1 < len(tokens) and tokens[i + 1][1] == ".")]
+        if not positions:
+            return None
+
+        edits = []
+        if qualifier:
+            table = aliases.get(qualifier.lower())
+            owner = next((t for t in referenced if t != table and closest(column_name, self._columns(schema, t), 1.0)),
+                         None)
+            match = closest(column_name, self._columns(schema, table), 1.0)
+            if match is None and owner is not None:
+                # The column exists under another table of the query: re-qualify it
+                match = closest(column_name, self._columns(schema, owner), 1.0)
+                alias = next(a for a, t in aliases.items() if t == owner)
+                edits += [(tokens[i - 2][2], tokens[i - 2][3], self.quote(alias)) for i in positions]
+            elif match is None:
+                match = closest(column_name, self._columns(schema, table), self.cutoff)
+        else:
+            candidates = [column_name for table in referenced for column_name in self._columns(schema, table)]
+            match = closest(column_name, candidates, self.cutoff)
+
+        if match is None:
+            # A string literal in double quotes (or backticks) reads as an identifier in most dialects
+            if all(tokens[i][0] in ("double", "backtick") for i in positions) and not qualifier:
+                literal = "'" + column_name.replace("'", "''") + "'"
+                return apply_edits(query, [(tokens[i][2], tokens[i][3], literal) for i in positions]), \
+                    f"quoted {column_name} as a string literal"
+            return None
+
+        edits += [(tokens[i][2], tokens[i][3], self.quote(match)) for i in positions]
+        return apply_edits(query, edits), f"column {name} -> {match}"
+
+    def _fix_table(self, query, tokens, name, schema):
+        table_name = name.rpartition(".")[2]
+        match = closest(table_name, list(schema), self.cutoff)
+        if match is None:
+            return None
+        # Only where the name is a table: after FROM / JOIN, and where it qualifies a column ("table.column")
+        tables = {position for position, _, _ in self._from_items(tokens)}
+        positions = [i for i in self._references(tokens, table_name) if i in tables]
+        if not positions:
+            return None
+        positions += [i for i in self._references(tokens, table_name)
+                      if i + 1 < len(tokens) and tokens[i + 1][1] == "." and tokens[i + 1][0] == "punct"]
+        return apply_edits(query, [(tokens[i][2], tokens[i][3], self.quote(match)) for i in positions]), \
+            f"table {name} -> {match}"
+
+    def _fix_ambiguous(self, query, tokens, name, schema):
+        column_name = name.rpartition(".")[2]
+        aliases = self._aliases(tokens, schema)
+        owner_alias = next((alias for alias, table in aliases.items()
+                            if table is not None and closest(column_name, self._columns(schema, table), 1.0)), None)
+        if owner_alias is None:
+            return None
+        edits = []
+        for i in self._references(tokens, column_name):
+            qualified = i > 0 and tokens[i - 1][1] == "." and tokens[i - 1][0] == "punct"
+            qualifier_follows = i + 1 < len(tokens) and tokens[i + 1][1] == "."
+            if not qualified and not qualifier_follows:
+                edits.append((tokens[i][2], tokens[i][2], f"{self.quote(owner_alias)}."))
+        if not edits:
+            return None
+        return apply_edits(query, edits), f"qualified {column_name} with {owner_alias}"
+
+    def _fix_function(self, query, tokens, name, schema):
+        function_name = name.rpartition(".")[2].upper()
+        rewrite = FUNCTION_REWRITES.get(self.dialect, {}).get(function_name)
+        if rewrite is None:
+            return None
+        edits = []
+        for i, token in enumerate(tokens):
+            if token[0] != "word" or token[1].upper() != function_name:
+                continue
+            if not (i + 1 < len(tokens) and tokens[i + 1][1] == "("):
+                continue
+            arguments, close = split_arguments(tokens, query, i + 1)
+            if arguments is None:
+                return None
+            replacement = rewrite(arguments)
+            if replacement is None:
+                return None
+            edits.append((token[2], tokens[close][3], replacement))
+        if not edits:
+            return None
+        # Nested calls of the same function are rewritten by the next round
+        edits = [edit for edit in edits if not any(o[0] < edit[0] and edit[1] <= o[1] for o in edits)]
+        return apply_edits(query, edits), f"rewrote {function_name}() for {self.dialect}"
+
+    def _fix_quoting(self, query, tokens):
+        """Re-quotes identifiers written with the quotes of another dialect."""
+        foreign = {"postgresql": ("backtick", "bracket"), "mysql": ("bracket",)}.get(self.dialect, ())
+        edits = [(start, end, self.quote(value)) for kind, value, start, end in tokens if kind in foreign]
+        if not edits:
+            return None
+        return apply_edits(query, edits), f"re-quoted identifiers for {self.dialect}"
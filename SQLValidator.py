@@ -0,0 +1,293 @@
+import re
+import time
+
+from sqlalchemy import text
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Non-executing SQL validation
+# A static pass over the tokens of the query rejects what it can prove wrong against the cached schema (writes,
+# multiple statements, unbalanced quotes/parentheses, unknown tables and columns). Everything else is checked with the
+# dialect's EXPLAIN, which parses and plans the query without reading any data.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+TOKEN_PATTERN = re.compile(r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<double>"(?:[^"]|"")*")
+    | (?P<backtick>`(?:[^`]|``)*`)
+    | (?P<bracket>\[[^\]]*\])
+    | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<param>[:@?$][A-Za-z0-9_]*)
+    | (?P<punct><>|<=|>=|!=|\|\||::|[(),.;*=<>+\-/%])
+    | (?P<space>\s+)
+    | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+WRITE_KEYWORDS = {"INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "CREATE", "REPLACE", "TRUNCATE", "ATTACH", "DETACH",
+                  "PRAGMA", "GRANT", "REVOKE", "MERGE", "VACUUM", "REINDEX", "CALL", "EXEC", "EXECUTE", "COPY", "SET"}
+
+CLAUSE_KEYWORDS = {"WHERE", "GROUP", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "INTERSECT", "EXCEPT", "ON",
+                   "USING", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "OUTER", "WINDOW", "AS",
+                   "SELECT", "FROM", "LATERAL", "FETCH", "FOR"}
+
+# Keywords that can precede a parenthesis without making it a function call: "IN (", "EXISTS (", "AND (", ...
+NON_FUNCTION_KEYWORDS = {"IN", "EXISTS", "ANY", "ALL", "SOME", "AND", "OR", "NOT", "WHEN", "THEN", "ELSE", "BY",
+                         "CASE", "BETWEEN", "IS", "LIKE", "VALUES"}
+
+EXPLAIN_PREFIX = {
+    "sqlite": "EXPLAIN QUERY PLAN ",
+    "postgresql": "EXPLAIN ",
+    "mysql": "EXPLAIN ",
+}
+
+# Quote characters that always denote an identifier in the dialect (SQLite falls back to a string literal for unknown
+# double-quoted names, so only backticks and brackets are unambiguous there)
+IDENTIFIER_QUOTES = {
+    "sqlite": {"backtick", "bracket"},
+    "postgresql": {"double"},
+    "mysql": {"backtick"},
+}
+
+
+def tokenize_sql(query: str) -> list[tuple[str, str]]:
+    """
+    Splits a SQL query into (kind, value) tokens, dropping whitespace and comments.
+    Quoted identifiers keep their kind ('double', 'backtick' or 'bracket') and are returned unquoted.
+
+    Raises:
+        ValueError: If a string literal or quoted identifier is not terminated.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(query):
+        kind, value = match.lastgroup, match.group()
+        if kind in ("space", "comment"):
+            continue
+        if kind == "other":
+            if value in "'\"`[":
+                raise ValueError(f"unterminated quote {value} near: {query[match.start():match.start() + 30]}")
+            tokens.append(("punct", value))
+        elif kind == "double":
+            tokens.append((kind, value[1:-1].replace('""', '"')))
+        elif kind == "backtick":
+            tokens.append((kind, value[1:-1].replace("``", "`")))
+        elif kind == "bracket":
+            tokens.append((kind, value[1:-1]))
+        else:
+            tokens.append((kind, value))
+    return tokens
+
+
+def is_identifier(token) -> bool:
+    return token[0] in ("word", "double", "backtick", "bracket")
+
+
+def opens_function_call(tokens, i) -> bool:
+    """
+    Tells whether the parenthesis at tokens[i] opens the argument list of a function call rather than a subquery, a
+    parenthesized join or an expression.
+    """
+    if i == 0 or not is_identifier(tokens[i - 1]):
+        return False
+    if tokens[i - 1][0] == "word" and tokens[i - 1][1].upper() in CLAUSE_KEYWORDS | NON_FUNCTION_KEYWORDS:
+        return False
+    return not (i + 1 < len(tokens) and tokens[i + 1][0] == "word" and tokens[i + 1][1].upper() in ("SELECT", "WITH"))
+
+
+def referenced_tables(tokens) -> list[str]:
+    """
+    Returns the table names that follow FROM / JOIN in the token list (CTE names included), in order of appearance.
+    """
+    return [name for name, _ in table_references(tokens)]
+
+
+def table_references(tokens) -> list[tuple[str, str]]:
+    """
+    Returns the (table name, alias) pairs that follow FROM / JOIN in the token list, alias None when there is none.
+    FROM within the arguments of a function call (EXTRACT(YEAR FROM d), TRIM(BOTH ' ' FROM s), SUBSTRING(s FROM 2))
+    is not a clause and is skipped.
+    """
+    tables = []
+    calls = []  # one flag per open parenthesis, True for the argument list of a function call
+    i = 0
+    while i < len(tokens):
+        kind, value = tokens[i]
+        if (kind, value) == ("punct", "("):
+            calls.append(opens_function_call(tokens, i))
+            i += 1
+        elif (kind, value) == ("punct", ")"):
+            if calls:
+                calls.pop()
+            i += 1
+        elif kind == "word" and value.upper() in ("FROM", "JOIN") and not (calls and calls[-1]):
+            i += 1
+            while i < len(tokens) and is_identifier(tokens[i]):
+                # Schema-qualified names (main.tracks) keep the last part
+                name = tokens[i][1]
+                while i + 2 < len(tokens) and tokens[i + 1] == ("punct", ".") and is_identifier(tokens[i + 2]):
+                    i += 2
+                    name = tokens[i][1]
+                i += 1
+                alias = None
+                if i < len(tokens) and tokens[i][0] == "word" and tokens[i][1].upper() == "AS":
+                    i += 1
+                if (i < len(tokens) and is_identifier(tokens[i])
+                        and not (tokens[i][0] == "word" and tokens[i][1].upper() in CLAUSE_KEYWORDS)):
+                    alias = tokens[i][1]
+                    i += 1
+                tables.append((name, alias))
+                if i < len(tokens) and tokens[i] == ("punct", ",") and i + 1 < len(tokens) and is_identifier(tokens[i + 1]):
+                    i += 1
+                    continue
+                break
+        else:
+            i += 1
+    return tables
+
+
+def defined_names(tokens) -> set[str]:
+    """
+    Returns the lowercased names the query introduces itself: CTEs with their optional column list
+    ("name AS (" or "name (a, b) AS (", as in WITH RECURSIVE t(n) AS (...)) and aliases ("AS name").
+    """
+    defined = set()
+    for i, token in enumerate(tokens):
+        if not is_identifier(token):
+            continue
+        if i > 0 and tokens[i - 1][0] == "word" and tokens[i - 1][1].upper() == "AS":
+            defined.add(token[1].lower())
+
+        j, columns = i + 1, []
+        if j < len(tokens) and tokens[j] == ("punct", "("):
+            j += 1
+            while j < len(tokens) and is_identifier(tokens[j]):
+                columns.append(tokens[j][1].lower())
+                j += 1
+                if j < len(tokens) and tokens[j] == ("punct", ","):
+                    j += 1
+            if not columns or j >= len(tokens) or tokens[j] != ("punct", ")"):
+                continue
+            j += 1
+        if (j + 1 < len(tokens) and tokens[j][0] == "word" and tokens[j][1].upper() == "AS"
+                and tokens[j + 1] == ("punct", "(")):
+            defined.add(token[1].lower())
+            defined.update(columns)
+    return defined
+
+
+class SQLValidator:
+    """
+    Validates read-only queries without executing them.
+
+    Attributes:
+        engine: The SQLAlchemy engine used for the EXPLAIN fallback.
+        schema_provider (callable): Returns the cached schema (table name to table data).
+        connect (callable): Returns a context manager yielding a connection, engine.connect by default.
+    """
+
+    def __init__(self, engine, schema_provider, connect=None):
+        self.engine = engine
+        self.schema_provider = schema_provider
+        self.connect = connect or engine.connect
+
+    def validate(self, query: str) -> dict:
+        """
+        Validates the query.
+
+        Returns:
+            dict: 'valid' (bool), 'message' (str), 'strategy' ('static' when the static pass rejected the query,
+                  otherwise 'explain' or, for dialects without EXPLAIN support, 'rollback') and 'latency_ms'.
+        """
+        start = time.perf_counter()
+        error = self.static_check(query)
+        if error is not None:
+            valid, message, strategy = False, error, "static"
+        else:
+            valid, message, strategy = self.explain_check(query)
+
+        return {
+            'valid': valid,
+            'message': message,
+            'strategy': strategy,
+            'latency_ms': (time.perf_counter() - start) * 1000,
+        }
+
+    def static_check(self, query: str):
+        """
+        Returns an error message if the query is certainly invalid for this database, otherwise None.
+        """
+        try:
+            tokens = tokenize_sql(query)
+        except ValueError as e:
+            return f"Syntax error: {e}"
+
+        while tokens and tokens[-1] == ("punct", ";"):
+            tokens.pop()
+        if not tokens:
+            return "Empty query"
+        if ("punct", ";") in tokens:
+            return "Only a single statement is allowed"
+
+        first = tokens[0][1].upper() if tokens[0][0] == "word" else tokens[0][1]
+        if first not in ("SELECT", "WITH"):
+            return f"Only read-only SELECT queries are allowed, got {first}"
+
+        depth = 0
+        for i, (kind, value) in enumerate(tokens):
+            if kind == "punct" and value == "(":
+                depth += 1
+            elif kind == "punct" and value == ")":
+                depth -= 1
+                if depth < 0:
+                    return "Syntax error: unbalanced parentheses"
+            elif kind == "word" and value.upper() in WRITE_KEYWORDS:
+                # Function calls such as REPLACE(...) are fine, statements are not
+                if not (i + 1 < len(tokens) and tokens[i + 1] == ("punct", "(")):
+                    return f"Only read-only SELECT queries are allowed, found {value.upper()}"
+        if depth != 0:
+            return "Syntax error: unbalanced parentheses"
+
+        schema = self.schema_provider()
+        tables = {name.lower() for name in schema}
+        columns = {col.name.lower() for table_data in schema.values() for col in table_data['columns']}
+
+        # Names introduced by the query itself: CTEs (with their column lists) and aliases
+        defined = defined_names(tokens)
+
+        for table_name in referenced_tables(tokens):
+            if table_name.lower() not in tables and table_name.lower() not in defined:
+                return f"no such table: {table_name}"
+
+        identifier_quotes = IDENTIFIER_QUOTES.get(self.engine.dialect.name, set())
+        for i, (kind, value) in enumerate(tokens):
+            if kind not in identifier_quotes:
+                continue
+            name = value.lower()
+            if name in tables or name in columns or name in defined:
+                continue
+            if i + 1 < len(tokens) and tokens[i + 1] == ("punct", "("):
+                continue  # a quoted function name
+            return f"no such column: {value}"
+
+        return None
+
+    def explain_check(self, query: str):
+        """
+        Asks the database to plan the query without running it.
+        Dialects without EXPLAIN support run the query inside a transaction that is always rolled back.
+        """
+        prefix = EXPLAIN_PREFIX.get(self.engine.dialect.name)
+        statement = query.strip().rstrip(";")
+        try:
+            with self.connect() as connection:
+                if prefix is not None:
+                    connection.execute(text(prefix + statement)).fetchall()
+                    return True, "Query is valid", "explain"
+                transaction = connection.begin()
+                try:
+                    connection.execute(text(statement))
+                finally:
+                    transaction.rollback()
+                return True, "Query is valid", "rollback"
+        except Exception as e:
+            return False, str(e), "explain" if prefix is not None else "rollback"
@@ -0,0 +1,212 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+
+from sqlalchemy import text
+
+logger = logging.getLogger("eda.schema_cache")
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Fingerprint queries
+# Each query must be cheap (catalog metadata only) and return a value that changes whenever a table, column or
+# constraint is added, dropped or altered. The value is hashed, so a query may return the catalog text itself. It must
+# also differ between databases of different schemas: snapshots are matched to a database on it (see RuntimeSnapshot).
+# SQLite's PRAGMA schema_version does not qualify, it is a change counter that starts at 1 in every new database.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+FINGERPRINT_QUERIES = {
+    "sqlite": """
+        SELECT group_concat(entry, char(10))
+        FROM (
+            SELECT type || ':' || name || ':' || coalesce(sql, '') AS entry
+            FROM sqlite_master
+            WHERE name NOT LIKE 'sqlite_%'
+            ORDER BY type, name
+        )
+    """,
+    "postgresql": """
+        SELECT md5(coalesce(string_agg(entry, ',' ORDER BY entry), ''))
+        FROM (
+            SELECT table_name || '.' || column_name || ':' || data_type || ':' || is_nullable AS entry
+            FROM information_schema.columns
+            WHERE table_schema = current_schema()
+            UNION ALL
+            SELECT table_name || '#' || constraint_name || ':' || constraint_type
+            FROM information_schema.table_constraints
+            WHERE table_schema = current_schema()
+        ) AS catalog
+    """,
+    "mysql": """
+        SELECT CONCAT(COUNT(*), ':', COALESCE(SUM(CRC32(CONCAT_WS('.', table_name, column_name, column_type,
+                                                                  is_nullable, column_key))), 0))
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE()
+    """,
+}
+
+
+class SchemaCache:
+    """
+    Caches the introspected schema and schema graph of a database.
+
+    The cached snapshot is kept in memory and, when a cache directory is given, pickled to disk so that a restarted
+    process can skip introspection entirely. The snapshot is only rebuilt when the database fingerprint changes
+    (see FINGERPRINT_QUERIES) or when refresh() is called explicitly. Without a fingerprint (a dialect without a
+    fingerprint query, or one that fails) the snapshot is kept until refresh() or invalidate().
+
+    Attributes:
+        engine: The SQLAlchemy engine of the database being cached.
+        loader (callable): Returns a (schema, graph) tuple by introspecting the database.
+        cache_dir (Optional[str]): Directory used to persist the snapshot. None keeps the cache in memory only.
+        check_interval (float): Minimum number of seconds between two fingerprint checks.
+    """
+
+    def __init__(self, engine, loader, cache_dir=None, check_interval=5.0):
+        self.engine = engine
+        self.loader = loader
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self.lock = threading.RLock()
+        self.snapshot = None
+        self.snapshot_size = None  # (snapshot, bytes), see memory_bytes()
+        self.last_check = 0.0
+        self.fingerprint_warned = False  # the lack of a fingerprint is reported once
+
+        if self.cache_dir:
+            self.snapshot = self._load_from_disk()
+
+    @property
+    def snapshot_path(self):
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha256(self.engine.url.render_as_string(hide_password=True).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"schema-{key}.pkl")
+
+    def fingerprint(self):
+        """
+        Returns the current fingerprint of the database schema, or None if the dialect has no fingerprint query.
+        """
+        query = FINGERPRINT_QUERIES.get(self.engine.dialect.name)
+        if query is None:
+            self._warn_no_fingerprint(f"the {self.engine.dialect.name} dialect has no fingerprint query")
+            return None
+
+        try:
+            with self.engine.connect() as connection:
+                value = connection.execute(text(query)).scalar()
+        except Exception as e:
+            self._warn_no_fingerprint(f"the fingerprint query failed: {e}")
+            return None
+        self.fingerprint_warned = False
+        return hashlib.sha256(str(value).encode()).hexdigest()[:16]
+
+    def _warn_no_fingerprint(self, reason):
+        if not self.fingerprint_warned:
+            self.fingerprint_warned = True
+            logger.warning("No schema fingerprint (%s), the schema snapshot is only rebuilt by refresh() or "
+                           "invalidate()", reason)
+
+    def get(self):
+        """
+        Returns the cached snapshot, rebuilding it first if it is missing or its fingerprint is out of date.
+
+        Returns:
+            dict: A dictionary with the keys 'fingerprint', 'schema', 'graph' and 'created_at'.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.snapshot is not None and now - self.last_check < self.check_interval:
+                return self.snapshot
+
+            current = self.fingerprint()
+            self.last_check = now
+            # Without a fingerprint the snapshot cannot be checked, and re-introspecting on every check would cost more
+            # than having no cache at all
+            if self.snapshot is None or (current is not None and self.snapshot['fingerprint'] != current):
+                self._rebuild(current)
+            return self.snapshot
+
+    def get_schema(self):
+        return self.get()['schema']
+
+    def get_graph(self):
+        return self.get()['graph']
+
+    def refresh(self):
+        """
+        Re-introspects the database regardless of the fingerprint and replaces both the in-memory and on-disk snapshot.
+        """
+        with self.lock:
+            self._rebuild(self.fingerprint())
+            self.last_check = time.monotonic()
+            return self.snapshot
+
+    def install(self, snapshot):
+        """
+        Replaces the cached snapshot by one built elsewhere (see RuntimeSnapshot). It is kept for as long as its
+        fingerprint matches the database, which the next get() checks.
+        """
+        with self.lock:
+            self.snapshot = snapshot
+            self.last_check = 0.0
+            self._save_to_disk()
+
+    def memory_bytes(self) -> int:
+        """Approximate size of the snapshot in memory (its pickled size), measured once per snapshot."""
+        with self.lock:
+            if self.snapshot is None:
+                return 0
+            if self.snapshot_size is None or self.snapshot_size[0] is not self.snapshot:
+                self.snapshot_size = (self.snapshot, len(pickle.dumps(self.snapshot)))
+            return self.snapshot_size[1]
+
+    def invalidate(self):
+        """
+        Drops the snapshot so that the next call to get() re-introspects the database.
+        """
+        with self.lock:
+            self.snapshot = None
+            path = self.snapshot_path
+            if path and os.path.exists(path):
+                os.remove(path)
+
+    def _rebuild(self, fingerprint):
+        schema, graph = self.loader()
+        self.snapshot = {
+            'fingerprint': fingerprint,
+            'schema': schema,
+            'graph': graph,
+            'created_at': time.time(),
+        }
+        self._save_to_disk()
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Disk persistence
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _load_from_disk(self):
+        path = self.snapshot_path
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logger.warning("Ignoring unreadable schema snapshot %s: %s", path, e)
+            return None
+
+    def _save_to_disk(self):
+        path = self.snapshot_path
+        if not path:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self.snapshot, f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Error writing schema snapshot %s: %s", path, e)
@@ -0,0 +1,194 @@
+import logging
+import re
+
+from SchemaRenderer import SchemaRenderer, key_columns
+
+logger = logging.getLogger("eda.schema_pruner")
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Question-scoped schema pruning
+# Scores tables against the question, expands the matches along foreign keys and keeps the best tables that fit into
+# the token budget, so the prompts only carry the part of the schema that is relevant to the question. Over the budget,
+# the columns that match nothing in the question are dropped first (lowest ranked tables first), whole tables after.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+TABLE_NAME_WEIGHT = 3.0
+COLUMN_NAME_WEIGHT = 1.0
+VALUE_WEIGHT = 2.0
+HOP_DECAY = 0.5
+
+
+def tokenize(text: str) -> set[str]:
+    """
+    Splits a question or an identifier into normalized words.
+    CamelCase and snake_case identifiers are split ("BillingCountry" -> billing, country) and plurals are reduced.
+    """
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    words = set()
+    for word in re.findall(r"[A-Za-z0-9]+", text.lower()):
+        if len(word) > 3 and word.endswith("ies"):
+            word = word[:-3] + "y"
+        elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.add(word)
+    return words
+
+
+class SchemaPruner:
+    """
+    Selects the subgraph of the schema that is relevant to a question.
+
+    Attributes:
+        hops (int): Number of foreign key hops used to expand the matched tables.
+        token_budget (Optional[int]): Maximum estimated size of the pruned schema in tokens. None disables the limit.
+        value_lookup (Optional[callable]): Called with the question and returns (table, column) pairs whose stored
+                                           values match words of the question.
+        renderer (SchemaRenderer): Renders the schema for the prompts, the budget is measured on its output.
+    """
+
+    def __init__(self, hops=1, token_budget=None, value_lookup=None, renderer=None):
+        self.hops = hops
+        self.token_budget = token_budget
+        self.value_lookup = value_lookup
+        self.renderer = renderer if renderer is not None else SchemaRenderer()
+
+    def score_tables(self, question, schema, value_matches=()):
+        """
+        Scores every table by lexical overlap of the question with the table name, its column names and the
+        (table, column) pairs whose stored values match the question (see match_values).
+
+        Returns:
+            dict: Table name to score. Tables that do not match have a score of 0.
+        """
+        question_words = tokenize(question)
+        scores = {}
+
+        for table_name, table_data in schema.items():
+            score = TABLE_NAME_WEIGHT * len(tokenize(table_name) & question_words)
+            for col in table_data['columns']:
+                score += COLUMN_NAME_WEIGHT * len(tokenize(col.name) & question_words)
+            scores[table_name] = score
+
+        for table_name, _ in value_matches:
+            if table_name in scores:
+                scores[table_name] += VALUE_WEIGHT
+
+        return scores
+
+    def match_values(self, question) -> list:
+        """Returns the (table, column) pairs of the value lookup for the question, empty without a lookup."""
+        if self.value_lookup is None:
+            return []
+        try:
+            return list(self.value_lookup(question))
+        except Exception as e:
+            logger.warning("Error during value lookup for schema pruning: %s", e)
+            return []
+
+    def expand(self, graph, scores):
+        """
+        Propagates the scores of the matched tables along foreign key edges (in both directions) for self.hops hops.
+        A table reached after n hops gets the score of its neighbour multiplied by HOP_DECAY ** n.
+        """
+        expanded = {table: score for table, score in scores.items() if score > 0}
+        frontier = dict(expanded)
+
+        for _ in range(self.hops):
+            next_frontier = {}
+            for table, score in frontier.items():
+                neighbours = set(graph.successors(table)) | set(graph.predecessors(table))
+                for neighbour in neighbours:
+                    edge = graph.get_edge_data(table, neighbour) or graph.get_edge_data(neighbour, table)
+                    if edge.get('relationship') != 'foreign_key':
+                        continue
+                    decayed = score * HOP_DECAY
+                    if decayed > expanded.get(neighbour, 0):
+                        expanded[neighbour] = decayed
+                        next_frontier[neighbour] = decayed
+            frontier = next_frontier
+
+        return expanded
+
+    def column_scores(self, question, table_name, table_data, value_matches=()) -> dict:
+        """
+        Scores the columns of a table for truncation. Key columns are never dropped (score None), the others score
+        by overlap of their name with the question plus VALUE_WEIGHT when their stored values match it.
+        """
+        question_words = tokenize(question)
+        keys = key_columns(table_data)
+        matched = {column_name for table, column_name in value_matches if table == table_name}
+        scores = {}
+        for col in table_data['columns']:
+            if col.name in keys:
+                scores[col.name] = None
+            else:
+                scores[col.name] = (COLUMN_NAME_WEIGHT * len(tokenize(col.name) & question_words)
+                                    + (VALUE_WEIGHT if col.name in matched else 0))
+        return scores
+
+    def prune(self, question, schema, graph):
+        """
+        Returns the part of the schema that is relevant to the question.
+
+        Args:
+            question (str): The user question.
+            schema (dict): Table name to table data, as returned by DatabaseManager.get_schema()['schema'].
+            graph (nx.DiGraph): The schema graph, as returned by DatabaseManager.get_schema_graph()['graph'].
+
+        Returns:
+            tuple: The pruned schema dictionary (tables whose columns were truncated are copies) and a report with
+                   the tables kept and dropped, the columns dropped and the token size of the rendered schema.
+        """
+        value_matches = self.match_values(question)
+        scores = self.expand(graph, self.score_tables(question, schema, value_matches))
+
+        if scores:
+            ranked = sorted((table for table in scores if table in schema), key=lambda table: (-scores[table], table))
+        else:
+            # Nothing matched, so there is no basis for dropping tables other than the budget
+            ranked = sorted(schema)
+
+        costs = {table_name: self.renderer.table_tokens(table_name, schema[table_name]) for table_name in ranked}
+        used_tokens = sum(cost['fixed'] + sum(cost['columns'].values()) for cost in costs.values())
+        dropped_columns = {}
+
+        if self.token_budget is not None and used_tokens > self.token_budget:
+            # Low-relevance columns go first: lowest ranked table, lowest scoring column, last declared column
+            candidates = []
+            for rank, table_name in enumerate(ranked):
+                column_scores = self.column_scores(question, table_name, schema[table_name], value_matches)
+                for position, (column_name, score) in enumerate(column_scores.items()):
+                    if score is not None:
+                        candidates.append((-rank, score, -position, table_name, column_name))
+            for _, _, _, table_name, column_name in sorted(candidates):
+                if used_tokens <= self.token_budget:
+                    break
+                used_tokens -= costs[table_name]['columns'][column_name]
+                dropped_columns.setdefault(table_name, set()).add(column_name)
+
+        kept = list(ranked)
+        while self.token_budget is not None and used_tokens > self.token_budget and len(kept) > 1:
+            table_name = kept.pop()
+            cost = costs[table_name]
+            used_tokens -= cost['fixed'] + sum(tokens for column_name, tokens in cost['columns'].items()
+                                               if column_name not in dropped_columns.get(table_name, ()))
+            dropped_columns.pop(table_name, None)
+
+        pruned = {}
+        for table_name in kept:
+            table_data = schema[table_name]
+            if table_name in dropped_columns:
+                table_data = dict(table_data, columns=[col for col in table_data['columns']
+                                                       if col.name not in dropped_columns[table_name]])
+            pruned[table_name] = table_data
+
+        report = {
+            'tables_total': len(schema),
+            'tables_kept': len(pruned),
+            'tables_dropped': len(schema) - len(pruned),
+            'kept': list(pruned),
+            'columns_dropped': {table: sorted(columns) for table, columns in dropped_columns.items()},
+            'estimated_tokens': used_tokens,
+            'token_budget': self.token_budget,
+        }
+        return pruned, report
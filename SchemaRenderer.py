@@ -0,0 +1,136 @@
+from token_counter import count_tokens
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Compact schema serialization for prompts
+# The schema dictionary holds pydantic column/foreign_relation models whose repr repeats every field name for every
+# column. The renderer writes the same information as DDL or as one line per table, which the models read just as well
+# at a fraction of the tokens.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+STYLES = ("ddl", "compact")
+
+
+def primary_key_columns(table_data) -> list:
+    primary_key = table_data.get('primary_key') or {}
+    if isinstance(primary_key, dict):
+        return list(primary_key.get('constrained_columns') or [])
+    return [primary_key] if isinstance(primary_key, str) else list(primary_key)
+
+
+def key_columns(table_data) -> set:
+    """Returns the names of the primary and foreign key columns of a table."""
+    keys = set(primary_key_columns(table_data))
+    for fk in table_data.get('foreign_keys') or []:
+        keys.update(fk.constrained_column)
+    return keys
+
+
+class SchemaRenderer:
+    """
+    Renders a schema dictionary (see DatabaseManager.get_schema) as prompt text.
+
+    Attributes:
+        style (str): 'ddl' writes a CREATE TABLE statement per table, 'compact' one line per table such as
+                     "invoices(InvoiceId INTEGER PK, CustomerId INTEGER NOT NULL -> customers.CustomerId)".
+        include_nullability (bool): Mark NOT NULL columns.
+        include_defaults (bool): Write column defaults.
+    """
+
+    def __init__(self, style="ddl", include_nullability=True, include_defaults=False):
+        if style not in STYLES:
+            raise ValueError(f"Unknown schema style {style!r}, expected one of {STYLES}")
+        self.style = style
+        self.include_nullability = include_nullability
+        self.include_defaults = include_defaults
+
+    def render(self, schema: dict) -> str:
+        """Returns the prompt text of the whole schema."""
+        separator = "\n\n" if self.style == "ddl" else "\n"
+        return separator.join(self.render_table(table_name, table_data) for table_name, table_data in schema.items())
+
+    def render_table(self, table_name, table_data) -> str:
+        parts, _ = self.table_parts(table_name, table_data)
+        return ("\n" if self.style == "ddl" else "").join(parts)
+
+    def table_tokens(self, table_name, table_data) -> dict:
+        """
+        Returns the token cost of a rendered table split into 'fixed' (the table line and table constraints) and
+        'columns' (column name to the cost of its definition), so that a budget can price dropping single columns.
+        """
+        parts, columns = self.table_parts(table_name, table_data)
+        costs = {}
+        fixed = 0
+        for part, column_name in zip(parts, columns):
+            tokens = count_tokens(part)
+            if column_name is None:
+                fixed += tokens
+            else:
+                costs[column_name] = tokens
+        return {'fixed': fixed, 'columns': costs}
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Column and table pieces
+    # Both styles build a table from parts, each one tagged with the column it describes (None for the table itself)
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _references(self, table_data) -> dict:
+        """Maps single-column foreign keys to "table(column)"; composite keys are written as table constraints."""
+        references = {}
+        for fk in table_data.get('foreign_keys') or []:
+            if len(fk.constrained_column) == 1 and fk.referenced_table and len(fk.referenced_column or []) == 1:
+                references[fk.constrained_column[0]] = (fk.referenced_table, fk.referenced_column[0])
+        return references
+
+    def _column(self, col, single_primary_key, references, compact) -> str:
+        words = [col.name, col.type]
+        if col.name == single_primary_key:
+            words.append("PK" if compact else "PRIMARY KEY")
+        elif self.include_nullability and not col.nullable:
+            words.append("NOT NULL")
+        if self.include_defaults and col.default is not None:
+            words.append(f"DEFAULT {col.default}")
+        if col.name in references:
+            table, column_name = references[col.name]
+            words.append(f"-> {table}.{column_name}" if compact else f"REFERENCES {table}({column_name})")
+        return " ".join(words)
+
+    def _constraints(self, table_data, primary_key, references, compact) -> list:
+        constraints = []
+        if len(primary_key) > 1:
+            constraints.append(f"{'PK' if compact else 'PRIMARY KEY'} ({', '.join(primary_key)})")
+        for fk in table_data.get('foreign_keys') or []:
+            if fk.constrained_column and fk.constrained_column[0] in references:
+                continue
+            referenced = ", ".join(fk.referenced_column or [])
+            if compact:
+                constraints.append(f"FK ({', '.join(fk.constrained_column)}) -> {fk.referenced_table}({referenced})")
+            else:
+                constraints.append(f"FOREIGN KEY ({', '.join(fk.constrained_column)}) "
+                                   f"REFERENCES {fk.referenced_table}({referenced})")
+        return constraints
+
+    def _definitions(self, table_data, compact) -> list:
+        """Returns (definition, column name or None) for the columns and then the table constraints."""
+        primary_key = primary_key_columns(table_data)
+        single_primary_key = primary_key[0] if len(primary_key) == 1 else None
+        references = self._references(table_data)
+        definitions = [(self._column(col, single_primary_key, references, compact), col.name)
+                       for col in table_data['columns']]
+        definitions += [(constraint, None) for constraint in
+                        self._constraints(table_data, primary_key, references, compact)]
+        return definitions
+
+    def table_parts(self, table_name, table_data):
+        """Returns the rendered parts of a table and, for each part, the column it defines (None for the rest)."""
+        compact = self.style == "compact"
+        definitions = self._definitions(table_data, compact)
+        parts, columns = [f"{table_name}(" if compact else f"CREATE TABLE {table_name} ("], [None]
+        for i, (definition, column_name) in enumerate(definitions):
+            if compact:
+                parts.append(definition if i == 0 else f", {definition}")
+            else:
+                parts.append(f"  {definition}{',' if i < len(definitions) - 1 else ''}")
+            columns.append(column_name)
+        parts.append(")" if compact else ");")
+        columns.append(None)
+        return parts, columns
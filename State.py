@@ -72,14 +72,29 @@ class InputState(TypedDict):
 
 class OutputState(TypedDict):
     schema : Dict[str,Table]
+    schema_text: str
+    schema_pruning: Dict[str, Any]
+    plan_cache_hit: bool
     parsed_question: Dict[str, Any]
     error: str
+    error_type: str
     unique_nouns: List[str]
     sql_query: str
     sql_valid: bool
     sql_issues: str
+    sql_repair: Dict[str, Any]
+    validation_strategy: str
+    validation_ms: float
     results: List[Any]
+    results_truncated: bool
+    results_digest: Any
+    results_tokens: Dict[str, Any]
     answer: Annotated[Any, operator.add]
     visualization: Annotated[str, operator.add]
     visualization_reason: Annotated[str, operator.add]
-    formatted_data_for_visualization: Dict[str, Any]
\ No newline at end of file
+    visualization_confidence: float
+    visualization_method: str
+    formatted_data_for_visualization: Dict[str, Any]
+
+class OverallState(InputState, OutputState):
+    pass
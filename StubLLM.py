@@ -0,0 +1,80 @@
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage
+from pydantic import BaseModel
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Deterministic stand-in for ChatOpenAI
+# Lets the workflow, the HTTP service and the benchmarks run locally without network access or API credits:
+# LLMManager(llm=StubChatModel(...)).
+# -----------------------------------------------------------------------------------------------------------------------------
+
+# Canned responses for the prompts of this repository, matched on a phrase of each prompt. Without more specific
+# responses every question is treated as not relevant to the database, which exercises the full graph cheaply.
+DEFAULT_RESPONSES = [
+    ("parse user questions", {"BaseTable": "", "columns": [], "relevant_tables": [], "noun_columns": [],
+                              "is_relevant": False}),
+    ("generates SQL queries", "NOT_ENOUGH_INFO"),
+    ("recommends appropriate data visualizations", "Recommended Visualization: none\nReason: Stub response."),
+    ("labeling expert", "Value"),
+    ("formats database query results", "Stub answer."),
+    ("Data expert who formats data", "{}"),
+]
+
+
+class StubChatModel:
+    """
+    Minimal chat model with the interface LLMManager relies on (invoke, ainvoke, with_structured_output).
+
+    Responses are looked up by prompt: the first (phrase, response) pair whose phrase occurs in the rendered messages
+    wins. A response is a string, a dict (validated against the structured output parser) or a callable that receives
+    the rendered prompt text and returns one of those.
+
+    Attributes:
+        responses (list[tuple]): The (phrase, response) pairs, checked in order before DEFAULT_RESPONSES.
+        default (str): Returned when no phrase matches.
+        latency (float): Seconds every call takes, to simulate the network round trip.
+        calls (int): Number of calls served so far.
+    """
+
+    def __init__(self, responses=None, default="", latency=0.0, model_name="stub", temperature=0):
+        self.responses = list(responses or []) + DEFAULT_RESPONSES
+        self.default = default
+        self.latency = latency
+        self.model_name = model_name
+        self.temperature = temperature
+        self.parser = None
+        self.calls = 0
+
+    def with_structured_output(self, parser):
+        structured = StubChatModel(default=self.default, latency=self.latency, model_name=self.model_name,
+                                   temperature=self.temperature)
+        structured.responses = self.responses
+        structured.parser = parser
+        return structured
+
+    def respond(self, messages):
+        self.calls += 1
+        prompt = "\n".join(str(message.content) for message in messages)
+        response = self.default
+        for phrase, candidate in self.responses:
+            if phrase in prompt:
+                response = candidate(prompt) if callable(candidate) else candidate
+                break
+
+        if self.parser is not None:
+            if isinstance(self.parser, type) and issubclass(self.parser, BaseModel):
+                return self.parser.model_validate(response)
+            return response
+        return AIMessage(content=response)
+
+    def invoke(self, messages, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(messages)
+
+    async def ainvoke(self, messages, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(messages)
@@ -0,0 +1,273 @@
+import contextvars
+import functools
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Tracing and metrics
+# Every workflow node, LLM call and query execution is timed and counted here. Measurements carry the trace ID of the
+# request (the uuid given to run_sql_agent) and the node they happened in, both held in context variables so they
+# follow the work into LangGraph's worker threads and asyncio tasks. Metrics are exported in the Prometheus text format
+# (server /metrics or a file), events as one JSON object per line on the "eda.telemetry" logger.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+trace_id = contextvars.ContextVar("trace_id", default=None)
+current_node = contextvars.ContextVar("current_node", default=None)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+# Name -> (type, help[, histogram buckets]) of every exported metric. Histograms without buckets use DEFAULT_BUCKETS.
+METRICS = {
+    "eda_requests_total": ("counter", "Questions answered, by status."),
+    "eda_request_duration_seconds": ("histogram", "Wall time of a whole question."),
+    "eda_node_duration_seconds": ("histogram", "Wall time of a workflow node, by node and status."),
+    "eda_llm_calls_total": ("counter", "LLM calls by node, task class, model and response cache result."),
+    "eda_llm_duration_seconds": ("histogram", "Wall time of LLM calls that missed the response cache."),
+    "eda_llm_prompt_tokens_total": ("counter", "Prompt tokens sent to the LLM (cache misses only)."),
+    "eda_llm_completion_tokens_total": ("counter", "Completion tokens received from the LLM (cache misses only)."),
+    "eda_llm_retries_total": ("counter", "LLM attempts retried after an error, by model."),
+    "eda_llm_fallbacks_total": ("counter", "Calls sent to the fallback route, by task class and reason (slo, error)."),
+    "eda_prompt_tokens": ("histogram", "Size of the prompts built by each node, in tokens.", TOKEN_BUCKETS),
+    "eda_db_queries_total": ("counter", "Queries executed by DatabaseManager.execute_query, by status."),
+    "eda_db_query_duration_seconds": ("histogram", "Wall time of query execution, including streaming the rows."),
+    "eda_db_rows_total": ("counter", "Rows returned by executed queries."),
+    "eda_result_cache_lookups_total": ("counter", "Result cache lookups by outcome (hits, stale_hits, misses, bypassed)."),
+    "eda_fix_sql_attempts_total": ("counter", "LLM attempts made by fix_sql."),
+    "eda_sql_repairs_total": ("counter", "Invalid queries handled by fix_sql, by outcome (local, llm, failed)."),
+    "eda_visualization_choices_total": ("counter", "Charts chosen by the rules, or deferred to the LLM, by chart type."),
+    "eda_chart_labels_total": ("counter", "Chart axis labels taken from the column names or asked from the LLM."),
+    "eda_plan_cache_lookups_total": ("counter", "Plan cache lookups by result."),
+    "eda_tenant_runtimes_total": ("counter", "Tenant runtimes opened, and closed by reason (idle, capacity, memory)."),
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    # Integers are written in full and floats with every digit (repr), "{:g}" would round to 6 significant digits
+    if isinstance(value, int):
+        return str(value)
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Telemetry:
+    """
+    Thread-safe registry of counters and histograms plus the structured event log.
+
+    Attributes:
+        buckets (tuple[float]): Upper bounds of the duration histogram buckets in seconds.
+        logger (logging.Logger): Receives one JSON document per event. Silent unless a handler is configured, see
+                                 configure_logging() (or set EDA_TELEMETRY_LOG to a path or "-" for stderr).
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("eda.telemetry")
+        if os.getenv("EDA_TELEMETRY_LOG"):
+            self.configure_logging(os.getenv("EDA_TELEMETRY_LOG"))
+
+    def configure_logging(self, path="-"):
+        """Writes the JSON events to a file, or to stderr for "-"."""
+        handler = logging.StreamHandler(sys.stderr) if path == "-" else logging.FileHandler(path)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger.addHandler(handler)
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Recording
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def count(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def bucket_bounds(self, name):
+        definition = METRICS.get(name, ())
+        return definition[2] if len(definition) > 2 else self.buckets
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        bounds = self.bucket_bounds(name)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(bounds), 0.0, 0]
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def event(self, event, **fields):
+        """Logs a JSON event stamped with the current trace ID and node."""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        record = {"ts": round(time.time(), 6), "event": event, "trace_id": trace_id.get(), "node": current_node.get()}
+        record.update(fields)
+        self.logger.info(json.dumps(record, default=str))
+
+    @contextmanager
+    def request(self, request_trace_id):
+        """
+        Runs a whole question under the given trace ID and records its duration and outcome.
+        """
+        token = trace_id.set(request_trace_id)
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            self.count("eda_requests_total", status=status)
+            self.observe("eda_request_duration_seconds", duration)
+            self.event("request", status=status, duration_ms=round(duration * 1000, 3))
+            trace_id.reset(token)
+
+    def instrument_node(self, name, func):
+        """Wraps a sync workflow node so that its wall time and outcome are recorded."""
+        @functools.wraps(func)
+        def node(state):
+            token = current_node.set(name)
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                return func(state)
+            except BaseException:
+                status = "error"
+                raise
+            finally:
+                self._node_done(name, status, time.perf_counter() - start)
+                current_node.reset(token)
+        return node
+
+    def ainstrument_node(self, name, func):
+        """Async variant of instrument_node."""
+        @functools.wraps(func)
+        async def node(state):
+            token = current_node.set(name)
+            start = time.perf_counter()
+            status = "ok"
+            try:
+                return await func(state)
+            except BaseException:
+                status = "error"
+                raise
+            finally:
+                self._node_done(name, status, time.perf_counter() - start)
+                current_node.reset(token)
+        return node
+
+    def _node_done(self, name, status, duration):
+        self.observe("eda_node_duration_seconds", duration, node=name, status=status)
+        self.event("node", status=status, duration_ms=round(duration * 1000, 3))
+
+    def record_llm(self, model, duration, prompt_tokens, completion_tokens, cache_hit, task="default"):
+        node = current_node.get() or "none"
+        self.count("eda_llm_calls_total", node=node, task=task, model=model, cache="hit" if cache_hit else "miss")
+        self.observe("eda_prompt_tokens", prompt_tokens, node=node)
+        if not cache_hit:
+            self.observe("eda_llm_duration_seconds", duration, node=node, model=model)
+            self.count("eda_llm_prompt_tokens_total", prompt_tokens, node=node, model=model)
+            self.count("eda_llm_completion_tokens_total", completion_tokens, node=node, model=model)
+        self.event("llm", task=task, model=model, cache_hit=cache_hit, duration_ms=round(duration * 1000, 3),
+                   prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def record_query(self, duration, rows, status, truncated=False, guard_action=None, cost=None):
+        self.count("eda_db_queries_total", status=status)
+        self.observe("eda_db_query_duration_seconds", duration, status=status)
+        self.count("eda_db_rows_total", rows)
+        self.event("query", status=status, duration_ms=round(duration * 1000, 3), rows=rows, truncated=truncated,
+                   guard_action=guard_action, cost=cost)
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Export
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def render_prometheus(self, gauges=()):
+        """
+        Returns every metric in the Prometheus text exposition format.
+
+        Args:
+            gauges: Extra (name, labels dict, value, help) samples exported as gauges, e.g. connection pool state.
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(buckets), total, count) for key, (buckets, total, count) in self.histograms.items()}
+
+        lines = []
+        for name, (kind, help_text, *_) in METRICS.items():
+            if kind == "counter":
+                samples = [(labels, value) for (metric, labels), value in counters.items() if metric == name]
+                if not samples:
+                    continue
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [f"{name}{_format_labels(labels)} {_format_value(value)}"
+                          for labels, value in sorted(samples)]
+            else:
+                samples = [(labels, data) for (metric, labels), data in histograms.items() if metric == name]
+                if not samples:
+                    continue
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for labels, (buckets, total, count) in sorted(samples):
+                    for bound, bucket_count in zip(self.bucket_bounds(name), buckets):
+                        bucket_labels = labels + (('le', _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {bucket_count}")
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        described = set()
+        for name, labels, value, help_text in gauges:
+            if name not in described:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+                described.add(name)
+            lines.append(f"{name}{_format_labels(_label_key(labels))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path, gauges=()):
+        """Writes the metrics to a file atomically, for the node exporter's textfile collector."""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            f.write(self.render_prometheus(gauges))
+        os.replace(temporary, path)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+# The process-wide registry used by every component
+telemetry = Telemetry()
@@ -0,0 +1,259 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from Telemetry import telemetry
+
+logger = logging.getLogger("eda.tenant_registry")
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Per-tenant runtimes
+# One process answers questions on many databases. Each tenant (a customer, or just a database) gets its own runtime on
+# its first question: a DatabaseManager (engine, connection pool, schema cache, value index and result cache), a
+# SQLAgent with its own plan cache, and a compiled graph. The LLM client is shared by all tenants. Runtimes are kept in
+# LRU order. A runtime is closed when the registry holds more than max_open of them, when its memory estimate pushes
+# the total over max_bytes, or after it has been idle for idle_timeout seconds. A runtime that is still answering a
+# question is never closed.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+class UnknownTenant(KeyError):
+    """Raised for a tenant the registry has no database for."""
+
+
+class TenantRuntime:
+    """
+    The components answering the questions of one tenant.
+
+    Attributes:
+        tenant (str): The tenant identifier, None for the default database of a WorkflowManager.
+        db_manager (DatabaseManager): Engine, schema cache, value index and result cache of the tenant's database.
+        sql_agent (SQLAgent): The workflow nodes, bound to db_manager.
+        app: The compiled workflow.
+        leases (int): Questions (or batches) currently using the runtime.
+        last_used (float): time.monotonic() of the last release.
+    """
+
+    def __init__(self, tenant, db_manager, sql_agent, app):
+        self.tenant = tenant
+        self.db_manager = db_manager
+        self.sql_agent = sql_agent
+        self.app = app
+        self.leases = 0
+        self.last_used = time.monotonic()
+
+    def memory_bytes(self) -> int:
+        return self.db_manager.memory_bytes()
+
+    def close(self):
+        self.sql_agent.close()
+        self.db_manager.close()
+
+
+class TenantRegistry:
+    """
+    Thread-safe LRU registry of tenant runtimes, built on first use.
+
+    Attributes:
+        tenants (dict | callable): Maps a tenant to its database, given either as a db_url or as a dict with 'db_url'
+                                   and optional 'snapshot' (see RuntimeSnapshot) and DatabaseManager arguments. A
+                                   callable tenant -> database (None for an unknown tenant) resolves tenants on demand,
+                                   e.g. from a catalog table.
+        build (callable): build(tenant, database, cache_dir) -> TenantRuntime.
+        max_open (int): Runtimes, and so database engines, kept open at once.
+        max_bytes (int): Budget of the summed memory estimates of the runtimes (see DatabaseManager.memory_bytes),
+                         None disables it.
+        idle_timeout (float): Seconds after its last question that a runtime is closed. None disables the timeout.
+        cache_dir (str): Parent of the per-tenant cache directories, None keeps every cache in memory.
+    """
+
+    def __init__(self, tenants, build, max_open=16, max_bytes=512 * 1024 * 1024, idle_timeout=600.0,
+                 cache_dir=".eda_cache"):
+        self.tenants = tenants
+        self.build = build
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.runtimes = OrderedDict()  # tenant -> TenantRuntime, least recently used first
+        self.building = {}  # tenant -> [lock held while its runtime is built, so that it is built once, callers]
+        self.stats = {'hits': 0, 'builds': 0, 'idle': 0, 'capacity': 0, 'memory': 0}
+
+    def resolve(self, tenant) -> dict:
+        """
+        Returns the database of a tenant as a dict with at least 'db_url'.
+
+        Raises:
+            UnknownTenant: If the tenant has no database.
+        """
+        database = self.tenants(tenant) if callable(self.tenants) else self.tenants.get(tenant)
+        if database is None:
+            raise UnknownTenant(tenant)
+        return {'db_url': database} if isinstance(database, str) else dict(database)
+
+    def tenant_cache_dir(self, tenant):
+        """Schema snapshots, value indexes and plans of a tenant are kept apart from those of the others."""
+        if not self.cache_dir:
+            return None
+        key = hashlib.sha256(str(tenant).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, "tenants", key)
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Leasing
+    # A runtime is leased for the duration of a question. Leased runtimes are skipped by eviction, so the total can go
+    # over max_open or max_bytes while many tenants are busy; it is brought back down as their questions finish.
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def acquire(self, tenant) -> TenantRuntime:
+        """
+        Returns the runtime of a tenant, building it on first use. Hand it back with release().
+
+        Raises:
+            UnknownTenant: If the tenant has no database.
+        """
+        runtime = self._lease(tenant)
+        if runtime is not None:
+            return runtime
+
+        with self.lock:
+            building = self.building.setdefault(tenant, [threading.Lock(), 0])
+            building[1] += 1
+        try:
+            with building[0]:
+                runtime = self._lease(tenant)  # built by a concurrent caller while this one waited
+                if runtime is not None:
+                    return runtime
+                start = time.perf_counter()
+                runtime = self.build(tenant, self.resolve(tenant), self.tenant_cache_dir(tenant))
+                runtime.leases = 1
+                with self.lock:
+                    self.runtimes[tenant] = runtime
+                    self.stats['builds'] += 1
+        finally:
+            # Dropped by the last caller only: after a failed build, the callers still waiting on the lock and those
+            # arriving now must take turns, not build side by side with a fresh lock
+            with self.lock:
+                building[1] -= 1
+                if building[1] == 0:
+                    self.building.pop(tenant, None)
+        telemetry.count("eda_tenant_runtimes_total", event="opened")
+        telemetry.event("tenant_opened", tenant=tenant, duration_ms=round((time.perf_counter() - start) * 1000, 3))
+        self.evict()
+        return runtime
+
+    def _lease(self, tenant):
+        with self.lock:
+            runtime = self.runtimes.get(tenant)
+            if runtime is None:
+                return None
+            runtime.leases += 1
+            self.runtimes.move_to_end(tenant)
+            self.stats['hits'] += 1
+            return runtime
+
+    def release(self, runtime):
+        """Hands back a runtime returned by acquire(), then closes the runtimes that are over the limits."""
+        with self.lock:
+            runtime.leases -= 1
+            runtime.last_used = time.monotonic()
+        self.evict()
+
+    @contextmanager
+    def lease(self, tenant):
+        """Holds the runtime of a tenant for the duration of the block."""
+        runtime = self.acquire(tenant)
+        try:
+            yield runtime
+        finally:
+            self.release(runtime)
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Eviction
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def evict(self) -> list:
+        """
+        Closes the idle runtimes that are past idle_timeout, then the least recently used idle runtimes until the
+        registry is within max_open and max_bytes. Runs after every acquire and release; call it periodically as
+        well so that idle tenants are closed when no questions arrive.
+
+        Returns:
+            list[tuple]: The (tenant, reason) pairs of the closed runtimes.
+        """
+        sizes = {}
+        if self.max_bytes is not None:
+            with self.lock:
+                runtimes = list(self.runtimes.items())
+            # Measured outside the lock, it reads the value indexes
+            sizes = {tenant: self._memory_bytes(runtime) for tenant, runtime in runtimes}
+
+        now = time.monotonic()
+        victims = []
+        with self.lock:
+            idle = [tenant for tenant, runtime in self.runtimes.items() if runtime.leases == 0]
+            if self.idle_timeout is not None:
+                for tenant in list(idle):
+                    if now - self.runtimes[tenant].last_used > self.idle_timeout:
+                        victims.append((tenant, "idle"))
+                        idle.remove(tenant)
+            remaining = len(self.runtimes) - len(victims)
+            total = sum(sizes.get(tenant, 0) for tenant in self.runtimes if (tenant, "idle") not in victims)
+            for tenant in idle:
+                if remaining > self.max_open:
+                    reason = "capacity"
+                elif self.max_bytes is not None and total > self.max_bytes and remaining > 1:
+                    # The last runtime is kept however large, closing it would only rebuild it on the next question
+                    reason = "memory"
+                else:
+                    break
+                victims.append((tenant, reason))
+                remaining -= 1
+                total -= sizes.get(tenant, 0)
+            closed = [(self.runtimes.pop(tenant), reason) for tenant, reason in victims]
+            for _, reason in victims:
+                self.stats[reason] += 1
+
+        for runtime, reason in closed:
+            self._close(runtime, reason)
+        return victims
+
+    def close_all(self):
+        """Closes every runtime, e.g. on shutdown. Runtimes still in use are closed as well."""
+        with self.lock:
+            closed = list(self.runtimes.values())
+            self.runtimes.clear()
+        for runtime in closed:
+            self._close(runtime, "shutdown")
+
+    @staticmethod
+    def _memory_bytes(runtime):
+        try:
+            return runtime.memory_bytes()
+        except Exception:
+            return 0  # closed by a concurrent eviction since it was listed
+
+    @staticmethod
+    def _close(runtime, reason):
+        try:
+            runtime.close()
+        except Exception as e:
+            logger.warning("Error closing tenant %s: %s", runtime.tenant, e)
+        telemetry.count("eda_tenant_runtimes_total", event=reason)
+        telemetry.event("tenant_closed", tenant=runtime.tenant, reason=reason)
+
+    def snapshot(self) -> dict:
+        """Returns the open tenants with their leases, idle seconds and memory estimate, and the counters."""
+        now = time.monotonic()
+        with self.lock:
+            runtimes = list(self.runtimes.items())
+            stats = dict(self.stats)
+        tenants = {tenant: {'leases': runtime.leases, 'idle_s': round(now - runtime.last_used, 1),
+                            'memory_bytes': self._memory_bytes(runtime)} for tenant, runtime in runtimes}
+        return {'open': len(tenants), 'max_open': self.max_open,
+                'memory_bytes': sum(tenant['memory_bytes'] for tenant in tenants.values()),
+                'max_bytes': self.max_bytes, 'tenants': tenants, 'stats': stats}
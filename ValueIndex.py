@@ -0,0 +1,309 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+
+from sqlalchemy import text
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Sidecar index of the distinct values stored in noun-bearing columns
+# The values are stored once in a local SQLite file together with a trigram inverted index, so finding the stored
+# values that are close to the words of a question never touches the main database.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+TEXT_TYPES = ("CHAR", "TEXT", "CLOB", "STRING")
+
+# Sum of a hash of every value of the column, so that values updated in place change the probe. SQLite has no hash
+# function, eda_crc32 is registered on the probing connection. Other dialects fall back to the summed lengths.
+CONTENT_CHECKSUMS = {
+    "sqlite": "SUM(eda_crc32({column}))",
+    "postgresql": "SUM(hashtext({column}::text)::bigint)",
+    "mysql": "SUM(CRC32({column}))",
+}
+DEFAULT_CONTENT_CHECKSUM = "SUM(LENGTH({column}))"
+
+
+def crc32(value):
+    return None if value is None else zlib.crc32(str(value).encode())
+
+
+def trigrams(value: str, min_word_length=1) -> set[str]:
+    """
+    Returns the padded character trigrams of every word in the value ("USA" -> "  u", " us", "usa", "sa ").
+    Words shorter than min_word_length are skipped.
+    """
+    grams = set()
+    for word in re.findall(r"\w+", value.lower()):
+        if len(word) < min_word_length:
+            continue
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class ValueIndex:
+    """
+    Trigram index over the distinct values of noun-bearing columns.
+
+    Columns are indexed the first time they are looked up (or up front with build()). Every refresh_interval seconds
+    a version probe (row count, a checksum of the column's values and, on SQLite, the max rowid) is compared with the
+    indexed version: appended rows are indexed incrementally, any other change, updates in place included, rebuilds
+    that column. Changes made since the last probe go unnoticed for up to refresh_interval seconds.
+
+    Attributes:
+        engine: The SQLAlchemy engine of the database whose values are indexed.
+        path (str): Location of the sidecar SQLite file, ":memory:" when no cache directory is given.
+        refresh_interval (float): Minimum number of seconds between two version probes of the same column.
+        min_hits (int): Minimum number of shared trigrams for a value to be considered a match.
+    """
+
+    def __init__(self, engine, cache_dir=None, refresh_interval=60.0, min_hits=3):
+        self.engine = engine
+        self.refresh_interval = refresh_interval
+        self.min_hits = min_hits
+        self.lock = threading.RLock()  # guards the sidecar connection, never held while the main database is read
+        self.last_probe = {}
+        self.column_locks = {}  # (table, column) -> lock held while that column is probed and re-indexed
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            key = hashlib.sha256(engine.url.render_as_string(hide_password=True).encode()).hexdigest()[:16]
+            self.path = os.path.join(cache_dir, f"values-{key}.sqlite")
+        else:
+            self.path = ":memory:"
+
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS indexed_columns (
+                table_name TEXT, column_name TEXT, row_count INTEGER, max_rowid INTEGER, built_at REAL,
+                checksum TEXT, PRIMARY KEY (table_name, column_name));
+            CREATE TABLE IF NOT EXISTS vals (
+                id INTEGER PRIMARY KEY, table_name TEXT, column_name TEXT, value TEXT, gram_count INTEGER,
+                UNIQUE (table_name, column_name, value));
+            CREATE TABLE IF NOT EXISTS grams (gram TEXT, value_id INTEGER);
+            CREATE INDEX IF NOT EXISTS grams_gram ON grams (gram);
+            CREATE INDEX IF NOT EXISTS grams_value ON grams (value_id);
+        """)
+        self._migrate()
+
+    def _migrate(self):
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(indexed_columns)")]
+        if "checksum" not in columns:
+            # Index files written before the checksum was probed; their columns are rebuilt on their next probe
+            self.conn.execute("ALTER TABLE indexed_columns ADD COLUMN checksum TEXT")
+            self.conn.commit()
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Building and refreshing
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def build(self, schema):
+        """
+        Indexes every text column of the given schema (table name to table data, see DatabaseManager.get_schema()).
+        """
+        for table_name, table_data in schema.items():
+            for col in table_data['columns']:
+                if any(t in col.type.upper() for t in TEXT_TYPES):
+                    self.ensure_indexed(table_name, col.name)
+
+    def ensure_indexed(self, table_name, column_name):
+        """
+        Makes sure the column is indexed and up to date with the main database.
+        The main database is probed at most once every refresh_interval seconds per column.
+
+        The probe and the reading of new values scan the column in the main database. They run under a lock of the
+        column only, so lookups of other columns (and of this one, against the values indexed so far) go on meanwhile;
+        the index lock is only taken to compare versions and write the values.
+        """
+        key = (table_name, column_name)
+        with self.lock:
+            if time.monotonic() - self.last_probe.get(key, float("-inf")) < self.refresh_interval:
+                return
+            column_lock = self.column_locks.setdefault(key, threading.Lock())
+
+        with column_lock:
+            now = time.monotonic()
+            with self.lock:
+                if now - self.last_probe.get(key, float("-inf")) < self.refresh_interval:
+                    return  # probed by a concurrent caller while this one waited
+                indexed = self.conn.execute("""SELECT row_count, max_rowid, checksum FROM indexed_columns
+                                               WHERE table_name = ? AND column_name = ?""", key).fetchone()
+
+            row_count, max_rowid, checksum = self._probe(table_name, column_name)
+            if indexed is not None and indexed == (row_count, max_rowid, checksum):
+                with self.lock:
+                    self.last_probe[key] = now
+                return
+
+            appended = self._only_appended(table_name, column_name, indexed, row_count, max_rowid, checksum)
+            values = self._read_values(table_name, column_name, after_rowid=indexed[1] if appended else None)
+
+            with self.lock:
+                if not appended:
+                    self._drop_column(table_name, column_name)
+                self._store_values(table_name, column_name, values)
+                self.conn.execute("INSERT OR REPLACE INTO indexed_columns VALUES (?, ?, ?, ?, ?, ?)",
+                                  (table_name, column_name, row_count, max_rowid, time.time(), checksum))
+                self.conn.commit()
+                self.last_probe[key] = now
+
+    def _only_appended(self, table_name, column_name, indexed, row_count, max_rowid, checksum):
+        """
+        True when the rows after the indexed max rowid are the only change: the row count grew by their number and the
+        checksum by theirs. Only SQLite has a rowid to tell new rows apart.
+        """
+        if indexed is None or max_rowid is None or indexed[1] is None or indexed[2] is None or checksum is None:
+            return False
+        if max_rowid <= indexed[1] or row_count - indexed[0] != max_rowid - indexed[1]:
+            return False
+        _, _, appended = self._probe(table_name, column_name, after_rowid=indexed[1])
+        return int(indexed[2]) + int(appended or 0) == int(checksum)
+
+    def _probe(self, table_name, column_name, after_rowid=None):
+        """Returns the row count, max rowid (None outside SQLite) and checksum (a string) of a column."""
+        dialect = self.engine.dialect.name
+        preparer = self.engine.dialect.identifier_preparer
+        checksum = CONTENT_CHECKSUMS.get(dialect, DEFAULT_CONTENT_CHECKSUM).format(column=preparer.quote(column_name))
+        max_rowid = "MAX(rowid)" if dialect == "sqlite" else "NULL"
+        query = f"SELECT COUNT(*), {max_rowid}, {checksum} FROM {preparer.quote(table_name)}"
+        if after_rowid is not None:
+            query += f" WHERE rowid > {int(after_rowid)}"
+        with self.engine.connect() as connection:
+            if dialect == "sqlite":
+                connection.connection.driver_connection.create_function("eda_crc32", 1, crc32, deterministic=True)
+            row_count, max_rowid, checksum = connection.execute(text(query)).one()
+        return row_count, max_rowid, None if checksum is None else str(checksum)
+
+    def _read_values(self, table_name, column_name, after_rowid=None):
+        """Returns the distinct values of a column (only those of rows after after_rowid) with their trigrams."""
+        preparer = self.engine.dialect.identifier_preparer
+        quoted_column = preparer.quote(column_name)
+        query = f"SELECT DISTINCT {quoted_column} FROM {preparer.quote(table_name)} WHERE {quoted_column} IS NOT NULL"
+        if after_rowid is not None:
+            query += f" AND rowid > {int(after_rowid)}"
+
+        values = []
+        with self.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(text(query))
+            for rows in result.partitions(1000):
+                for (value,) in rows:
+                    value = str(value)
+                    grams = trigrams(value)
+                    if grams:
+                        values.append((value, grams))
+        return values
+
+    def _store_values(self, table_name, column_name, values):
+        for value, grams in values:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO vals (table_name, column_name, value, gram_count) VALUES (?, ?, ?, ?)",
+                (table_name, column_name, value, len(grams)))
+            if cursor.rowcount:
+                self.conn.executemany("INSERT INTO grams VALUES (?, ?)", [(gram, cursor.lastrowid) for gram in grams])
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Export and import
+    # The sidecar database is copied with SQLite's online backup, so an index can be built once and shipped to workers
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def save(self, path):
+        """Writes a copy of the index to a SQLite file."""
+        with self.lock:
+            target = sqlite3.connect(path)
+            try:
+                self.conn.backup(target)
+            finally:
+                target.close()
+
+    def load(self, path, trusted=False):
+        """
+        Replaces the index by the copy in a SQLite file (see save()).
+
+        Args:
+            trusted (bool): The copy is known to match the database, so its columns are not probed for changes
+                            before refresh_interval has passed.
+        """
+        with self.lock:
+            source = sqlite3.connect(path)
+            try:
+                source.backup(self.conn)
+            finally:
+                source.close()
+            self._migrate()
+            self.last_probe.clear()
+            if trusted:
+                now = time.monotonic()
+                for table_name, column_name in self.conn.execute("SELECT table_name, column_name FROM indexed_columns"):
+                    self.last_probe[(table_name, column_name)] = now
+
+    def memory_bytes(self) -> int:
+        """Size of the index when it lives in memory (no cache directory); an index on disk is not counted."""
+        if self.path != ":memory:":
+            return 0
+        with self.lock:
+            page_count = self.conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        return page_count * page_size
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _drop_column(self, table_name, column_name):
+        self.conn.execute("""DELETE FROM grams WHERE value_id IN
+                             (SELECT id FROM vals WHERE table_name = ? AND column_name = ?)""", (table_name, column_name))
+        self.conn.execute("DELETE FROM vals WHERE table_name = ? AND column_name = ?", (table_name, column_name))
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Lookups
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def lookup(self, question, table_name, columns, k=20, ensure=True):
+        """
+        Returns the stored values of the given columns that are closest to the words of the question.
+
+        Args:
+            question (str): The user question.
+            table_name (str): The table the columns belong to.
+            columns (list[str]): The noun-bearing columns to search.
+            k (int): Maximum number of values to return.
+            ensure (bool): Bring the columns up to date first (see ensure_indexed).
+
+        Returns:
+            list[tuple]: (value, score) pairs ordered by decreasing score, where score is the share of the value's
+                         trigrams that appear in the question.
+        """
+        if ensure:
+            for column_name in columns:
+                self.ensure_indexed(table_name, column_name)
+        return [(value, score) for value, _, _, score in self._search(question, [(table_name, c) for c in columns], k)]
+
+    def match_columns(self, question, k=20):
+        """
+        Returns the (table, column) pairs of already indexed columns whose values match words of the question.
+        Never touches the main database, so it is cheap enough to run before the schema is pruned.
+        """
+        return [(table_name, column_name) for _, table_name, column_name, _ in self._search(question, None, k)]
+
+    def _search(self, question, targets, k):
+        grams = sorted(trigrams(question, min_word_length=3))  # short words ("in", "by") match almost anything
+        if not grams:
+            return []
+
+        query = f"""
+            SELECT v.value, v.table_name, v.column_name, COUNT(*) * 1.0 / v.gram_count AS score
+            FROM grams g JOIN vals v ON v.id = g.value_id
+            WHERE g.gram IN ({', '.join('?' * len(grams))})
+        """
+        params = list(grams)
+        if targets is not None:
+            query += f" AND (v.table_name || '.' || v.column_name) IN ({', '.join('?' * len(targets))})"
+            params += [f"{table_name}.{column_name}" for table_name, column_name in targets]
+        query += " GROUP BY v.id HAVING COUNT(*) >= ? ORDER BY score DESC, v.value LIMIT ?"
+        params += [self.min_hits, k]
+
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
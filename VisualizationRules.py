@@ -0,0 +1,171 @@
+import re
+
+import numpy as np
+
+from ResultSet import to_columns
+from ResultSummarizer import profile_column
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Rule-based visualization choice and chart labels
+# Most results have a shape that decides the chart on its own: a date or year column and a number make a line chart,
+# two numbers a scatter plot, a handful of categories with a number a bar or pie chart. The rules below read the column
+# names and the profiles of the result columns (see ResultSummarizer.profile_column) and return the chart with a
+# confidence; the LLM is only asked about shapes they cannot place. Column names and SQL aliases double as axis labels
+# (see DataFormatter).
+# -----------------------------------------------------------------------------------------------------------------------------
+
+CHART_TYPES = ("bar", "horizontal_bar", "line", "pie", "scatter", "none")
+
+# Column names of numbers that are points in time rather than quantities
+TEMPORAL_NAME = re.compile(r"\b(year|month|quarter|week|day|date|time|period|yr)s?\b", re.IGNORECASE)
+PROPORTION_WORDS = re.compile(r"\b(percent(age)?s?|proportions?|shares?|fractions?|ratios?|breakdown|split|"
+                              r"distribution of|out of|% of)\b", re.IGNORECASE)
+TREND_WORDS = re.compile(r"\b(trend|over time|per (year|month|day|week|quarter)|by (year|month|day|week|quarter)|"
+                         r"monthly|yearly|daily|weekly|growth|changed?)\b", re.IGNORECASE)
+CORRELATION_WORDS = re.compile(r"\b(correlat\w*|relationship|versus|vs\.?|against|scatter)\b", re.IGNORECASE)
+# Names that are expressions or positional placeholders say nothing about the data
+UNINFORMATIVE_NAME = re.compile(r"^column_\d+$|[()*+/,]|^\?column\?$", re.IGNORECASE)
+
+PIE_MAX_SLICES = 8
+BAR_MAX_CATEGORIES = 30
+HORIZONTAL_BAR_MAX_CATEGORIES = 3
+HORIZONTAL_BAR_LABEL_LENGTH = 20
+PROFILE_ROWS = 5000
+
+
+def humanize(name) -> str:
+    """Turns a column name or alias such as "total_sales" or "UnitPrice" into "Total Sales" / "Unit Price"."""
+    name = str(name).strip().strip('"`[]')
+    if name.isupper():
+        name = name.lower()  # TOTAL_SALES
+    words = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", name)
+    words = re.sub(r"[_\s]+", " ", words).strip()
+    return " ".join(word if word.isupper() else word.capitalize() for word in words.split(" "))
+
+
+def column_label(name):
+    """
+    Returns the axis label of a result column, or None when the name is an expression (an unaliased aggregate) or a
+    positional placeholder that the LLM has to label from the data instead.
+    """
+    if not name or UNINFORMATIVE_NAME.search(str(name)):
+        return None
+    label = humanize(str(name).split(".")[-1])
+    return label or None
+
+
+def is_temporal(name, profile) -> bool:
+    """A column is temporal if its values look like dates, or if it holds whole numbers under a date-like name."""
+    if profile['type'] == 'temporal':
+        return True
+    return (profile['type'] == 'numeric' and TEMPORAL_NAME.search(humanize(name)) is not None
+            and float(profile['min']).is_integer() and float(profile['max']).is_integer())
+
+
+class VisualizationRules:
+    """
+    Chooses the chart for a result from its column metadata.
+
+    Attributes:
+        threshold (float): Minimum confidence at which the rule decision is used; below it the caller asks the LLM.
+        profile_rows (int): Rows profiled per column; larger results are profiled on their head.
+    """
+
+    def __init__(self, threshold=0.75, profile_rows=PROFILE_ROWS):
+        self.threshold = threshold
+        self.profile_rows = profile_rows
+
+    def choose(self, question, results) -> dict:
+        """
+        Returns:
+            dict: 'visualization' (one of CHART_TYPES), 'visualization_reason' and 'visualization_confidence' (0 to 1).
+        """
+        names, values = to_columns(results)
+        rows = len(values[0]) if values else 0
+        if not names or rows == 0:
+            return self._decision("none", 1.0, "The query returned no rows.")
+
+        profiles = [profile_column(column[:self.profile_rows], top_k=1) for column in values]
+        kinds = ["temporal" if is_temporal(name, profile) else profile['type']
+                 for name, profile in zip(names, profiles)]
+        question = question or ""
+
+        if len(names) == 1:
+            return self._decision("none", 0.9, "A single column is best read as a list or a value.")
+        if rows == 1:
+            return self._decision("none", 0.8, "A single row is best read as a sentence.")
+        if len(names) == 2:
+            return self._two_columns(question, names, kinds, profiles, values[0][:self.profile_rows])
+        if len(names) == 3:
+            return self._three_columns(question, names, kinds, profiles)
+        return self._decision("none", 0.3, f"No rule covers results with {len(names)} columns.")
+
+    @staticmethod
+    def _decision(visualization, confidence, reason):
+        return {"visualization": visualization, "visualization_reason": reason,
+                "visualization_confidence": round(confidence, 2)}
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Shapes
+    # The column order matters as well as the types: DataFormatter reads the x values from the first column and the
+    # numbers from the last one, so a decision for an order it cannot format loses confidence.
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _two_columns(self, question, names, kinds, profiles, x_values):
+        x_kind, y_kind = kinds
+        if y_kind != "numeric":
+            if x_kind in ("numeric", "temporal") and y_kind == "text":
+                return self._decision("bar", 0.5, "The numbers come before the categories.")
+            return self._decision("none", 0.6, "The result has no numeric measure to plot.")
+
+        if x_kind == "temporal":
+            return self._decision("line", 0.9, f"{humanize(names[1])} over {humanize(names[0])} is a trend over time.")
+
+        if x_kind == "numeric":
+            if TREND_WORDS.search(question):
+                return self._decision("line", 0.7, "The question asks for a trend along a numeric axis.")
+            confidence = 0.9 if CORRELATION_WORDS.search(question) else 0.8
+            return self._decision("scatter", confidence, "Both columns are continuous numbers.")
+
+        if x_kind != "text":
+            return self._decision("none", 0.5, "The first column is empty.")
+
+        categories = profiles[0]['distinct']
+        if categories < len(x_values):
+            # Repeated categories need an aggregation the query did not make
+            return self._decision("bar", 0.5, "The categories repeat, the values may need aggregating.")
+
+        proportion = PROPORTION_WORDS.search(question) is not None
+        non_negative = profiles[1]['min'] >= 0
+        if proportion and non_negative and categories <= PIE_MAX_SLICES:
+            return self._decision("pie", 0.85, "The question asks for the parts of a whole over a few categories.")
+        if categories <= HORIZONTAL_BAR_MAX_CATEGORIES:
+            return self._decision("horizontal_bar", 0.8, "A comparison of only a few categories.")
+        label_length = np.mean([len(str(value)) for value in x_values[:100]])
+        if categories <= BAR_MAX_CATEGORIES:
+            if label_length > HORIZONTAL_BAR_LABEL_LENGTH:
+                return self._decision("horizontal_bar", 0.8, "Categories with long names compare best side by side.")
+            return self._decision("bar", 0.85, f"{humanize(names[1])} compared across {categories} categories.")
+        return self._decision("bar", 0.65, f"{categories} categories are many for one chart.")
+
+    def _three_columns(self, question, names, kinds, profiles):
+        if kinds[2] != "numeric":
+            return self._decision("none", 0.4, "The last column is not a numeric measure.")
+
+        first, second = kinds[0], kinds[1]
+        if first == "text" and second == "temporal":
+            return self._decision("line", 0.85, f"One {humanize(names[2])} trend per {humanize(names[0])}.")
+        if first == "temporal" and second == "text":
+            # Dates written as text look like labels to DataFormatter, years stored as numbers do not
+            confidence = 0.85 if profiles[0]['type'] == "numeric" else 0.6
+            return self._decision("line", confidence, f"One {humanize(names[2])} trend per {humanize(names[1])}.")
+        if first == "text" and second == "text":
+            return self._decision("bar", 0.8, f"{humanize(names[2])} grouped by {humanize(names[0])} and "
+                                              f"{humanize(names[1])}.")
+        if first == "text" and second == "numeric":
+            if TREND_WORDS.search(question):
+                return self._decision("line", 0.7, "One series per category along a numeric axis.")
+            return self._decision("scatter", 0.8, "Two numeric columns with one series per category.")
+        if first == "numeric" and second == "text":
+            return self._decision("scatter", 0.7, "Two numeric columns with one series per category.")
+        return self._decision("none", 0.4, "No rule covers this combination of columns.")
@@ -0,0 +1,73 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataFormatter import DataFormatter
+from LLMManager import LLMManager
+from ResultSet import ColumnBatch, ResultSet
+from StubLLM import StubChatModel
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Micro-benchmark of the chart formatters
+# Run with `python benchmarks/bench_data_formatter.py [--rows 10000 100000 1000000]`. Results are built as streamed
+# ResultSets (like DatabaseManager.execute_query returns) and the labeling prompts are answered by StubChatModel.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+BATCH_SIZE = 5000
+
+
+def make_results(columns, data):
+    batches = [ColumnBatch(columns, [values[start:start + BATCH_SIZE] for values in data])
+               for start in range(0, len(data[0]), BATCH_SIZE)]
+    return ResultSet(columns, batches)
+
+
+def make_cases(rows, seed=0):
+    """
+    Returns (name, formatter method, results) for every chart shape with the given number of rows.
+    Grouped results use 20 series; the x values of the line charts are unique per series.
+    """
+    rng = np.random.default_rng(seed)
+    labels = [f"series_{i}" for i in rng.integers(0, 20, rows)]
+    x = [f"t{i:07d}" for i in range(rows)]
+    values = rng.random(rows).round(4).tolist()
+    other = rng.random(rows).round(4).tolist()
+    categories = [f"category_{i}" for i in rng.integers(0, 50, rows)]
+
+    return [
+        ("bar", "_format_bar_data", make_results(["label", "value"], [labels, values])),
+        ("grouped bar", "_format_bar_data", make_results(["entity", "category", "value"], [labels, categories, values])),
+        ("line", "_format_line_data", make_results(["x", "y"], [x, values])),
+        ("multi-series line", "_format_line_data", make_results(["label", "x", "y"], [labels, x, values])),
+        ("scatter", "_format_scatter_data", make_results(["x", "y"], [values, other])),
+        ("grouped scatter", "_format_scatter_data", make_results(["label", "x", "y"], [labels, values, other])),
+    ]
+
+
+def run(row_counts, repeat=3):
+    formatter = DataFormatter(llm_manager=LLMManager(llm=StubChatModel()))
+    print(f"{'rows':>10}  {'chart':<18} {'best ms':>10} {'rows/s':>14}")
+    for rows in row_counts:
+        for name, method, results in make_cases(rows):
+            format_chart = getattr(formatter, method)
+            args = (results,) if method == "_format_scatter_data" else (results, "benchmark")
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                format_chart(*args)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            print(f"{rows:>10}  {name:<18} {best * 1000:>10.1f} {rows / best:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the DataFormatter chart formatters.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,289 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from DataFormatter import DataFormatter
+from DatabaseManager import DatabaseManager
+from LLMManager import LLMManager
+from StubLLM import StubChatModel
+from sql_agent import SQLAgent
+from synthetic_db import ensure_database
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Offline benchmark of the question-to-chart pipeline
+# Runs a fixed set of questions against synthetic Chinook-style databases with StubChatModel answering every prompt,
+# so the numbers only depend on this code and the machine. Each node is timed over several runs (after one cold run
+# that builds the caches) and measured once more under tracemalloc for its peak memory. Results are written as JSON:
+#
+#   python benchmarks/bench_pipeline.py --scales 1 100 1000 --output benchmarks/results/before.json
+#   python benchmarks/bench_pipeline.py --baseline benchmarks/results/before.json
+# -----------------------------------------------------------------------------------------------------------------------------
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def relevant(base_table, tables):
+    """Builds the ParsedQuestion answer of the stub: tables maps table name to (columns, noun columns)."""
+    return {
+        "BaseTable": base_table,
+        "columns": tables[base_table][0],
+        "relevant_tables": [{"table_name": table, "column_name": columns, "noun_columns": nouns}
+                            for table, (columns, nouns) in tables.items()],
+        "noun_columns": [noun for _, nouns in tables.values() for noun in nouns],
+        "is_relevant": True,
+    }
+
+
+# One question per DataFormatter path, with the parsed question, SQL and visualization the stub answers with
+QUESTIONS = [
+    {
+        "question": "What are the total sales per billing country?",
+        "chart": "bar",
+        "parsed": relevant("invoices", {"invoices": (["BillingCountry", "Total"], ["BillingCountry"])}),
+        "sql": "SELECT BillingCountry, SUM(Total) AS total_sales FROM invoices GROUP BY BillingCountry "
+               "ORDER BY total_sales DESC",
+    },
+    {
+        "question": "Which tracks did customers from Brazil buy most often?",
+        "chart": "horizontal_bar",
+        "parsed": relevant("tracks", {"tracks": (["TrackId", "Name"], ["Name"]),
+                                      "invoice_items": (["InvoiceId", "TrackId"], []),
+                                      "invoices": (["InvoiceId", "BillingCountry"], ["BillingCountry"])}),
+        "sql": "SELECT t.Name, COUNT(*) AS purchases FROM invoice_items ii JOIN invoices i ON i.InvoiceId = ii.InvoiceId "
+               "JOIN tracks t ON t.TrackId = ii.TrackId WHERE i.BillingCountry = 'Brazil' GROUP BY t.Name "
+               "ORDER BY purchases DESC LIMIT 10",
+    },
+    {
+        "question": "How many tracks does each genre have per media type?",
+        "chart": "bar",
+        "parsed": relevant("tracks", {"tracks": (["GenreId", "MediaTypeId"], []),
+                                      "genres": (["GenreId", "Name"], ["Name"]),
+                                      "media_types": (["MediaTypeId", "Name"], ["Name"])}),
+        "sql": "SELECT g.Name AS genre, m.Name AS media_type, COUNT(*) AS tracks FROM tracks t "
+               "JOIN genres g ON g.GenreId = t.GenreId JOIN media_types m ON m.MediaTypeId = t.MediaTypeId "
+               "GROUP BY g.Name, m.Name",
+    },
+    {
+        "question": "How did the monthly revenue evolve over time?",
+        "chart": "line",
+        "parsed": relevant("invoices", {"invoices": (["InvoiceDate", "Total"], [])}),
+        "sql": "SELECT strftime('%Y-%m', InvoiceDate) AS month, SUM(Total) AS revenue FROM invoices "
+               "GROUP BY month ORDER BY month",
+    },
+    {
+        "question": "How did the daily revenue of each billing country evolve?",
+        "chart": "line",
+        "parsed": relevant("invoices", {"invoices": (["BillingCountry", "InvoiceDate", "Total"], ["BillingCountry"])}),
+        "sql": "SELECT BillingCountry, date(InvoiceDate) AS day, SUM(Total) AS revenue FROM invoices "
+               "GROUP BY BillingCountry, day ORDER BY day",
+    },
+    {
+        "question": "Is the length of a track related to its file size?",
+        "chart": "scatter",
+        "parsed": relevant("tracks", {"tracks": (["Milliseconds", "Bytes"], [])}),
+        "sql": "SELECT Milliseconds, Bytes FROM tracks",
+    },
+    {
+        "question": "How do track length and file size compare across genres?",
+        "chart": "scatter",
+        "parsed": relevant("tracks", {"tracks": (["GenreId", "Milliseconds", "Bytes"], []),
+                                      "genres": (["GenreId", "Name"], ["Name"])}),
+        "sql": "SELECT g.Name AS genre, t.Milliseconds, t.Bytes FROM tracks t JOIN genres g ON g.GenreId = t.GenreId",
+    },
+]
+
+# The nodes in pipeline order; format_data_for_visualization is reported per chart path
+NODES = ["retrieve_schema", "parse_question", "get_unique_nouns", "generate_sql", "validate_sql", "execute_sql",
+         "summarize_results", "format_results", "choose_visualization", "format_data_for_visualization"]
+
+
+def stub_model(latency=0.0):
+    """
+    StubChatModel answering the prompts of every benchmark question: the question text occurs in each prompt.
+    """
+    def answer(field):
+        def respond(prompt):
+            for spec in QUESTIONS:
+                if spec["question"] in prompt:
+                    return field(spec)
+            return ""
+        return respond
+
+    return StubChatModel(responses=[
+        ("parse user questions", answer(lambda spec: spec["parsed"])),
+        ("generates SQL queries", answer(lambda spec: spec["sql"])),
+        ("recommends appropriate data visualizations",
+         answer(lambda spec: f"Recommended Visualization: {spec['chart']}\nReason: Benchmark.")),
+    ], latency=latency)
+
+
+class Pipeline:
+    """The nodes of the workflow for one database, called directly in pipeline order."""
+
+    def __init__(self, db_url, cache_dir, latency=0.0):
+        self.db_manager = DatabaseManager(db_url, cache_dir=cache_dir)
+        self.llm_manager = LLMManager(cache_dir=None, llm=stub_model(latency))
+        self.agent = SQLAgent(db_manager=self.db_manager, llm_manager=self.llm_manager)
+        self.formatter = DataFormatter(llm_manager=self.llm_manager)
+        agent = self.agent
+        self.nodes = [
+            ("retrieve_schema", agent.retrieve_schema),
+            ("parse_question", agent.parse_question),
+            ("get_unique_nouns", agent.get_unique_nouns),
+            ("generate_sql", agent.generate_sql),
+            ("validate_sql", agent.validator),
+            ("execute_sql", agent.execute_sql),
+            ("summarize_results", agent.summarize_results),
+            ("format_results", agent.format_results),
+            ("choose_visualization", agent.choose_visualization),
+            ("format_data_for_visualization", self.formatter.format_data_for_visualization),
+        ]
+
+    def run(self, question, measure_memory=False):
+        """
+        Answers the question and returns the final state and the seconds (or peak bytes) spent in every node.
+        """
+        self.llm_manager.cache.clear()  # every run pays for the prompts and the query, not for cache hits
+        if self.db_manager.result_cache is not None:
+            self.db_manager.result_cache.clear()
+        state = {"question": question}
+        measurements = {}
+        for name, node in self.nodes:
+            if measure_memory:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                update = node(state)
+                measurements[name] = tracemalloc.get_traced_memory()[1] - before
+            else:
+                start = time.perf_counter()
+                update = node(state)
+                measurements[name] = time.perf_counter() - start
+            state.update(update)
+        return state, measurements
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def bench_scale(scale, repeat, data_dir, latency):
+    db_path = ensure_database(data_dir, scale)
+    cache_dir = tempfile.mkdtemp(prefix="eda-bench-")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline = Pipeline(f"sqlite:///{db_path}", cache_dir, latency)
+        results = []
+        for spec in QUESTIONS:
+            with contextlib.redirect_stdout(io.StringIO()):
+                cold_state, cold = pipeline.run(spec["question"])
+                timings = [pipeline.run(spec["question"])[1] for _ in range(repeat)]
+                tracemalloc.start()
+                try:
+                    _, memory = pipeline.run(spec["question"], measure_memory=True)
+                finally:
+                    tracemalloc.stop()
+
+            results_value = cold_state.get("results")
+            nodes = {}
+            for name in NODES:
+                samples = [timing[name] * 1000 for timing in timings]
+                nodes[name] = {
+                    "cold_ms": round(cold[name] * 1000, 3),
+                    "median_ms": round(statistics.median(samples), 3),
+                    "min_ms": round(min(samples), 3),
+                    "p95_ms": round(percentile(samples, 0.95), 3),
+                    "peak_kb": round(memory[name] / 1024, 1),
+                }
+            results.append({
+                "scale": scale,
+                "question": spec["question"],
+                "chart": cold_state.get("visualization"),
+                "result_rows": None if isinstance(results_value, (str, dict, type(None))) else len(results_value),
+                "results_truncated": bool(cold_state.get("results_truncated")),
+                "error": cold_state.get("error"),
+                "nodes": nodes,
+            })
+            node = nodes["format_data_for_visualization"]
+            print(f"{scale:>5}x  {spec['chart']:<15} rows={results[-1]['result_rows']!s:<8} "
+                  + "  ".join(f"{name}={nodes[name]['median_ms']:.1f}ms" for name in
+                              ("parse_question", "get_unique_nouns", "validate_sql", "execute_sql"))
+                  + f"  format={node['median_ms']:.1f}ms/{node['peak_kb']:.0f}KB")
+        return results
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(report, baseline_path):
+    """Prints the median latency of every node relative to a previous report."""
+    with open(baseline_path) as f:
+        baseline = {(item["scale"], item["question"]): item for item in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path} (current / baseline median):")
+    for item in report["results"]:
+        previous = baseline.get((item["scale"], item["question"]))
+        if previous is None:
+            continue
+        ratios = []
+        for name, node in item["nodes"].items():
+            before = previous["nodes"].get(name, {}).get("median_ms")
+            if before:
+                ratios.append(f"{name}={node['median_ms'] / before:.2f}x")
+        print(f"{item['scale']:>5}x  {item['chart'] or '-':<15} " + "  ".join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the question-to-chart pipeline.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="Simulated seconds per LLM call.")
+    parser.add_argument("--data-dir", default=os.path.join(BENCHMARK_DIR, "data"))
+    parser.add_argument("--output", help="JSON report path (default benchmarks/results/pipeline-<commit>.json).")
+    parser.add_argument("--baseline", help="A previous JSON report to compare against.")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "llm_latency_s": args.latency,
+        "results": [],
+    }
+    for scale in args.scales:
+        report["results"].extend(bench_scale(scale, args.repeat, args.data_dir, args.latency))
+
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", f"pipeline-{commit or 'local'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+
+    if args.baseline:
+        compare(report, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Start-up profile of a fresh worker
+# Reports what a new process pays before it can answer: the import time of every package (from python -X importtime)
+# and the time of each start-up step, up to the first answered question, measured in a fresh interpreter with empty
+# caches. StubChatModel answers the prompts, so no network is involved:
+#
+#   python benchmarks/profile_startup.py --db-url sqlite:///chinook.db
+#   python benchmarks/profile_startup.py --db-url sqlite:///chinook.db --snapshot snapshots/chinook
+# -----------------------------------------------------------------------------------------------------------------------------
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+# The modules a worker needs to answer a question
+WORKER_MODULES = ("workflow_manager", "sql_agent", "DataFormatter", "DatabaseManager", "LLMManager", "StubLLM",
+                  "langgraph.graph")
+
+
+def profile_imports(modules=WORKER_MODULES) -> dict:
+    """
+    Imports the modules in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: 'packages' (top-level package to the milliseconds spent in its own modules, so that the numbers add up
+              to the total) and 'total_ms'.
+    """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {', '.join(modules)}"],
+                               cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    packages = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match is None:
+            continue
+        package = match.group(4).split(".")[0]
+        packages[package] = packages.get(package, 0) + int(match.group(1)) / 1000
+    packages = dict(sorted(((name, round(ms, 3)) for name, ms in packages.items()), key=lambda item: -item[1]))
+    return {"packages": packages, "total_ms": round(sum(packages.values()), 3)}
+
+
+def profile_startup(db_url, snapshot=None, question="How many customers are there?") -> dict:
+    """
+    Times the start-up steps of a worker in this (fresh) process: importing workflow_manager, building each
+    component (which imports its dependencies on first use), compiling the graph and answering a first question.
+
+    Returns:
+        dict: Step name to milliseconds.
+    """
+    steps = {}
+
+    def timed(name, step):
+        start = time.perf_counter()
+        value = step()
+        steps[name] = round((time.perf_counter() - start) * 1000, 3)
+        return value
+
+    workflow_manager = timed("import workflow_manager", lambda: __import__("workflow_manager"))
+
+    def build_llm_manager():
+        from LLMManager import LLMManager
+        from StubLLM import StubChatModel
+        return LLMManager(cache_dir=None, llm=StubChatModel())
+
+    llm_manager = timed("llm_manager", build_llm_manager)
+    manager = timed("WorkflowManager()", lambda: workflow_manager.WorkflowManager(
+        db_url=db_url, llm_manager=llm_manager, snapshot=snapshot))
+    for name, step_ms in timed("warm_up()", manager.warm_up).items():
+        steps[f"  {name}"] = step_ms
+    timed("first question", lambda: manager.run_sql_agent(question, "startup-profile"))
+    timed("second question", lambda: manager.run_sql_agent(question, "startup-profile"))
+    return steps
+
+
+def absolute_db_url(db_url):
+    """Makes a relative SQLite path absolute, as the profiled process runs in an empty directory."""
+    prefix = "sqlite:///"
+    if db_url.startswith(prefix) and not db_url.startswith(prefix + "/") and ":memory:" not in db_url:
+        return prefix + os.path.abspath(db_url[len(prefix):])
+    return db_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import and start-up cost of a fresh worker.")
+    parser.add_argument("--db-url", default=os.getenv("EDA_DB_URL", "sqlite:///chinook.db"))
+    parser.add_argument("--snapshot", help="Runtime snapshot directory to start from (see RuntimeSnapshot).")
+    parser.add_argument("--top", type=int, default=15, help="Packages listed in the import report.")
+    parser.add_argument("--output", help="Write the report as JSON.")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Runs in an empty working directory, so that no cache directory from an earlier run is found
+        print(json.dumps(profile_startup(args.db_url, args.snapshot)))
+        return
+
+    imports = profile_imports()
+    snapshot = os.path.abspath(args.snapshot) if args.snapshot else None
+    with tempfile.TemporaryDirectory() as workdir:
+        command = [sys.executable, os.path.abspath(__file__), "--child", "--db-url", absolute_db_url(args.db_url)]
+        if snapshot:
+            command += ["--snapshot", snapshot]
+        completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True)
+    steps = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    print(f"Imports ({imports['total_ms']:.0f} ms in total):")
+    for name, ms in list(imports["packages"].items())[:args.top]:
+        print(f"  {name:<30} {ms:>9.1f} ms")
+    print("\nStart-up steps:")
+    for name, ms in steps.items():
+        print(f"  {name:<30} {ms:>9.1f} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"db_url": args.db_url, "snapshot": args.snapshot, "imports": imports, "steps": steps}, f,
+                      indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
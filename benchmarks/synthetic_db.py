@@ -0,0 +1,127 @@
+import argparse
+import os
+import random
+import sqlite3
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Synthetic Chinook-style databases
+# Same tables and relationships as the Chinook sample database, filled with seeded random data. Scale 1 has roughly
+# the row counts of the real Chinook database; every table except genres and media types grows linearly with the scale.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+# Rows of each table at scale 1
+BASE_ROWS = {
+    "artists": 275,
+    "albums": 347,
+    "tracks": 3503,
+    "customers": 59,
+    "invoices": 412,
+    "invoice_items": 2240,
+}
+
+GENRES = ["Rock", "Jazz", "Metal", "Alternative & Punk", "Rock And Roll", "Blues", "Latin", "Reggae", "Pop",
+          "Soundtrack", "Bossa Nova", "Easy Listening", "Heavy Metal", "R&B/Soul", "Electronica/Dance", "World",
+          "Hip Hop/Rap", "Science Fiction", "TV Shows", "Sci Fi & Fantasy", "Drama", "Comedy", "Alternative",
+          "Classical", "Opera"]
+MEDIA_TYPES = ["MPEG audio file", "Protected AAC audio file", "Protected MPEG-4 video file",
+               "Purchased AAC audio file", "AAC audio file"]
+COUNTRIES = ["USA", "Canada", "Brazil", "France", "Germany", "United Kingdom", "Czech Republic", "Portugal", "India",
+             "Chile", "Ireland", "Hungary", "Austria", "Finland", "Netherlands", "Norway", "Sweden", "Spain", "Poland",
+             "Italy", "Denmark", "Australia", "Argentina", "Belgium"]
+WORDS = ["Love", "Night", "Rock", "Blue", "Fire", "Dream", "Road", "Heart", "Rain", "Stone", "Light", "City", "Wild",
+         "Gold", "River", "Sun", "Dark", "Free", "Time", "Soul", "Star", "King", "Shadow", "Angel", "Thunder"]
+
+SCHEMA = """
+CREATE TABLE artists (ArtistId INTEGER PRIMARY KEY, Name NVARCHAR(120));
+CREATE TABLE albums (AlbumId INTEGER PRIMARY KEY, Title NVARCHAR(160) NOT NULL,
+                     ArtistId INTEGER NOT NULL REFERENCES artists (ArtistId));
+CREATE TABLE genres (GenreId INTEGER PRIMARY KEY, Name NVARCHAR(120));
+CREATE TABLE media_types (MediaTypeId INTEGER PRIMARY KEY, Name NVARCHAR(120));
+CREATE TABLE tracks (TrackId INTEGER PRIMARY KEY, Name NVARCHAR(200) NOT NULL, AlbumId INTEGER REFERENCES albums (AlbumId),
+                     MediaTypeId INTEGER NOT NULL REFERENCES media_types (MediaTypeId),
+                     GenreId INTEGER REFERENCES genres (GenreId), Composer NVARCHAR(220), Milliseconds INTEGER NOT NULL,
+                     Bytes INTEGER, UnitPrice NUMERIC(10,2) NOT NULL);
+CREATE TABLE customers (CustomerId INTEGER PRIMARY KEY, FirstName NVARCHAR(40) NOT NULL, LastName NVARCHAR(20) NOT NULL,
+                        City NVARCHAR(40), Country NVARCHAR(40), Email NVARCHAR(60) NOT NULL);
+CREATE TABLE invoices (InvoiceId INTEGER PRIMARY KEY, CustomerId INTEGER NOT NULL REFERENCES customers (CustomerId),
+                       InvoiceDate DATETIME NOT NULL, BillingCountry NVARCHAR(40), Total NUMERIC(10,2) NOT NULL);
+CREATE TABLE invoice_items (InvoiceLineId INTEGER PRIMARY KEY, InvoiceId INTEGER NOT NULL REFERENCES invoices (InvoiceId),
+                            TrackId INTEGER NOT NULL REFERENCES tracks (TrackId), UnitPrice NUMERIC(10,2) NOT NULL,
+                            Quantity INTEGER NOT NULL);
+CREATE INDEX albums_artist ON albums (ArtistId);
+CREATE INDEX tracks_album ON tracks (AlbumId);
+CREATE INDEX tracks_genre ON tracks (GenreId);
+CREATE INDEX invoices_customer ON invoices (CustomerId);
+CREATE INDEX invoice_items_invoice ON invoice_items (InvoiceId);
+CREATE INDEX invoice_items_track ON invoice_items (TrackId);
+"""
+
+
+def row_counts(scale):
+    return {table: rows * scale for table, rows in BASE_ROWS.items()}
+
+
+def build_database(path, scale=1, seed=0):
+    """
+    Creates (or replaces) a synthetic Chinook-style SQLite database at path and returns its row counts.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    rnd = random.Random(seed)
+    counts = row_counts(scale)
+    name = lambda n: " ".join(rnd.choice(WORDS) for _ in range(n))  # noqa: E731
+
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    connection.executemany("INSERT INTO genres VALUES (?, ?)", enumerate(GENRES, 1))
+    connection.executemany("INSERT INTO media_types VALUES (?, ?)", enumerate(MEDIA_TYPES, 1))
+    connection.executemany("INSERT INTO artists VALUES (?, ?)",
+                           ((i, f"{name(2)} {i}") for i in range(1, counts["artists"] + 1)))
+    connection.executemany("INSERT INTO albums VALUES (?, ?, ?)",
+                           ((i, name(3), rnd.randint(1, counts["artists"])) for i in range(1, counts["albums"] + 1)))
+    connection.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           ((i, name(rnd.randint(1, 4)), rnd.randint(1, counts["albums"]), rnd.randint(1, len(MEDIA_TYPES)),
+                             rnd.randint(1, len(GENRES)), name(2), rnd.randint(60_000, 600_000),
+                             rnd.randint(1_000_000, 12_000_000), rnd.choice((0.99, 1.99)))
+                            for i in range(1, counts["tracks"] + 1)))
+    connection.executemany("INSERT INTO customers VALUES (?, ?, ?, ?, ?, ?)",
+                           ((i, f"First{i}", f"Last{i}", f"City{rnd.randint(1, 50)}", rnd.choice(COUNTRIES),
+                             f"customer{i}@example.com") for i in range(1, counts["customers"] + 1)))
+    connection.executemany("INSERT INTO invoices VALUES (?, ?, ?, ?, ?)",
+                           ((i, rnd.randint(1, counts["customers"]),
+                             f"{rnd.randint(2009, 2013)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} 00:00:00",
+                             rnd.choice(COUNTRIES), round(rnd.uniform(0.99, 25.86), 2))
+                            for i in range(1, counts["invoices"] + 1)))
+    connection.executemany("INSERT INTO invoice_items VALUES (?, ?, ?, ?, ?)",
+                           ((i, rnd.randint(1, counts["invoices"]), rnd.randint(1, counts["tracks"]),
+                             rnd.choice((0.99, 1.99)), 1) for i in range(1, counts["invoice_items"] + 1)))
+    connection.commit()
+    connection.close()
+    return {**counts, "genres": len(GENRES), "media_types": len(MEDIA_TYPES)}
+
+
+def database_path(data_dir, scale, seed=0):
+    return os.path.join(data_dir, f"chinook-{scale}x-seed{seed}.db")
+
+
+def ensure_database(data_dir, scale, seed=0):
+    """
+    Returns the path of the synthetic database for the scale, building it on first use.
+    """
+    path = database_path(data_dir, scale, seed)
+    if not os.path.exists(path):
+        print(f"Building the {scale}x synthetic database at {path}")
+        build_database(path + ".tmp", scale, seed)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a synthetic Chinook-style SQLite database.")
+    parser.add_argument("path")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(build_database(args.path, args.scale, args.seed))
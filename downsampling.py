@@ -0,0 +1,110 @@
+import numpy as np
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Downsampling of chart series
+# Every function returns the sorted indices of the points to keep, so the caller can apply them to x, y, ids and labels
+# alike. Inputs with no more points than the budget are returned whole.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+# Maximum number of points sent to the client per chart type (per x axis for line charts, in total for scatter plots)
+DEFAULT_POINT_BUDGETS = {
+    "line": 2000,
+    "scatter": 5000,
+}
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: keeps the first and last point and, from each of threshold - 2 equal buckets in
+    between, the point forming the largest triangle with the previously kept point and the average of the next bucket.
+    Preserves peaks and troughs of a series far better than taking every n-th point.
+
+    Args:
+        x (np.ndarray): Float x coordinates in ascending order (positions can be used for categorical axes).
+        y (np.ndarray): Float y coordinates, without NaN.
+        threshold (int): Number of points to keep. Below 3 only the endpoints (or the first point) are kept.
+    """
+    n = len(x)
+    if threshold >= n:
+        return np.arange(n)
+    if threshold < 3:
+        return np.array([0, n - 1], dtype=np.intp)[:max(threshold, 0)]
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.intp)
+    selected = np.empty(threshold, dtype=np.intp)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        if bucket == threshold - 3:
+            average_x, average_y = x[n - 1], y[n - 1]
+        else:
+            next_end = edges[bucket + 2]
+            average_x, average_y = x[end:next_end].mean(), y[end:next_end].mean()
+
+        areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (average_y - y[previous]))
+        previous = start + int(areas.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def bin_2d(x, y, budget):
+    """
+    Lays a sqrt(budget) x sqrt(budget) grid over the points and keeps the first point of every non-empty cell,
+    which keeps the outline of the cloud and its outliers.
+    """
+    n = len(x)
+    if n <= budget:
+        return np.arange(n)
+    if budget < 1:
+        return np.arange(0)
+
+    bins = int(np.sqrt(budget))
+
+    def cell(values):
+        low, span = values.min(), np.ptp(values)
+        if span == 0:
+            return np.zeros(len(values), dtype=np.intp)
+        return np.minimum(((values - low) / span * bins).astype(np.intp), bins - 1)
+
+    _, first = np.unique(cell(x) * bins + cell(y), return_index=True)
+    return np.sort(first)
+
+
+def reservoir_sample(n, budget, seed=0):
+    """
+    Uniform sample of budget points without replacement (the result of reservoir sampling, drawn at once since the
+    points are already in memory). The seed keeps the payload of a given result stable between requests.
+    """
+    if n <= budget:
+        return np.arange(n)
+    return np.sort(np.random.default_rng(seed).choice(n, max(budget, 0), replace=False))
+
+
+def split_budget(counts, budget):
+    """
+    Shares a point budget between groups of the given sizes: every group gets at least one point and the rest is split
+    in proportion to the group sizes (largest remainders first), so the shares never add up to more than the budget.
+    When there are more groups than points, the largest groups get one point each and the others none.
+
+    Returns:
+        np.ndarray: The number of points of every group, at most its size.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total, groups = int(counts.sum()), len(counts)
+    if total <= budget:
+        return counts.copy()
+
+    shares = np.zeros(groups, dtype=np.int64)
+    if groups >= budget:
+        shares[np.argsort(-counts, kind='stable')[:max(budget, 0)]] = 1
+        return np.minimum(shares, counts)
+
+    # One point per group, the spare points in proportion to the points each group has left
+    spare = budget - groups
+    exact = (counts - 1) * spare / (total - groups)
+    shares = 1 + np.floor(exact).astype(np.int64)
+    left = budget - int(shares.sum())
+    shares[np.argsort(-(exact - np.floor(exact)), kind='stable')[:left]] += 1
+    return np.minimum(shares, counts)
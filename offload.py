@@ -0,0 +1,32 @@
+import asyncio
+import contextvars
+import functools
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Thread offloading that outlives cancellation
+# asyncio.to_thread stops waiting when the awaiting task is cancelled (a request timeout, a client gone), but the work
+# keeps running in its thread. Whoever bounds the concurrent work (the service's admission slots, the tenant leases)
+# would then count it as finished while it still holds a connection. to_thread() below waits for the thread to end
+# before the cancellation propagates, after asking it to stop through on_cancel.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+async def to_thread(func, *args, on_cancel=None, **kwargs):
+    """
+    Runs func(*args, **kwargs) in the default executor with the current context, like asyncio.to_thread.
+
+    Args:
+        on_cancel (callable): Called when the awaiting task is cancelled, to interrupt func (e.g. the set() of the
+                              cancel event of DatabaseManager.execute_query).
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    future = loop.run_in_executor(None, functools.partial(context.run, func, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if on_cancel is not None:
+            on_cancel()
+        # The thread cannot be stopped from here, only waited for
+        await asyncio.wait([future])
+        raise
@@ -0,0 +1,278 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid as uuid_lib
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+
+from TenantRegistry import UnknownTenant
+
+logger = logging.getLogger("eda.server")
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# HTTP service on top of the compiled workflow
+# Run with `python server.py` or `uvicorn server:app`. Set EDA_STUB_LLM=1 to serve answers from StubLLM.StubChatModel
+# instead of OpenAI, and EDA_SNAPSHOT to the directory of a runtime snapshot (see RuntimeSnapshot) to start from it.
+# EDA_TENANTS points to a JSON file mapping tenant identifiers to databases (see TenantRegistry); requests then choose
+# their database with the "tenant" field, and the default database answers requests without one.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+
+class AskRequest(BaseModel):
+    question: str
+    uuid: str | None = None
+    tenant: str | None = None
+
+
+class BatchRequest(BaseModel):
+    questions: list[str] = Field(min_length=1)
+    parallelism: int | None = Field(default=None, ge=1)
+    tenant: str | None = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueueTimeout(Exception):
+    pass
+
+
+class AdmissionController:
+    """
+    Bounds the number of pipelines running at once and the number of requests waiting for slots.
+
+    A question takes one slot, a batch one slot per pipeline it runs in parallel. Slots are granted in arrival order,
+    so a large batch is not starved by a stream of single questions.
+
+    Attributes:
+        max_in_flight (int): Pipelines allowed to run at the same time.
+        max_queue (int): Requests allowed to wait for slots; further requests are rejected with QueueFull (429).
+        queue_timeout (float): Seconds a request may wait for its slots before QueueTimeout (503) is raised.
+    """
+
+    def __init__(self, max_in_flight=16, max_queue=64, queue_timeout=5.0):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiters = deque()  # (slots, future) of the waiting requests, in arrival order
+        self.in_flight = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self, slots=1):
+        """
+        Waits until `slots` slots are free, holds them for the block and yields the seconds spent waiting.
+        """
+        slots = max(1, min(slots, self.max_in_flight))
+        start = time.perf_counter()
+        if not self.waiters and self.in_flight + slots <= self.max_in_flight:
+            self.in_flight += slots  # free slots, this does not suspend
+        elif self.waiting >= self.max_queue:
+            raise QueueFull()
+        else:
+            granted = asyncio.get_running_loop().create_future()
+            waiter = (slots, granted)
+            self.waiters.append(waiter)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(granted, timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                if not granted.done() or granted.cancelled():
+                    raise QueueTimeout()
+            except BaseException:
+                if granted.done() and not granted.cancelled():
+                    self.in_flight -= slots  # granted just before the request was cancelled
+                    self._grant()
+                raise
+            finally:
+                self.waiting -= 1
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    self._grant()  # the next request may fit now that this one stopped waiting
+
+        try:
+            yield time.perf_counter() - start
+        finally:
+            self.in_flight -= slots
+            self._grant()
+
+    def _grant(self):
+        while self.waiters and self.in_flight + self.waiters[0][0] <= self.max_in_flight:
+            slots, granted = self.waiters.popleft()
+            if granted.done():
+                continue  # timed out or cancelled
+            self.in_flight += slots
+            granted.set_result(None)
+
+
+def default_workflow_manager():
+    """
+    Builds the WorkflowManager served by the app from the EDA_* environment variables.
+    """
+    from workflow_manager import WorkflowManager
+    from LLMManager import LLMManager
+
+    db_url = os.getenv("EDA_DB_URL", "sqlite:///chinook.db")
+    llm_manager = None
+    if os.getenv("EDA_STUB_LLM") == "1":
+        from StubLLM import StubChatModel
+        llm_manager = LLMManager(llm=StubChatModel())
+    tenants = None
+    if os.getenv("EDA_TENANTS"):
+        with open(os.getenv("EDA_TENANTS")) as f:
+            tenants = json.load(f)
+    idle_timeout = float(os.getenv("EDA_TENANT_IDLE_TIMEOUT", "600"))
+    return WorkflowManager(db_url=db_url, llm_manager=llm_manager, snapshot=os.getenv("EDA_SNAPSHOT"),
+                           tenants=tenants, max_tenants=int(os.getenv("EDA_MAX_TENANTS", "16")),
+                           tenant_memory_bytes=int(float(os.getenv("EDA_TENANT_MEMORY_MB", "512")) * 1024 * 1024),
+                           tenant_idle_timeout=idle_timeout if idle_timeout > 0 else None)
+
+
+def create_app(workflow_manager=None, max_in_flight=None, max_queue=None, queue_timeout=None, request_timeout=None):
+    """
+    Creates the FastAPI app.
+
+    Args:
+        workflow_manager: The WorkflowManager to serve. Built from the environment on startup if None.
+        max_in_flight (int): Questions answered at the same time (EDA_MAX_IN_FLIGHT, default 16).
+        max_queue (int): Requests allowed to wait for a slot before answering 429 (EDA_MAX_QUEUE, default 64).
+        queue_timeout (float): Seconds a request may wait for a slot before answering 503 (EDA_QUEUE_TIMEOUT, default 5).
+        request_timeout (float): Seconds a request may run before answering 504 (EDA_REQUEST_TIMEOUT, default 120).
+    """
+    if max_in_flight is None:
+        max_in_flight = int(os.getenv("EDA_MAX_IN_FLIGHT", "16"))
+    if max_queue is None:
+        max_queue = int(os.getenv("EDA_MAX_QUEUE", "64"))
+    if queue_timeout is None:
+        queue_timeout = float(os.getenv("EDA_QUEUE_TIMEOUT", "5"))
+    if request_timeout is None:
+        request_timeout = float(os.getenv("EDA_REQUEST_TIMEOUT", "120"))
+    batch_parallelism = int(os.getenv("EDA_BATCH_PARALLELISM", "8"))
+    metrics_file = os.getenv("EDA_METRICS_FILE")
+    metrics_interval = float(os.getenv("EDA_METRICS_INTERVAL", "15"))
+
+    async def sweep_tenants(interval):
+        # Closes idle tenant runtimes while no requests arrive (requests evict them on their own)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(app.state.workflow_manager.tenant_registry.evict)
+            except Exception as e:
+                logger.warning("Could not evict idle tenants: %s", e)
+
+    async def export_metrics():
+        # Keeps a Prometheus textfile up to date for deployments that scrape files instead of /metrics
+        while True:
+            await asyncio.sleep(metrics_interval)
+            try:
+                await asyncio.to_thread(app.state.workflow_manager.write_metrics, metrics_file)
+            except Exception as e:
+                logger.warning("Could not write the metrics file: %s", e)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if app.state.workflow_manager is None:
+            app.state.workflow_manager = await asyncio.to_thread(default_workflow_manager)
+        # Build the components and compile the graph before the first request
+        timings = await asyncio.to_thread(app.state.workflow_manager.warm_up)
+        print(f"Warmed up in {sum(timings.values()):.0f} ms: {timings}")
+        exporter = asyncio.create_task(export_metrics()) if metrics_file else None
+        registry = app.state.workflow_manager.tenant_registry
+        sweeper = None
+        if registry is not None and registry.idle_timeout is not None:
+            sweeper = asyncio.create_task(sweep_tenants(min(registry.idle_timeout / 2, 60.0)))
+        yield
+        for task in (exporter, sweeper):
+            if task is not None:
+                task.cancel()
+        await asyncio.to_thread(app.state.workflow_manager.close_tenants)
+
+    app = FastAPI(title="EDA Agent", lifespan=lifespan)
+    app.state.workflow_manager = workflow_manager
+    app.state.admission = AdmissionController(max_in_flight, max_queue, queue_timeout)
+
+    async def admitted(request: Request, work, slots=1):
+        """
+        Runs work() inside `slots` admission slots and returns the response with timing headers.
+        """
+        request_id = request.headers.get("X-Request-Id") or str(uuid_lib.uuid4())
+        headers = {"X-Request-Id": request_id}
+        try:
+            async with app.state.admission.slot(slots) as queue_time:
+                headers["X-Queue-Time-Ms"] = f"{queue_time * 1000:.1f}"
+                start = time.perf_counter()
+                try:
+                    # On timeout wait_for cancels the work and waits for it to stop, worker threads included (see
+                    # offload.to_thread), so the slots are only freed once the database work has ended
+                    body = await asyncio.wait_for(work(request_id), timeout=request_timeout)
+                    status = 200
+                except asyncio.TimeoutError:
+                    body, status = {"error": "Request timed out"}, 504
+                except UnknownTenant as e:
+                    body, status = {"error": f"Unknown tenant {e.args[0]}"}, 404
+                except Exception as e:
+                    body, status = {"error": str(e)}, 500
+                headers["X-Process-Time-Ms"] = f"{(time.perf_counter() - start) * 1000:.1f}"
+        except QueueFull:
+            headers["Retry-After"] = "1"
+            return JSONResponse({"error": "Too many requests queued"}, status_code=429, headers=headers)
+        except QueueTimeout:
+            headers["Retry-After"] = "1"
+            return JSONResponse({"error": "Timed out waiting for a free worker"}, status_code=503, headers=headers)
+
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    @app.post("/ask")
+    async def ask(body: AskRequest, request: Request):
+        async def work(request_id):
+            return await app.state.workflow_manager.arun_sql_agent(body.question, body.uuid or request_id,
+                                                                   tenant=body.tenant)
+        return await admitted(request, work)
+
+    @app.post("/batch")
+    async def batch(body: BatchRequest, request: Request):
+        # Every pipeline the batch runs in parallel takes a slot, so no batch can run more than max_in_flight
+        parallelism = body.parallelism if body.parallelism is not None else batch_parallelism
+        parallelism = max(1, min(parallelism, len(body.questions), app.state.admission.max_in_flight))
+
+        async def work(request_id):
+            items = await app.state.workflow_manager.arun_batch(body.questions, parallelism, uuid_prefix=request_id,
+                                                                tenant=body.tenant)
+            return {"results": items}
+        return await admitted(request, work, slots=parallelism)
+
+    @app.get("/health")
+    async def health():
+        admission = app.state.admission
+        manager = app.state.workflow_manager
+        return {
+            "status": "ok" if manager is not None else "starting",
+            "in_flight": admission.in_flight,
+            "waiting": admission.waiting,
+            "max_in_flight": admission.max_in_flight,
+            "max_queue": admission.max_queue,
+            "db_pool": manager.db_manager.pool_metrics() if manager is not None else None,
+            "tenants": manager.tenant_registry.snapshot() if manager is not None and manager.tenant_registry else None,
+        }
+
+    @app.get("/metrics")
+    async def metrics():
+        manager = app.state.workflow_manager
+        body = manager.metrics_text() if manager is not None else ""
+        return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+    return app
+
+
+app = create_app()
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("EDA_HOST", "127.0.0.1"), port=int(os.getenv("EDA_PORT", "8000")))
@@ -5,6 +5,19 @@ from LLMManager import LLMManager
 from State import InputState , ParsedQuestion
 from pydantic import BaseModel , Field
 from prompt_templates import sqlite_prompt_template , mysql_prompt_template , postgresql_prompt_template
+from SchemaPruner import SchemaPruner
+from SchemaRenderer import SchemaRenderer
+from SQLRepair import SQLRepair
+from VisualizationRules import VisualizationRules, CHART_TYPES
+from PlanCache import PlanCache
+from ResultSummarizer import ResultSummarizer
+from BatchRunner import current_batch
+from Telemetry import telemetry
+from offload import to_thread
+import logging
+
+# Per-request details go to telemetry events, problems to this logger; neither writes to stdout
+logger = logging.getLogger("eda.sql_agent")
 
 # -----------------------------------------------------------------------------------------------------------------------------
 # Defining the schema for the parsed question
@@ -12,71 +25,272 @@ from prompt_templates import sqlite_prompt_template , mysql_prompt_template , po
 
 # Check State.py for the definition of ParsedQuestion
 
+# -----------------------------------------------------------------------------------------------------------------------------
+# Prompts shared by the sync and async variants of the nodes
+# -----------------------------------------------------------------------------------------------------------------------------
+
+parse_question_prompt = ChatPromptTemplate.from_messages([
+    ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions about a database. 
+        Given the question and database schema, identify the relevant tables and columns. 
+        If the question is not relevant to the database or if there is not enough information to answer the question, set is_relevant to false.
+
+        Your response should be in the following JSON format:
+        {{
+            "is_relevant": boolean,
+            "relevant_tables": [
+                {{
+                    "table_name": string,
+                    "columns": [string],
+                    "noun_columns": [string]
+                }}
+            ]
+        }}
+
+        The "noun_columns" field should contain only the columns that are relevant to the question and contain nouns or names, for example, the column "Artist name" contains nouns relevant to the question "What are the top selling artists?", but the column "Artist ID" is not relevant because it does not contain a noun. Do not include columns that contain numbers.
+    '''),
+    ("human", "===Database schema===\n{schema}\n\n===User question===\n{question}\n\nIdentify relevant tables and columns:")
+])
+
+format_results_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
+    ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
+])
+
+choose_visualization_prompt = ChatPromptTemplate.from_messages([
+    ("system", '''
+    You are an AI assistant that recommends appropriate data visualizations. Based on the user's question, SQL query, and query results, suggest the most suitable type of graph or chart to visualize the data. If no visualization is appropriate, indicate that.
+
+    Available chart types and their use cases:
+    - Bar Graphs: Best for comparing categorical data or showing changes over time when categories are discrete and the number of categories is more than 2. Use for questions like "What are the sales figures for each product?" or "How does the population of cities compare? or "What percentage of each city is male?"
+    - Horizontal Bar Graphs: Best for comparing categorical data or showing changes over time when the number of categories is small or the disparity between categories is large. Use for questions like "Show the revenue of A and B?" or "How does the population of 2 cities compare?" or "How many men and women got promoted?" or "What percentage of men and what percentage of women got promoted?" when the disparity between categories is large.
+    - Scatter Plots: Useful for identifying relationships or correlations between two numerical variables or plotting distributions of data. Best used when both x axis and y axis are continuous. Use for questions like "Plot a distribution of the fares (where the x axis is the fare and the y axis is the count of people who paid that fare)" or "Is there a relationship between advertising spend and sales?" or "How do height and weight correlate in the dataset? Do not use it for questions that do not have a continuous x axis."
+    - Pie Charts: Ideal for showing proportions or percentages within a whole. Use for questions like "What is the market share distribution among different companies?" or "What percentage of the total revenue comes from each product?"
+    - Line Graphs: Best for showing trends and distributionsover time. Best used when both x axis and y axis are continuous. Used for questions like "How have website visits changed over the year?" or "What is the trend in temperature over the past decade?". Do not use it for questions that do not have a continuous x axis or a time based x axis.
+
+    Consider these types of questions when recommending a visualization:
+    1. Aggregations and Summarizations (e.g., "What is the average revenue by month?" - Line Graph)
+    2. Comparisons (e.g., "Compare the sales figures of Product A and Product B over the last year." - Line or Column Graph)
+    3. Plotting Distributions (e.g., "Plot a distribution of the age of users" - Scatter Plot)
+    4. Trends Over Time (e.g., "What is the trend in the number of active users over the past year?" - Line Graph)
+    5. Proportions (e.g., "What is the market share of the products?" - Pie Chart)
+    6. Correlations (e.g., "Is there a correlation between marketing spend and revenue?" - Scatter Plot)
+
+    Provide your response in the following format:
+    Recommended Visualization: [Chart type or "None"]. ONLY use the following names: bar, horizontal_bar, line, pie, scatter, none
+    Reason: [Brief explanation for your recommendation]
+    '''),
+                ("human", '''
+    User question: {question}
+    SQL query: {sql_query}
+    Query results: {results}
+
+    Recommend a visualization:'''),
+            ])
+
+fix_sql_prompt = ChatPromptTemplate.from_messages([
+    ("system", '''You are an AI assistant that fixes SQL queries. The database type is {db_type}.
+    Here is the error message:
+    {error_message}
+    Fix the following SQL query:
+    {query}
+    Previous attempts that also failed (do not repeat them):
+    {previous_attempts}
+    Only return the corrected SQL query.
+    '''),
+])
+
 # -----------------------------------------------------------------------------------------------------------------------------
 # Building the SQL Agent class
 # -----------------------------------------------------------------------------------------------------------------------------
 
 class SQLAgent:
-    def __init__(self):
-        self.db_manager = DatabaseManager()
-        self.llm_manager = LLMManager()
+    def __init__(self, db_manager=None, llm_manager=None, schema_token_budget=None, schema_hops=1, noun_top_k=20,
+                 result_token_budget=1500, schema_style="ddl", schema_nullability=True, schema_defaults=False,
+                 local_sql_repair=True, local_repair_rounds=3, visualization_rules=True,
+                 visualization_threshold=0.75, plan_cache_dir=".eda_cache"):
+        # The managers can be shared with other components (see WorkflowManager) so that one engine/connection pool
+        # and one LLM client serve every request
+        self.db_manager = db_manager if db_manager is not None else DatabaseManager()
+        self.llm_manager = llm_manager if llm_manager is not None else LLMManager()
+        # The schema goes into the prompts as DDL (or one line per table), see SchemaRenderer
+        self.schema_renderer = SchemaRenderer(style=schema_style, include_nullability=schema_nullability,
+                                              include_defaults=schema_defaults)
+        self.schema_pruner = SchemaPruner(hops=schema_hops, token_budget=schema_token_budget,
+                                          value_lookup=self.db_manager.value_index.match_columns,
+                                          renderer=self.schema_renderer)
+        self.noun_top_k = noun_top_k
+        # Plans are dropped when the schema fingerprint changes, so agents of different databases need their own
+        self.plan_cache = PlanCache(cache_dir=plan_cache_dir,
+                                    database=self.db_manager.engine.url.render_as_string(hide_password=True))
+        self.result_summarizer = ResultSummarizer(token_budget=result_token_budget)
+        # Invalid queries are first repaired against the cached schema, the LLM is only asked when that fails
+        self.sql_repair = SQLRepair(self.db_manager.get_db_type())
+        self.local_sql_repair = local_sql_repair
+        self.local_repair_rounds = local_repair_rounds
+        # The chart is chosen from the result columns; the LLM is only asked when the rules are not confident enough
+        self.visualization_rules = None
+        if visualization_rules:
+            self.visualization_rules = VisualizationRules(threshold=visualization_threshold)
+
+    def close(self):
+        """Closes the plan cache. The managers can be shared, so closing them is left to their owner."""
+        self.plan_cache.close()
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Nodes
+    # Every node has an async variant (prefixed with "a") used by WorkflowManager.arun_sql_agent. Nodes that only touch
+    # the database or local caches are offloaded to a thread, nodes that call the LLM await LLMManager.ainvoke.
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    def _schema_snapshot(self) -> dict:
+        """
+        Returns the schema snapshot (fingerprint, schema, graph) to answer with: the one taken at the start of the
+        running batch (see BatchRunner), otherwise the current one from the schema cache.
+        """
+        batch = current_batch.get()
+        if batch is not None:
+            return batch.snapshot
+        return self.db_manager.schema_cache.get()
 
-    def parse_question(self, state:InputState):
+    def lookup_plan(self, state: dict) -> dict:
+        """
+        Looks the question up in the plan cache. On a hit the cached SQL and visualization are put in the state
+        and the workflow jumps straight to execute_sql.
+        """
+        plan = self.plan_cache.get(state['question'], self._schema_snapshot()['fingerprint'])
+        telemetry.count("eda_plan_cache_lookups_total", result="miss" if plan is None else "hit")
+        if plan is None:
+            return {"plan_cache_hit": False}
+
+        return {
+            "plan_cache_hit": True,
+            "sql_query": plan['sql_query'],
+            "sql_valid": True,
+            "visualization": plan['visualization'],
+            "visualization_reason": plan['visualization_reason'],
+        }
+
+    async def alookup_plan(self, state: dict) -> dict:
+        return await to_thread(self.lookup_plan, state)
+
+    def store_plan(self, state: dict) -> dict:
+        """
+        Stores the validated SQL and chosen visualization of a freshly answered question in the plan cache.
+        A cached plan whose query failed to execute is evicted instead.
+        """
+        results = state['results']
+        failed = isinstance(results, dict) and 'error' in results
+
+        if state.get('plan_cache_hit'):
+            if failed:
+                self.plan_cache.evict(state['question'])
+            return {}
+
+        if failed or results == "NOT_RELEVANT" or not state.get('sql_valid'):
+            return {}
+
+        result_columns = list(results[0].keys()) if results else []
+        self.plan_cache.put(state['question'], self._schema_snapshot()['fingerprint'], state['sql_query'],
+                            state['visualization'], state.get('visualization_reason', ''), result_columns)
+        return {}
+
+    async def astore_plan(self, state: dict) -> dict:
+        return await to_thread(self.store_plan, state)
+
+    def retrieve_schema(self, state: dict) -> dict:
+        """
+        Selects the tables relevant to the question (plus their foreign key neighbours) before any LLM call,
+        so that parse_question and generate_sql only receive that part of the schema.
+        """
         question = state['question']
-        schema = state['schema']
+        snapshot = self._schema_snapshot()
+        schema, graph = snapshot['schema'], snapshot['graph']
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", '''You are a data analyst that can help summarize SQL tables and parse user questions about a database. 
-                Given the question and database schema, identify the relevant tables and columns. 
-                If the question is not relevant to the database or if there is not enough information to answer the question, set is_relevant to false.
+        pruned_schema, report = self.schema_pruner.prune(question, schema, graph)
+        telemetry.event("schema_pruning", tables_kept=report['tables_kept'], tables_total=report['tables_total'],
+                        tokens=report['estimated_tokens'],
+                        columns_dropped=sum(len(columns) for columns in report['columns_dropped'].values()))
+        return {'schema': pruned_schema, 'schema_text': self.schema_renderer.render(pruned_schema),
+                'schema_pruning': report}
 
-                Your response should be in the following JSON format:
-                {{
-                    "is_relevant": boolean,
-                    "relevant_tables": [
-                        {{
-                            "table_name": string,
-                            "columns": [string],
-                            "noun_columns": [string]
-                        }}
-                    ]
-                }}
+    async def aretrieve_schema(self, state: dict) -> dict:
+        return await to_thread(self.retrieve_schema, state)
+
+    def _schema_text(self, state: dict) -> str:
+        # A schema passed in with the input has not been through retrieve_schema
+        if state.get('schema_text'):
+            return state['schema_text']
+        return self.schema_renderer.render(state['schema'])
 
-                The "noun_columns" field should contain only the columns that are relevant to the question and contain nouns or names, for example, the column "Artist name" contains nouns relevant to the question "What are the top selling artists?", but the column "Artist ID" is not relevant because it does not contain a noun. Do not include columns that contain numbers.
-            '''),
-            ("human", "===Database schema===\n{schema}\n\n===User question===\n{question}\n\nIdentify relevant tables and columns:")
-        ])
+    def parse_question(self, state:InputState):
+        question = state['question']
+        schema = self._schema_text(state)
+
+        response = self.llm_manager.invoke(parse_question_prompt, parser=ParsedQuestion, task="parse",
+                                           schema=schema, question=question)
+        return {'parsed_question': response}
 
-        response = self.llm_manager.invoke(prompt, parser=ParsedQuestion , schema=schema, question=question)
+    async def aparse_question(self, state:InputState):
+        response = await self.llm_manager.ainvoke(parse_question_prompt, parser=ParsedQuestion, task="parse",
+                                                  schema=self._schema_text(state), question=state['question'])
         return {'parsed_question': response}
         
     def get_unique_nouns(self, state: dict) -> dict:
-        """Find unique nouns in relevant tables and columns."""
+        """
+        Find the stored values of the relevant noun columns that are closest to the words of the question.
+        Values come from the sidecar value index, so no DISTINCT scan runs against the database per question,
+        and only the noun_top_k best matches are returned.
+        """
+        question = state['question']
         parsed_question = state['parsed_question']
         
         if not parsed_question.is_relevant:
             return {"unique_nouns": []}
 
-        unique_nouns = set()
+        value_index = self.db_manager.value_index
+        batch = current_batch.get()
+        matches = {}
         for table_info in parsed_question.relevant_tables:
             table_name = table_info.table_name
             noun_columns = table_info.noun_columns
             
             if noun_columns:
-                column_names = ', '.join(f"`{col}`" for col in noun_columns)
-                query = f"SELECT DISTINCT {column_names} FROM `{table_name}`"
                 try:
-                    results = self.db_manager.execute_query(query)
-                    print(results)
-                    for row in results:
-                        unique_nouns.update(str(value) for value in row if value)
+                    if batch is not None:
+                        batch.ensure_indexed(value_index, table_name, noun_columns)  # once per batch
+                    for value, score in value_index.lookup(question, table_name, noun_columns, k=self.noun_top_k,
+                                                           ensure=batch is None):
+                        matches[value] = max(score, matches.get(value, 0))
                 except Exception as e:
-                    print(f"Error getting unique nouns for {table_name}: {e}") #log
+                    logger.warning("Error getting unique nouns for %s: %s", table_name, e)
                     # Consider whether to reraise, continue, or return partial results
         
-        return {"unique_nouns": list(unique_nouns)}
+        unique_nouns = sorted(matches, key=lambda value: -matches[value])[:self.noun_top_k]
+        return {"unique_nouns": unique_nouns}
+
+    async def aget_unique_nouns(self, state: dict) -> dict:
+        return await to_thread(self.get_unique_nouns, state)
 
-    def generate_sql(self, db_manager: DatabaseManager, llm_manager: LLMManager, state: dict) -> dict:
+    def _sql_prompt(self):
+        """Returns the SQL generation prompt of the database dialect, or None if the dialect is not supported."""
+        db_type = self.db_manager.get_db_type()
+
+        if db_type == "sqlite":
+            return sqlite_prompt_template
+        elif db_type == "mysql":
+            return mysql_prompt_template
+        elif db_type == "postgresql":
+            return postgresql_prompt_template
+        return None
+
+    @staticmethod
+    def _sql_response(response: str) -> dict:
+        if response.strip() == "NOT_ENOUGH_INFO":
+            return {"sql_query": "NOT_RELEVANT"}
+        else:
+            return {"sql_query": response}
+
+    def generate_sql(self, state: dict) -> dict:
         
         question = state['question']
         parsed_question = state['parsed_question']
@@ -85,29 +299,39 @@ class SQLAgent:
         if not parsed_question.is_relevant:
             return {"sql_query": "NOT_RELEVANT", "is_relevant": False}
 
-        schema = db_manager.get_schema()
-        db_type = db_manager.get_db_type()
-
-        if db_type == "sqlite":
-            prompt = sqlite_prompt_template
-        elif db_type == "mysql":
-            prompt = mysql_prompt_template
-        elif db_type == "postgresql":
-            prompt = postgresql_prompt_template
-        else:
+        schema = self._schema_text(state)  # pruned to the question by retrieve_schema
+        prompt = self._sql_prompt()
+        if prompt is None:
             return {"sql_query": "UNSUPPORTED_DATABASE"}
 
         try:
-            response = llm_manager.invoke(prompt, parser=None , schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
-
-            if response.strip() == "NOT_ENOUGH_INFO":
-                return {"sql_query": "NOT_RELEVANT"}
-            else:
-                return {"sql_query": response}
+            response = self.llm_manager.invoke(prompt, parser=None, task="generate_sql", schema=schema, question=question, parsed_question=parsed_question, unique_nouns=unique_nouns)
+            return self._sql_response(response)
             
         except Exception as e:
-            print(f"Error during LLM invocation: {e}")  # Log the error
+            logger.warning("Error during LLM invocation: %s", e)
             return {"sql_query": "ERROR"} # Or some other error indicator
+
+    async def agenerate_sql(self, state: dict) -> dict:
+        parsed_question = state['parsed_question']
+
+        if not parsed_question.is_relevant:
+            return {"sql_query": "NOT_RELEVANT", "is_relevant": False}
+
+        prompt = self._sql_prompt()
+        if prompt is None:
+            return {"sql_query": "UNSUPPORTED_DATABASE"}
+
+        try:
+            response = await self.llm_manager.ainvoke(prompt, parser=None, task="generate_sql",
+                                                      schema=self._schema_text(state),
+                                                      question=state['question'],
+                                                      parsed_question=parsed_question, unique_nouns=state['unique_nouns'])
+            return self._sql_response(response)
+
+        except Exception as e:
+            logger.warning("Error during LLM invocation: %s", e)
+            return {"sql_query": "ERROR"}
         
     def execute_sql(self, state: dict) -> dict:
         """Execute SQL query and return results."""
@@ -117,76 +341,225 @@ class SQLAgent:
             return {"results": "NOT_RELEVANT"}
 
         try:
-            results = self.db_manager.execute_query(query)
-            return {"results": results}
+            return self._execution_result(self.db_manager.execute_query(query))
+        except Exception as e:
+            return {"error": str(e), "error_type": "database"}
+
+    async def aexecute_sql(self, state: dict) -> dict:
+        query = state['sql_query']
+
+        if query == "NOT_RELEVANT":
+            return {"results": "NOT_RELEVANT"}
+
+        try:
+            return self._execution_result(await self.db_manager.aexecute_query(query))
         except Exception as e:
-            return {"error": str(e)}
+            return {"error": str(e), "error_type": "database"}
+
+    @staticmethod
+    def _execution_result(results) -> dict:
+        if isinstance(results, dict) and 'error' in results:
+            # Failed executions carry an error_type the workflow routes on (see handle_query_error)
+            return {"results": results, "error": results['error'], "error_type": results.get('error_type', "database")}
+        return {"results": results, "results_truncated": getattr(results, 'truncated', False)}
+
+    def handle_query_error(self, state: dict) -> dict:
+        """
+        Answers a question whose query failed to run (rejected as too expensive, timed out, cancelled or failed in the
+        database) without calling the LLM. A cached plan whose query failed is evicted.
+        """
+        messages = {
+            "cost_exceeded": "The query needed to answer this question is too expensive to run. Try narrowing it down.",
+            "timeout": "The query needed to answer this question took too long to run. Try narrowing it down.",
+            "cancelled": "The query was cancelled before it finished.",
+        }
+        error_type = state.get('error_type', "database")
+        answer = messages.get(error_type, "The query failed to run on the database.")
+        telemetry.event("query_failed", error_type=error_type, error=state.get('error'))
+
+        update = {"answer": answer, "formatted_data_for_visualization": None}
+        if state.get('plan_cache_hit'):
+            self.plan_cache.evict(state['question'])
+        else:
+            update["visualization"] = "none"
+            update["visualization_reason"] = "The query did not return results."
+        return update
+
+    async def ahandle_query_error(self, state: dict) -> dict:
+        return await to_thread(self.handle_query_error, state)
+
+    def summarize_results(self, state: dict) -> dict:
+        """
+        Replaces results larger than the token budget by a digest (row count, column types, ranges, top categories,
+        sample rows) that format_results and choose_visualization put in their prompts instead of the raw rows.
+        """
+        results = state.get('results')
+        if results is None or results == "NOT_RELEVANT":
+            return {"results_digest": results}
+
+        digest, report = self.result_summarizer.summarize(results)
+        telemetry.event("results_summary", **report)
+        return {"results_digest": digest, "results_tokens": report}
+
+    async def asummarize_results(self, state: dict) -> dict:
+        return await to_thread(self.summarize_results, state)
 
     # else block within the try block is complete for now
 
+    @staticmethod
+    def _validation_result(check: dict) -> dict:
+        report = {"validation_strategy": check['strategy'], "validation_ms": round(check['latency_ms'], 3)}
+        telemetry.event("sql_validation", valid=check['valid'], strategy=check['strategy'],
+                        duration_ms=report['validation_ms'])
+        if check['valid']:
+            return {"sql_valid": True, "valid": "valid", **report}
+        else:
+            return {"sql_valid": False, "sql_issues": check['message'], "valid": "invalid", **report}
+
     def validator(self, state: dict) -> dict:
-        """Validate the generated SQL query."""
+        """Validate the generated SQL query without executing it (see DatabaseManager.check_query)."""
         sql_query = state['sql_query']
 
         if sql_query == "NOT_RELEVANT":
-            return {"sql_valid": False, "sql_issues": "NOT_RELEVANT", "valid": "invalid"}
+            # Nothing to validate or fix, execute_sql turns this into a NOT_RELEVANT result
+            return {"sql_valid": False, "sql_issues": "NOT_RELEVANT", "valid": "not_relevant"}
 
         try:
-            ret, executable = self.db_manager.validate_query(sql_query)
-            if executable:
-                return {"sql_valid": True, "valid": "valid"}
-            else:
-                return {"sql_valid": False, "sql_issues": ret, "valid": "invalid"}
+            return self._validation_result(self.db_manager.check_query(sql_query))
         except Exception as e:
-            print(f"Error during SQL validation: {e}")
+            logger.warning("Error during SQL validation: %s", e)
             return {"sql_valid": False, "sql_issues": str(e), "valid": "invalid"}
 
+    async def avalidator(self, state: dict) -> dict:
+        sql_query = state['sql_query']
+
+        if sql_query == "NOT_RELEVANT":
+            return {"sql_valid": False, "sql_issues": "NOT_RELEVANT", "valid": "not_relevant"}
 
-    def fix_sql(self, query:str, error_message:str)-> str | None:
+        try:
+            return self._validation_result(await self.db_manager.acheck_query(sql_query))
+        except Exception as e:
+            logger.warning("Error during SQL validation: %s", e)
+            return {"sql_valid": False, "sql_issues": str(e), "valid": "invalid"}
+
+    def _repair_locally(self, query: str, error_message: str) -> dict:
+        """
+        Repairs the query without the LLM (see SQLRepair), one error at a time, re-validating after every edit.
+
+        Returns:
+            dict: 'query' (the valid repaired query, or None), 'fixes' (the edits made) and 'history' (the
+                  (query, error) pairs of the edited queries that were still invalid).
         """
-        Attempts to fix an invalid SQL query using the LLM.
-        Has a maximum of 3 retries in order to avoid a recursive loop and reduce cost.
+        schema = self._schema_snapshot()['schema']
+        fixes, history = [], []
+        for _ in range(self.local_repair_rounds):
+            repair = self.sql_repair.repair(query, error_message, schema)
+            if repair is None:
+                break
+            query = repair['query']
+            fixes.append(repair['fix'])
+            error_message, valid = self.db_manager.validate_query(query)
+            if valid:
+                return {'query': query, 'fixes': fixes, 'history': history}
+            history.append((query, error_message))
+        return {'query': None, 'fixes': fixes, 'history': history}
+
+    @staticmethod
+    def _previous_attempts(history) -> str:
+        if not history:
+            return "None"
+        return "\n".join(f"{i}. {query}\n   Error: {error}" for i, (query, error) in enumerate(history, 1))
+
+    @staticmethod
+    def _repair_result(method, query, fixes, attempts):
+        telemetry.count("eda_sql_repairs_total", method=method)
+        report = {"method": method, "fixes": fixes, "llm_attempts": attempts}
+        telemetry.event("sql_repair", **report)
+        if method == "failed":
+            return {"sql_query": "NOT_RELEVANT", "sql_issues": "Cannot write a query that is valid for your prompt",
+                    "sql_repair": report}
+        return {"sql_query": query, "sql_repair": report}
+
+    def fix_sql(self, state: dict) -> dict:
+        """
+        Attempts to fix an invalid SQL query, first locally against the cached schema (misspelled or ambiguous
+        identifiers, quoting, functions of another dialect, see SQLRepair) and then with the LLM.
+        The LLM has a maximum of 3 retries in order to avoid a recursive loop and reduce cost; every retry is shown the
+        queries that already failed and their errors, so that it does not repeat them.
 
         Args:
-            query: The invalid SQL query.
-            error_message: The error message from the validator.
+            state: The workflow state, holding the invalid SQL query ('sql_query')
+                   and the error message from the validator ('sql_issues').
 
         Returns:
-            The fixed SQL query, or None if it couldn't be fixed.
+            The fixed SQL query, or NOT_RELEVANT if it couldn't be fixed, and a 'sql_repair' report.
         """
+        query = state['sql_query']
+        error_message = state.get('sql_issues', '')
         db_type = self.db_manager.get_db_type()
 
-        if db_type in {"sqlite","mysql","postgresql"}:
-            pass
-        else:
-            return {"sql_query": "UNSUPPORTED_DATABASE"}  # Or raise an exception
-
-        prompt = ChatPromptTemplate.from_messages([
-        ("system", f'''You are an AI assistant that fixes SQL queries. The database type is {db_type}.
-        Here is the error message:
-        {error_message}
-        Fix the following SQL query:
-        {query}
-        Only return the corrected SQL query.
-        '''),
-        ])
+        if db_type not in {"sqlite","mysql","postgresql"}:
+            return {"sql_query": "NOT_RELEVANT", "sql_issues": "UNSUPPORTED_DATABASE"}
 
-        try:
-            retries = 0
+        local = self._repair_locally(query, error_message) if self.local_sql_repair else \
+            {'query': None, 'fixes': [], 'history': []}
+        if local['query'] is not None:
+            return self._repair_result("local", local['query'], local['fixes'], 0)
 
+        history = local['history']
+        retries = 0
+        try:
             while retries < 3:
-                response = self.llm_manager.invoke(prompt,parser=None, query=query, error_message=error_message)
+                telemetry.count("eda_fix_sql_attempts_total")
+                # Only the first attempt may come from the response cache, a cached answer failed before
+                response = self.llm_manager.invoke(fix_sql_prompt, parser=None, task="fix",
+                                                   use_cache=retries == 0, db_type=db_type, query=query,
+                                                   error_message=error_message,
+                                                   previous_attempts=self._previous_attempts(history))
+                retries += 1
                 # Re-validate the fixed query
-                _, validation_result = self.db_manager.validate_query(response)
+                message, validation_result = self.db_manager.validate_query(response)
                 if validation_result:
-                    return {'sql_query':response}
-                else:
-                    retries += 1
-            return 'Cannot write a query that is valid for your prompt'
+                    return self._repair_result("llm", response, local['fixes'], retries)
+                history.append((response, message))
 
         except Exception as e:
-            print(f"Error during LLM-based SQL fixing: {e}")
-            return None           
+            logger.warning("Error during LLM-based SQL fixing: %s", e)
+
+        return self._repair_result("failed", None, local['fixes'], retries)
+
+    async def afix_sql(self, state: dict) -> dict:
+        query = state['sql_query']
+        error_message = state.get('sql_issues', '')
+        db_type = self.db_manager.get_db_type()
+
+        if db_type not in {"sqlite","mysql","postgresql"}:
+            return {"sql_query": "NOT_RELEVANT", "sql_issues": "UNSUPPORTED_DATABASE"}
+
+        local = await to_thread(self._repair_locally, query, error_message) if self.local_sql_repair else \
+            {'query': None, 'fixes': [], 'history': []}
+        if local['query'] is not None:
+            return self._repair_result("local", local['query'], local['fixes'], 0)
+
+        history = local['history']
+        retries = 0
+        try:
+            while retries < 3:
+                telemetry.count("eda_fix_sql_attempts_total")
+                response = await self.llm_manager.ainvoke(fix_sql_prompt, parser=None, task="fix",
+                                                          use_cache=retries == 0, db_type=db_type, query=query,
+                                                          error_message=error_message,
+                                                          previous_attempts=self._previous_attempts(history))
+                retries += 1
+                message, validation_result = await self.db_manager.avalidate_query(response)
+                if validation_result:
+                    return self._repair_result("llm", response, local['fixes'], retries)
+                history.append((response, message))
+
+        except Exception as e:
+            logger.warning("Error during LLM-based SQL fixing: %s", e)
+
+        return self._repair_result("failed", None, local['fixes'], retries)
 
     def format_results(self, state: dict) -> dict:
         """Format query results into a human-readable response."""
@@ -196,16 +569,63 @@ class SQLAgent:
         if results == "NOT_RELEVANT":
             return {"answer": "Sorry, I can only give answers relevant to the database."}
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", "You are an AI assistant that formats database query results into a human-readable response. Give a conclusion to the user's question based on the query results. Do not give the answer in markdown format. Only give the answer in one line."),
-            ("human", "User question: {question}\n\nQuery results: {results}\n\nFormatted response:"),
-        ])
+        response = self.llm_manager.invoke(format_results_prompt, task="summarize", question=question,
+                                           results=state.get('results_digest', results))
+        return {"answer": response}
+
+    async def aformat_results(self, state: dict) -> dict:
+        results = state['results']
+
+        if results == "NOT_RELEVANT":
+            return {"answer": "Sorry, I can only give answers relevant to the database."}
 
-        response = self.llm_manager.invoke(prompt, question=question, results=results)
+        response = await self.llm_manager.ainvoke(format_results_prompt, task="summarize",
+                                                  question=state['question'],
+                                                  results=state.get('results_digest', results))
         return {"answer": response}
-    
+
+    @staticmethod
+    def _visualization_response(response: str, fallback: dict) -> dict:
+        """
+        Reads the "Recommended Visualization: ..." and "Reason: ..." lines of the LLM answer. The chart name is matched
+        loosely ("Horizontal Bar", "[pie]."); an answer without a known chart keeps the rule decision.
+        """
+        visualization, reason = None, ""
+        for line in response.splitlines():
+            key, _, value = line.partition(':')
+            key = key.strip(' *').lower()
+            if key.endswith("visualization") and visualization is None:
+                name = value.strip(' []."\'*').lower().replace(" ", "_").replace("-", "_")
+                visualization = next((chart for chart in CHART_TYPES if name.startswith(chart)), None)
+            elif key == "reason":
+                reason = value.strip(' *')
+        if visualization is None:
+            logger.info("The LLM did not name a known chart type, keeping the rule decision")
+            return fallback
+        return {**fallback, "visualization": visualization, "visualization_reason": reason}
+
+    def _rule_visualization(self, state: dict):
+        """
+        Returns the rule decision (see VisualizationRules) with the method that made it: 'rules' when it is confident
+        enough to skip the LLM, 'llm' when the LLM has to be asked.
+        """
+        if self.visualization_rules is None:
+            return {"visualization": "none", "visualization_reason": "", "visualization_confidence": 0.0,
+                    "visualization_method": "llm"}
+        decision = self.visualization_rules.choose(state['question'], state['results'])
+        confident = decision['visualization_confidence'] >= self.visualization_rules.threshold
+        decision["visualization_method"] = "rules" if confident else "llm"
+        telemetry.count("eda_visualization_choices_total", method=decision["visualization_method"],
+                        visualization=decision['visualization'] if confident else "deferred")
+        telemetry.event("visualization_rules", visualization=decision['visualization'],
+                        confidence=decision['visualization_confidence'], method=decision["visualization_method"])
+        return decision
+
     def choose_visualization(self, state: dict) -> dict:
-        """Choose an appropriate visualization for the data."""
+        """
+        Choose an appropriate visualization for the data: from the result columns when the rules are confident,
+        otherwise by asking the LLM.
+        """
         question = state['question']
         results = state['results']
         sql_query = state['sql_query']
@@ -213,41 +633,34 @@ class SQLAgent:
         if results == "NOT_RELEVANT":
             return {"visualization": "none", "visualization_reasoning": "No visualization needed for irrelevant questions."}
 
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", '''
-            You are an AI assistant that recommends appropriate data visualizations. Based on the user's question, SQL query, and query results, suggest the most suitable type of graph or chart to visualize the data. If no visualization is appropriate, indicate that.
-
-            Available chart types and their use cases:
-            - Bar Graphs: Best for comparing categorical data or showing changes over time when categories are discrete and the number of categories is more than 2. Use for questions like "What are the sales figures for each product?" or "How does the population of cities compare? or "What percentage of each city is male?"
-            - Horizontal Bar Graphs: Best for comparing categorical data or showing changes over time when the number of categories is small or the disparity between categories is large. Use for questions like "Show the revenue of A and B?" or "How does the population of 2 cities compare?" or "How many men and women got promoted?" or "What percentage of men and what percentage of women got promoted?" when the disparity between categories is large.
-            - Scatter Plots: Useful for identifying relationships or correlations between two numerical variables or plotting distributions of data. Best used when both x axis and y axis are continuous. Use for questions like "Plot a distribution of the fares (where the x axis is the fare and the y axis is the count of people who paid that fare)" or "Is there a relationship between advertising spend and sales?" or "How do height and weight correlate in the dataset? Do not use it for questions that do not have a continuous x axis."
-            - Pie Charts: Ideal for showing proportions or percentages within a whole. Use for questions like "What is the market share distribution among different companies?" or "What percentage of the total revenue comes from each product?"
-            - Line Graphs: Best for showing trends and distributionsover time. Best used when both x axis and y axis are continuous. Used for questions like "How have website visits changed over the year?" or "What is the trend in temperature over the past decade?". Do not use it for questions that do not have a continuous x axis or a time based x axis.
-
-            Consider these types of questions when recommending a visualization:
-            1. Aggregations and Summarizations (e.g., "What is the average revenue by month?" - Line Graph)
-            2. Comparisons (e.g., "Compare the sales figures of Product A and Product B over the last year." - Line or Column Graph)
-            3. Plotting Distributions (e.g., "Plot a distribution of the age of users" - Scatter Plot)
-            4. Trends Over Time (e.g., "What is the trend in the number of active users over the past year?" - Line Graph)
-            5. Proportions (e.g., "What is the market share of the products?" - Pie Chart)
-            6. Correlations (e.g., "Is there a correlation between marketing spend and revenue?" - Scatter Plot)
-
-            Provide your response in the following format:
-            Recommended Visualization: [Chart type or "None"]. ONLY use the following names: bar, horizontal_bar, line, pie, scatter, none
-            Reason: [Brief explanation for your recommendation]
-            '''),
-                        ("human", '''
-            User question: {question}
-            SQL query: {sql_query}
-            Query results: {results}
-
-            Recommend a visualization:'''),
-                    ])
-
-        response = self.llm_manager.invoke(prompt, question=question, sql_query=sql_query, results=results)
-        
-        lines = response.split('\n')
-        visualization = lines[0].split(': ')[1]
-        reason = lines[1].split(': ')[1]
+        if state.get('plan_cache_hit'):
+            return {}  # the visualization was restored from the plan cache
+
+        decision = self._rule_visualization(state)
+        if decision["visualization_method"] == "rules":
+            return decision
+
+        response = self.llm_manager.invoke(choose_visualization_prompt, task="visualize", question=question,
+                                           sql_query=sql_query,
+                                           results=state.get('results_digest', results))
+        return self._visualization_response(response, decision)
+
+    async def achoose_visualization(self, state: dict) -> dict:
+        results = state['results']
+
+        if results == "NOT_RELEVANT":
+            return {"visualization": "none", "visualization_reasoning": "No visualization needed for irrelevant questions."}
+
+        if state.get('plan_cache_hit'):
+            return {}
+
+        # The rules only profile the head of each column, cheap enough to run on the event loop
+        decision = self._rule_visualization(state)
+        if decision["visualization_method"] == "rules":
+            return decision
 
-        return {"visualization": visualization, "visualization_reason": reason}
\ No newline at end of file
+        response = await self.llm_manager.ainvoke(choose_visualization_prompt, task="visualize",
+                                                  question=state['question'],
+                                                  sql_query=state['sql_query'],
+                                                  results=state.get('results_digest', results))
+        return self._visualization_response(response, decision)
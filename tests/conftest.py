@@ -0,0 +1,92 @@
+import collections
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_database(path, rows=50):
+    """A small artists / albums / invoices database in a SQLite file."""
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE artists (ArtistId INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE albums (AlbumId INTEGER PRIMARY KEY, Title TEXT,
+                             ArtistId INTEGER REFERENCES artists (ArtistId));
+        CREATE TABLE invoices (InvoiceId INTEGER PRIMARY KEY, InvoiceDate TEXT, BillingCountry TEXT, Total REAL);
+    """)
+    conn.executemany("INSERT INTO artists VALUES (?, ?)", [(i, f"Artist {i}") for i in range(1, rows + 1)])
+    conn.executemany("INSERT INTO albums VALUES (?, ?, ?)",
+                     [(i, f"Album {i}", i % rows + 1) for i in range(1, 2 * rows + 1)])
+    conn.executemany("INSERT INTO invoices VALUES (?, ?, ?, ?)",
+                     [(i, f"2021-{i % 12 + 1:02d}-01", ["USA", "Canada", "France"][i % 3], i * 1.5)
+                      for i in range(1, rows + 1)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return make_database(str(tmp_path / "test.db"))
+
+
+@pytest.fixture
+def db_url(db_path):
+    return f"sqlite:///{db_path}"
+
+
+@pytest.fixture
+def db_manager(db_url):
+    from DatabaseManager import DatabaseManager
+    manager = DatabaseManager(db_url, cache_dir=None)
+    yield manager
+    manager.close()
+
+
+# The prompts of the SQL agent, by the phrase StubChatModel matches them on
+STUB_TASKS = [
+    ("parse user questions", "parse", {"BaseTable": "artists", "columns": ["Name"], "noun_columns": ["Name"],
+                                       "relevant_tables": [{"table_name": "artists", "column_name": ["Name"],
+                                                            "noun_columns": ["Name"]}],
+                                       "is_relevant": True}),
+    ("generates SQL queries", "generate_sql", "SELECT Name FROM artists ORDER BY ArtistId LIMIT 3"),
+    ("fixes SQL queries", "fix", "SELECT Name FROM artists ORDER BY ArtistId LIMIT 3"),
+    ("formats database query results", "summarize", "The first artists are Artist 1, Artist 2 and Artist 3."),
+    ("recommends appropriate data visualizations", "visualize", "Recommended Visualization: none\nReason: Stub."),
+]
+
+
+def stub_llm(calls, latency=0.0):
+    """A StubChatModel answering questions about the artists table, counting its calls per task in calls."""
+    from StubLLM import StubChatModel
+
+    def counted(task, response):
+        def respond(prompt):
+            calls[task] += 1
+            return response
+        return respond
+
+    return StubChatModel(responses=[(phrase, counted(task, response)) for phrase, task, response in STUB_TASKS],
+                         latency=latency)
+
+
+@pytest.fixture
+def llm_calls():
+    return collections.Counter()
+
+
+@pytest.fixture
+def workflow(db_manager, llm_calls, tmp_path, monkeypatch):
+    """A WorkflowManager on the test database with a stub LLM; the plan cache lives in tmp_path."""
+    from LLMManager import LLMManager
+    from workflow_manager import WorkflowManager
+
+    monkeypatch.chdir(tmp_path)
+    manager = WorkflowManager(db_manager=db_manager, llm_manager=LLMManager(cache_dir=None, llm=stub_llm(llm_calls)))
+    yield manager
+    if manager._sql_agent is not None:
+        manager.sql_agent.close()
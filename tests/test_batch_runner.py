@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from BatchRunner import BatchRunner, current_batch
+
+QUESTIONS = ["Which artists are there?", "which artists  are there", "Which albums are there?",
+             "WHICH ARTISTS ARE THERE?"]
+
+
+def test_plan_groups_normalized_duplicates():
+    unique, owners = BatchRunner.plan(QUESTIONS)
+    assert unique == [0, 2]
+    assert owners == [0, 0, 2, 0]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_duplicates_call_the_llm_once_per_node(workflow, llm_calls, asynchronous):
+    questions = ["Which artists are there?", "which artists  are there", "WHICH ARTISTS ARE THERE?"]
+    if asynchronous:
+        items = asyncio.run(workflow.arun_batch(questions, parallelism=4))
+    else:
+        items = workflow.run_batch(questions, parallelism=4)
+
+    assert llm_calls["parse"] == 1
+    assert llm_calls["generate_sql"] == 1
+    assert llm_calls["summarize"] == 1
+    assert [item["duplicate_of"] for item in items] == [None, 0, 0]
+    assert all(item["error"] is None for item in items)
+    assert items[1]["result"] is items[0]["result"]
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_items_come_back_in_input_order(workflow, asynchronous):
+    if asynchronous:
+        items = asyncio.run(workflow.arun_batch(QUESTIONS, parallelism=2))
+    else:
+        items = workflow.run_batch(QUESTIONS, parallelism=2)
+
+    assert [item["index"] for item in items] == [0, 1, 2, 3]
+    assert [item["question"] for item in items] == QUESTIONS
+    assert [item["duplicate_of"] for item in items] == [None, 0, None, 0]
+    assert items[0]["result"]["answer"] == "The first artists are Artist 1, Artist 2 and Artist 3."
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_every_question_of_a_batch_sees_one_snapshot(workflow, asynchronous):
+    agent = workflow.sql_agent
+    seen = []
+    snapshot = agent._schema_snapshot
+
+    def recording_snapshot():
+        seen.append((current_batch.get(), snapshot()))
+        return seen[-1][1]
+
+    agent._schema_snapshot = recording_snapshot
+    questions = ["Which artists are there?", "Which albums are there?", "Which invoices are there?"]
+    if asynchronous:
+        asyncio.run(workflow.arun_batch(questions, parallelism=3))
+    else:
+        workflow.run_batch(questions, parallelism=3)
+
+    batches = {id(batch) for batch, _ in seen}
+    assert len(seen) >= len(questions) and len(batches) == 1
+    batch = seen[0][0]
+    assert batch is not None
+    assert all(snapshot is batch.snapshot for _, snapshot in seen)
+    # The value index column of the three questions was brought up to date once
+    assert batch.indexed == {("artists", "Name")}
+    assert current_batch.get() is None
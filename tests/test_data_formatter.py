@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from DataFormatter import DataFormatter, factorize, pivot
+from LLMManager import LLMManager
+from StubLLM import StubChatModel
+
+
+@pytest.fixture
+def stub():
+    return StubChatModel(responses=[("labeling expert", "Stub Label")])
+
+
+@pytest.fixture
+def formatter(stub):
+    return DataFormatter(llm_manager=LLMManager(cache_dir=None, llm=stub))
+
+
+def formatted(formatter, visualization, results):
+    state = {'visualization': visualization, 'results': results, 'question': "question", 'sql_query': "SELECT"}
+    return formatter.format_data_for_visualization(state)['formatted_data_for_visualization']
+
+
+def test_factorize_keeps_the_order_of_first_appearance():
+    keys, codes = factorize(["b", "a", "b", None, "a"])
+    assert keys.tolist() == ["b", "a", None]
+    assert codes.tolist() == [0, 1, 0, 2, 1]
+
+
+def test_pivot_leaves_missing_cells_empty():
+    grid = pivot(np.array([0, 1, 1]), np.array([1, 0, 0]), np.array([1.0, 2.0, 3.0]), 2, 2)
+    assert np.isnan(grid[0, 0]) and np.isnan(grid[1, 1])
+    assert grid[0, 1] == 1.0
+    # The last value of a repeated cell wins
+    assert grid[1, 0] == 3.0
+
+
+def test_bar_chart_is_labelled_with_the_column_name(formatter, stub):
+    data = formatted(formatter, "bar", [{"BillingCountry": "USA", "total_sales": 10.5},
+                                        {"BillingCountry": "France", "total_sales": None}])
+    assert data == {"labels": ["USA", "France"], "values": [{"data": [10.5, None], "label": "Total Sales"}]}
+    assert stub.calls == 0
+
+
+def test_unnamed_column_is_labelled_by_the_llm(formatter, stub):
+    data = formatted(formatter, "bar", [("USA", 3), ("France", 2)])
+    assert data["values"][0]["label"] == "Stub Label"
+    assert stub.calls == 1
+
+
+def test_grouped_bar_chart_has_one_series_per_entity(formatter):
+    data = formatted(formatter, "bar", [("Artist 1", "2020", 3), ("Artist 1", "2021", 4), ("Artist 2", "2021", 5)])
+    assert data["labels"] == ["2020", "2021"]
+    assert data["values"] == [{"data": [3.0, 4.0], "label": "Artist 1"},
+                              {"data": [None, 5.0], "label": "Artist 2"}]
+
+
+def test_line_chart_with_several_series(formatter, stub):
+    data = formatted(formatter, "line", [{"Country": "USA", "Month": "2021-01", "Sales": 1},
+                                         {"Country": "USA", "Month": "2021-02", "Sales": 2},
+                                         {"Country": "France", "Month": "2021-02", "Sales": 3}])
+    assert data["xValues"] == ["2021-01", "2021-02"]
+    assert data["yValues"] == [{"data": [1.0, 2.0], "label": "USA"}, {"data": [None, 3.0], "label": "France"}]
+    assert data["yAxisLabel"] == "Sales"
+    assert data["meta"] == {"originalPointCount": 2, "pointCount": 2, "downsampled": False, "method": None}
+    assert stub.calls == 0
+
+
+def test_line_chart_with_one_series(formatter):
+    data = formatted(formatter, "line", [{"Year": 2020, "Total": 1.5}, {"Year": 2021, "Total": None}])
+    assert data["xValues"] == ["2020", "2021"]
+    assert data["yValues"] == [{"data": [1.5, None], "label": "Total"}]
+
+
+def test_scatter_plot_with_several_series(formatter):
+    data = formatted(formatter, "scatter", [("Rock", 1, 2), ("Jazz", 3, 4), ("Rock", 5, None), ("Rock", 7, 8)])
+    # Points with a missing coordinate are left out
+    assert data["series"] == [
+        {"data": [{"x": 1.0, "y": 2.0, "id": 1}, {"x": 7.0, "y": 8.0, "id": 2}], "label": "Rock"},
+        {"data": [{"x": 3.0, "y": 4.0, "id": 1}], "label": "Jazz"},
+    ]
+    assert data["meta"]["originalPointCount"] == 3
+
+
+def test_scatter_plot_of_two_columns(formatter):
+    data = formatted(formatter, "scatter", [(1, 2), (3, 4)])
+    assert data["series"] == [{"data": [{"x": 1.0, "y": 2.0, "id": 1}, {"x": 3.0, "y": 4.0, "id": 2}],
+                               "label": "Data Points"}]
@@ -0,0 +1,74 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+from conftest import make_database
+from DatabaseManager import DatabaseManager
+from workflow_manager import WorkflowManager
+
+
+@pytest.fixture
+def replicated(tmp_path):
+    """A manager on a primary with 50 artists and a replica that lags behind with 10."""
+    primary = make_database(str(tmp_path / "primary.db"))
+    replica = make_database(str(tmp_path / "replica.db"), rows=10)
+    manager = DatabaseManager(f"sqlite:///{primary}", cache_dir=None, read_replica_url=f"sqlite:///{replica}",
+                              result_cache_bytes=0)
+    yield manager, primary, replica
+    manager.close()
+
+
+def count(path, table="artists"):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_reads_go_to_the_replica(replicated):
+    manager, _, _ = replicated
+    assert manager.execute_query("SELECT COUNT(*) AS n FROM artists")[0]['n'] == 10
+    batches = list(manager.stream_query("SELECT Name FROM artists"))
+    assert sum(batch.num_rows for batch in batches) == 10
+
+
+def test_writes_go_to_the_primary(replicated):
+    manager, primary, replica = replicated
+    with manager.connect() as connection:
+        connection.execute(text("INSERT INTO artists (Name) VALUES ('New Artist')"))
+        connection.commit()
+    assert count(primary) == 51
+    assert count(replica) == 10
+
+
+@pytest.mark.parametrize("mode", ["static", "execute"])
+def test_validation_uses_the_primary(replicated, mode):
+    manager, primary, _ = replicated
+    manager.validation_mode = mode
+    conn = sqlite3.connect(primary)
+    conn.execute("CREATE TABLE playlists (PlaylistId INTEGER PRIMARY KEY, Name TEXT)")
+    conn.commit()
+    conn.close()
+    manager.refresh_schema()
+
+    # The replica has not caught up with the new table yet
+    assert manager.check_query("SELECT Name FROM playlists")['valid']
+    assert "error" in manager.execute_query("SELECT Name FROM playlists")
+
+
+def test_pool_gauges_are_exported_per_engine(replicated):
+    manager, _, _ = replicated
+    manager.execute_query("SELECT COUNT(*) AS n FROM artists")
+    with manager.connect():
+        metrics = manager.pool_metrics()
+    assert metrics['primary']['checked_out'] == 1
+    assert metrics['replica']['checked_out'] == 0
+    assert metrics['replica']['checkouts'] >= 1
+
+    exported = WorkflowManager(db_manager=manager).metrics_text()
+    assert 'eda_db_pool_checked_out{engine="primary"} 0' in exported
+    assert 'eda_db_pool_checked_out{engine="replica"} 0' in exported
+    assert 'eda_db_pool_waits{engine="replica"} 0' in exported
+    assert 'eda_db_pool_wait_seconds{engine="primary"}' in exported
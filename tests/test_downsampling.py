@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from DataFormatter import DataFormatter
+from downsampling import bin_2d, lttb, reservoir_sample, split_budget
+from LLMManager import LLMManager
+from StubLLM import StubChatModel
+
+
+@pytest.fixture
+def formatter():
+    return DataFormatter(llm_manager=LLMManager(cache_dir=None, llm=StubChatModel()),
+                         point_budgets={"line": 50, "scatter": 40})
+
+
+def test_lttb_keeps_the_endpoints_and_the_peak():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 50)
+    y[500] = 10
+    keep = lttb(x, y, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0 and keep[-1] == 999
+    assert 500 in keep
+    assert np.all(np.diff(keep) > 0)
+
+
+@pytest.mark.parametrize("threshold", [0, 1, 2, 3, 10])
+def test_lttb_stays_within_the_threshold(threshold):
+    x = np.arange(100, dtype=float)
+    assert len(lttb(x, x, threshold)) <= threshold
+
+
+def test_bin_2d_keeps_the_outliers():
+    rng = np.random.default_rng(1)
+    x, y = rng.normal(size=10000), rng.normal(size=10000)
+    x[1234], y[1234] = 100, 100
+    keep = bin_2d(x, y, 100)
+    assert len(keep) <= 100
+    assert 1234 in keep
+
+
+def test_reservoir_sample_is_deterministic_for_a_seed():
+    first = reservoir_sample(10000, 100, seed=7)
+    assert len(first) == 100 and len(np.unique(first)) == 100
+    assert np.array_equal(first, reservoir_sample(10000, 100, seed=7))
+    assert not np.array_equal(first, reservoir_sample(10000, 100, seed=8))
+    assert np.array_equal(reservoir_sample(10, 100), np.arange(10))
+
+
+@pytest.mark.parametrize("counts, budget", [([900, 90, 10], 100), ([1] * 150, 100), ([5, 5, 5], 100),
+                                            ([1000, 1, 1, 1], 10), ([3, 3, 3, 3], 4), ([7, 2], 5)])
+def test_split_budget_is_proportional_with_a_floor_of_one(counts, budget):
+    shares = split_budget(counts, budget)
+    assert shares.sum() <= budget
+    assert np.all(shares <= counts)
+    if len(counts) <= budget:
+        assert np.all(shares >= 1)
+    if sum(counts) > budget:
+        assert shares.sum() == budget
+
+
+def test_split_budget_follows_the_group_sizes():
+    assert split_budget([900, 90, 10], 100).tolist() == [88, 10, 2]
+
+
+def test_line_payload_is_downsampled_with_lttb(formatter):
+    results = [{"Day": i, "Total": float(i % 17)} for i in range(1000)]
+    state = {'visualization': "line", 'results': results, 'question': "q", 'sql_query': "SELECT"}
+    data = formatter.format_data_for_visualization(state)['formatted_data_for_visualization']
+    assert len(data["xValues"]) <= 50
+    assert data["xValues"][0] == "0" and data["xValues"][-1] == "999"
+    assert data["meta"] == {"originalPointCount": 1000, "pointCount": len(data["xValues"]), "downsampled": True,
+                            "method": "lttb"}
+
+
+@pytest.mark.parametrize("method", ["bin", "reservoir"])
+def test_grouped_scatter_stays_within_the_budget(formatter, method):
+    formatter.scatter_method = method
+    # Many small groups next to a large one used to get one point each on top of the large group's share
+    results = [("big", float(i), float(i * i % 97)) for i in range(1000)]
+    results += [(f"small {i}", float(i), 1.0) for i in range(30)]
+    state = {'visualization': "scatter", 'results': results, 'question': "q", 'sql_query': "SELECT"}
+    first = formatter.format_data_for_visualization(state)['formatted_data_for_visualization']
+
+    total = sum(len(series["data"]) for series in first["series"])
+    assert total <= 40
+    assert first["meta"] == {"originalPointCount": 1030, "pointCount": total, "downsampled": True, "method": method}
+    assert first == formatter.format_data_for_visualization(state)['formatted_data_for_visualization']
@@ -0,0 +1,91 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+import LLMCache
+from LLMCache import LLMResponseCache
+from LLMManager import LLMManager
+from State import ParsedQuestion
+from StubLLM import StubChatModel
+
+
+class Clock:
+    """Stands in for the time module of LLMCache, moved forward by the test."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(monkeypatch, tmp_path):
+    clock = Clock()
+    monkeypatch.setattr(LLMCache, "time", clock)
+    cache = LLMResponseCache(cache_dir=str(tmp_path), ttl=60)
+    cache.put("key", "answer")
+
+    clock.now += 59
+    assert cache.get("key") == "answer"
+    clock.now += 2
+    assert cache.get("key") is None
+    assert cache.stats['misses'] == 1
+    # The expired row is dropped from disk as well
+    assert cache.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = LLMResponseCache(max_memory_entries=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"
+    cache.put("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats['evictions'] == 1
+
+
+def test_disk_tier_evicts_down_to_its_size_limit(monkeypatch, tmp_path):
+    clock = Clock()
+    monkeypatch.setattr(LLMCache, "time", clock)
+    cache = LLMResponseCache(cache_dir=str(tmp_path), max_memory_entries=1, max_disk_entries=2)
+    for key in ["a", "b", "c"]:
+        clock.now += 1
+        cache.put(key, key)
+
+    keys = {row[0] for row in cache.conn.execute("SELECT key FROM responses")}
+    assert keys == {"b", "c"}
+
+
+def test_responses_survive_a_new_instance(tmp_path):
+    question = ParsedQuestion(BaseTable="artists", columns=["Name"], relevant_tables=[], noun_columns=["Name"],
+                              is_relevant=True)
+    first = LLMResponseCache(cache_dir=str(tmp_path))
+    first.put("text", "answer")
+    first.put("parsed", question)
+    first.conn.close()
+
+    second = LLMResponseCache(cache_dir=str(tmp_path))
+    assert second.get("text") == "answer"
+    assert second.get("parsed", ParsedQuestion) == question
+    assert second.stats['disk_hits'] == 2
+    # Served from memory once it has been read from disk
+    assert second.get("text") == "answer"
+    assert second.stats['memory_hits'] == 1
+
+
+def test_use_cache_false_bypasses_the_cache(tmp_path):
+    stub = StubChatModel(default="Stub reply")
+    manager = LLMManager(cache_dir=str(tmp_path), llm=stub)
+    prompt = ChatPromptTemplate.from_messages([("system", "Answer briefly."), ("human", "{question}")])
+
+    assert manager.invoke(prompt, question="How many artists?") == "Stub reply"
+    assert manager.invoke(prompt, question="How many artists?") == "Stub reply"
+    assert stub.calls == 1
+
+    assert manager.invoke(prompt, use_cache=False, question="How many artists?") == "Stub reply"
+    assert manager.invoke(prompt, use_cache=False, question="How many albums?") == "Stub reply"
+    assert stub.calls == 3
+    # Nothing was written for the uncached question
+    assert manager.invoke(prompt, question="How many albums?") == "Stub reply"
+    assert stub.calls == 4
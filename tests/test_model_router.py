@@ -0,0 +1,128 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+import ModelRouter as model_router
+from ModelRouter import ModelRoute, ModelRouter
+from StubLLM import StubChatModel
+from Telemetry import Telemetry
+
+MESSAGES = [HumanMessage(content="How many artists are there?")]
+
+
+class FlakyChatModel(StubChatModel):
+    """Fails its first failures calls."""
+
+    def __init__(self, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.failures = failures
+        self.attempts = 0
+
+    def respond(self, messages):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise ConnectionError("endpoint unavailable")
+        return super().respond(messages)
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    metrics = Telemetry()
+    monkeypatch.setattr(model_router, "telemetry", metrics)
+    return metrics
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(model_router, "time", SimpleNamespace(sleep=sleeps.append))
+    return sleeps
+
+
+def counter(metrics, name, **labels):
+    return metrics.counters.get((name, tuple(sorted((key, str(value)) for key, value in labels.items()))), 0)
+
+
+def test_routes_are_selected_by_task():
+    router = ModelRouter.from_config({"default": {"model": "large", "timeout": 20},
+                                      "routes": {"label": {"model": "small", "max_tokens": 16}}})
+    assert router.route("label").model == "small"
+    assert router.route("label").max_tokens == 16
+    assert router.route("label").timeout == 20
+    assert router.route("parse") is router.default
+    assert router.route(None) is router.default
+    with pytest.raises(ValueError):
+        ModelRouter.from_config({"routes": {"translate": {"model": "small"}}})
+
+
+def test_calls_go_to_the_model_of_their_task():
+    large, small = StubChatModel(default="large", model_name="large"), StubChatModel(default="small",
+                                                                                     model_name="small")
+    router = ModelRouter(ModelRoute(llm=large), {"label": ModelRoute(llm=small)})
+
+    _, response, route = router.call("label", MESSAGES)
+    assert (response, route.name) == ("small", "small")
+    _, response, route = router.call("generate_sql", MESSAGES)
+    assert (response, route.name) == ("large", "large")
+    assert (large.calls, small.calls) == (1, 1)
+
+
+def test_failed_calls_are_retried_with_backoff(metrics, sleeps):
+    flaky = FlakyChatModel(failures=2, default="answer", model_name="flaky")
+    router = ModelRouter(ModelRoute(llm=flaky, max_retries=2, retry_backoff=0.1))
+
+    assert router.call("parse", MESSAGES)[1] == "answer"
+    assert sleeps == [0.1, 0.2]
+    assert counter(metrics, "eda_llm_retries_total", model="flaky") == 2
+
+
+def test_error_after_the_last_retry_is_raised(metrics, sleeps):
+    router = ModelRouter(ModelRoute(llm=FlakyChatModel(failures=3), max_retries=2, retry_backoff=0.1))
+    with pytest.raises(ConnectionError):
+        router.call("parse", MESSAGES)
+    assert sleeps == [0.1, 0.2]
+
+
+def test_async_calls_are_retried(metrics):
+    flaky = FlakyChatModel(failures=1, default="answer", model_name="flaky")
+    router = ModelRouter(ModelRoute(llm=flaky, max_retries=1, retry_backoff=0.001))
+    assert asyncio.run(router.acall("parse", MESSAGES))[1] == "answer"
+    assert counter(metrics, "eda_llm_retries_total", model="flaky") == 1
+
+
+def test_failing_route_falls_back(metrics, sleeps):
+    fallback = ModelRoute(llm=StubChatModel(default="fallback", model_name="small"))
+    router = ModelRouter(ModelRoute(llm=FlakyChatModel(failures=10), max_retries=0, fallback=fallback))
+
+    _, response, route = router.call("generate_sql", MESSAGES)
+    assert (response, route) == ("fallback", fallback)
+    assert counter(metrics, "eda_llm_fallbacks_total", task="generate_sql", reason="error") == 1
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_slow_route_is_hedged_after_its_slo(metrics, asynchronous):
+    slow = StubChatModel(default="slow", model_name="large", latency=1.0)
+    fallback = ModelRoute(llm=StubChatModel(default="fast", model_name="small"))
+    router = ModelRouter(ModelRoute(llm=slow, latency_slo=0.05, fallback=fallback))
+
+    start = time.perf_counter()
+    if asynchronous:
+        _, response, route = asyncio.run(router.acall("generate_sql", MESSAGES))
+    else:
+        _, response, route = router.call("generate_sql", MESSAGES)
+    assert time.perf_counter() - start < 0.5
+    assert (response, route) == ("fast", fallback)
+    assert counter(metrics, "eda_llm_fallbacks_total", task="generate_sql", reason="slo") == 1
+
+
+def test_fast_route_is_not_hedged(metrics):
+    fast = StubChatModel(default="primary", model_name="large")
+    fallback_model = StubChatModel(default="fallback", model_name="small")
+    router = ModelRouter(ModelRoute(llm=fast, latency_slo=0.5, fallback=ModelRoute(llm=fallback_model)))
+
+    assert router.call("generate_sql", MESSAGES)[1] == "primary"
+    assert fallback_model.calls == 0
+    assert counter(metrics, "eda_llm_fallbacks_total", task="generate_sql", reason="slo") == 0
@@ -0,0 +1,23 @@
+from PlanCache import PlanCache
+
+
+def test_databases_sharing_a_cache_directory_do_not_share_plans(tmp_path):
+    a = PlanCache(cache_dir=str(tmp_path), database="sqlite:///a.db")
+    b = PlanCache(cache_dir=str(tmp_path), database="sqlite:///b.db")
+    a.put("How many artists?", "1", "SELECT COUNT(*) FROM artists", "none", "", ["count"])
+
+    # Both report the same fingerprint, b must neither see nor drop the plan of a
+    assert b.get("How many artists?", "1") is None
+    b.get("How many orders?", "2")
+    assert a.get("How many artists?", "1")['sql_query'] == "SELECT COUNT(*) FROM artists"
+    a.close()
+    b.close()
+
+
+def test_plans_survive_a_restart(tmp_path):
+    cache = PlanCache(cache_dir=str(tmp_path), database="sqlite:///a.db")
+    cache.put("How many artists?", "1", "SELECT COUNT(*) FROM artists", "none", "", ["count"])
+    cache.close()
+    reopened = PlanCache(cache_dir=str(tmp_path), database="sqlite:///a.db")
+    assert reopened.get("How many artists?", "1") is not None
+    reopened.close()
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from DatabaseManager import DatabaseManager
+from QueryGuard import QueryGuard, QueryRejected, has_top_level_limit
+
+
+@pytest.fixture
+def engine(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE INDEX albums_artist ON albums (ArtistId)")
+    conn.close()
+    engine = create_engine(f"sqlite:///{db_path}")
+    yield engine
+    engine.dispose()
+
+
+def cost(engine, query):
+    with engine.connect() as connection:
+        return QueryGuard(engine).estimate_cost(connection, query)
+
+
+def test_aliased_tables_are_costed_at_their_size(engine):
+    # artists has 50 rows, the fallback for unknown tables is 1000
+    assert cost(engine, "SELECT Name FROM artists a") == 50
+    assert cost(engine, "SELECT Name FROM artists AS a") == 50
+
+
+def test_covering_index_scan_visits_every_row(engine):
+    # albums has 100 rows, scanned through albums_artist without touching the table
+    assert cost(engine, "SELECT COUNT(ArtistId) FROM albums") == 100
+
+
+def test_index_search_is_logarithmic(engine):
+    assert cost(engine, "SELECT Name FROM artists WHERE ArtistId = 3") < 10
+    assert cost(engine, "SELECT 1") == 1
+
+
+def test_join_multiplies_the_loops(engine):
+    scan = cost(engine, "SELECT * FROM albums")
+    joined = cost(engine, "SELECT * FROM albums b JOIN artists a ON a.ArtistId = b.ArtistId")
+    assert scan < joined < scan * 10
+
+
+def test_limit_is_not_swallowed_by_a_trailing_comment(engine):
+    guard = QueryGuard(engine, max_cost=10, row_limit=5)
+    with engine.connect() as connection:
+        checked = guard.check(connection, "SELECT * FROM albums -- every album;")
+        rows = connection.execute(text(checked['query'])).fetchall()
+    assert checked['action'] == "limit"
+    assert len(rows) == 5
+
+
+def test_expensive_query_with_a_limit_is_rejected(engine):
+    guard = QueryGuard(engine, max_cost=10)
+    with engine.connect() as connection, pytest.raises(QueryRejected):
+        guard.check(connection, "SELECT * FROM albums b JOIN artists a ON a.ArtistId = b.ArtistId LIMIT 500")
+
+
+def test_limited_result_is_marked_truncated(db_url):
+    manager = DatabaseManager(db_url, cache_dir=None, max_query_cost=10, guard_row_limit=5)
+    results = manager.execute_query("SELECT * FROM albums")
+    manager.close()
+    assert len(results) == 5
+    assert results.truncated
+    assert results.guard_action == "limit" and results.cost > 10
+
+
+def test_only_row_limiting_clauses_count_as_a_limit():
+    assert has_top_level_limit("SELECT Name FROM artists LIMIT 5")
+    assert has_top_level_limit("SELECT Name FROM artists FETCH FIRST 5 ROWS ONLY")
+    assert has_top_level_limit("SELECT TOP 5 Name FROM artists")
+    assert has_top_level_limit("SELECT DISTINCT TOP 5 Name FROM artists")
+    assert not has_top_level_limit("SELECT Name AS top, top.x FROM artists top")
+    assert not has_top_level_limit("SELECT Name FROM artists WHERE ArtistId IN (SELECT ArtistId FROM albums LIMIT 3)")
+
+
+def test_query_with_a_top_column_is_limited_not_rejected(engine):
+    guard = QueryGuard(engine, max_cost=10, row_limit=5)
+    with engine.connect() as connection:
+        checked = guard.check(connection, "SELECT Title AS top FROM albums")
+    assert checked['action'] == "limit"
@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from DatabaseManager import DatabaseManager
+from ResultCache import DataVersions, ResultCache, normalize_sql
+from ResultSet import ColumnBatch, ResultSet
+
+
+@pytest.fixture
+def manager(db_url):
+    manager = DatabaseManager(db_url, cache_dir=None, data_version_interval=0)
+    yield manager
+    manager.close()
+
+
+def result(value):
+    return ResultSet(["value"], [ColumnBatch.from_rows(["value"], [(value,)])])
+
+
+class Versions(DataVersions):
+    """Tokens set by the test instead of read from a database."""
+
+    def __init__(self):
+        super().__init__(engine=None, hook=lambda tables: {table: self.token for table in tables}, check_interval=0)
+        self.token = "1"
+
+
+def test_normalized_queries_share_an_entry():
+    assert normalize_sql("SELECT  Name FROM artists;")[0] == normalize_sql("select name\nfrom ARTISTS -- all")[0]
+    assert normalize_sql("SELECT EXTRACT(YEAR FROM InvoiceDate) FROM invoices")[1] == ["invoices"]
+    assert normalize_sql("SELECT random() FROM artists") is None
+
+
+def test_a_write_to_the_table_invalidates_the_result(manager, db_path):
+    query = "SELECT COUNT(*) AS n FROM artists"
+    assert manager.execute_query(query)[0]['n'] == 50
+    assert manager.execute_query(query)[0]['n'] == 50
+    assert manager.result_cache.stats['hits'] == 1
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO artists (Name) VALUES ('New Artist')")
+    conn.commit()
+    conn.close()
+    assert manager.execute_query(query)[0]['n'] == 51
+    assert manager.result_cache.stats['misses'] == 2
+
+
+def test_concurrent_misses_run_the_query_once():
+    cache = ResultCache(Versions())
+    runs = []
+    release = threading.Event()
+
+    def run():
+        runs.append(1)
+        release.wait(2)
+        return result(len(runs))
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.fetch("SELECT * FROM t", run))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    while len(cache.inflight) == 0:
+        time.sleep(0.005)
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(runs) == 1
+    assert all(value is results[0] for value in results)
+
+
+def test_stale_result_is_served_while_it_is_refreshed():
+    versions = Versions()
+    cache = ResultCache(versions, stale_while_revalidate=60)
+    cache.fetch("SELECT * FROM t", lambda: result("old"))
+    versions.token = "2"
+    refreshed = threading.Event()
+
+    def run():
+        refreshed.set()
+        return result("new")
+
+    assert cache.fetch("SELECT * FROM t", run)[0]['value'] == "old"
+    assert refreshed.wait(2)
+    while cache.inflight:
+        time.sleep(0.005)
+    assert cache.fetch("SELECT * FROM t", run)[0]['value'] == "new"
+    assert cache.stats['stale_hits'] == 1
+    cache.close()
+
+
+def test_errors_are_not_cached():
+    cache = ResultCache(Versions())
+    cache.fetch("SELECT * FROM t", lambda: {'error': "boom", 'error_type': "database"})
+    assert cache.fetch("SELECT * FROM t", lambda: result(1))[0]['value'] == 1
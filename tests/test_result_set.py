@@ -0,0 +1,54 @@
+import pickle
+
+from ResultSet import ColumnBatch, ResultSet, to_columns
+
+
+def collect(db_manager, query, **limits):
+    return list(db_manager.stream_query(query, **limits))
+
+
+def test_batches_have_the_requested_size(db_manager):
+    batches = collect(db_manager, "SELECT AlbumId FROM albums ORDER BY AlbumId", batch_size=30, max_rows=None,
+                      max_bytes=None)
+    assert [batch.num_rows for batch in batches] == [30, 30, 30, 10]
+    assert not any(batch.truncated for batch in batches)
+    results = ResultSet(batches=batches)
+    assert results.column("AlbumId") == list(range(1, 101))
+    assert results[30] == {'AlbumId': 31} and results[-1] == {'AlbumId': 100}
+
+
+def test_row_limit_truncates(db_manager):
+    batches = collect(db_manager, "SELECT AlbumId FROM albums", batch_size=30, max_rows=45, max_bytes=None)
+    assert [batch.num_rows for batch in batches] == [30, 15]
+    assert batches[-1].truncated
+    results = db_manager.execute_query("SELECT * FROM albums", use_cache=False)
+    assert not results.truncated
+
+
+def test_byte_limit_truncates(db_manager):
+    # Every Title is "Album n", 7 to 9 characters
+    batches = collect(db_manager, "SELECT Title FROM albums", batch_size=10, max_rows=None, max_bytes=100)
+    results = ResultSet(batches=batches)
+    assert results.truncated
+    assert len(results) < 100
+    assert len(batches) == 2  # streaming stops with the batch that crosses the budget
+
+
+def test_records_and_columns_round_trip():
+    rows = [(1, "a", None), (2, "b", 2.5), (3, "c", 3.5)]
+    results = ResultSet(batches=[ColumnBatch.from_rows(["id", "name", "value"], rows[:2]),
+                                 ColumnBatch.from_rows(["id", "name", "value"], rows[2:])])
+    records = [dict(zip(["id", "name", "value"], row)) for row in rows]
+    assert results.to_records() == records
+    assert list(results) == records and results == records
+    assert results[1:] == records[1:]
+    assert results.head(2) == records[:2]
+    assert list(results.iter_rows()) == rows
+    assert to_columns(results) == (["id", "name", "value"], [[1, 2, 3], ["a", "b", "c"], [None, 2.5, 3.5]])
+    assert to_columns(records) == to_columns(results)
+    assert pickle.loads(pickle.dumps(results)) == results
+
+
+def test_empty_result_keeps_its_columns(db_manager):
+    results = db_manager.execute_query("SELECT Name FROM artists WHERE 0", use_cache=False)
+    assert results.columns == ["Name"] and len(results) == 0 and results.to_records() == []
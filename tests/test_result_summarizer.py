@@ -0,0 +1,66 @@
+from ResultSet import ColumnBatch, ResultSet
+from ResultSummarizer import ResultSummarizer, profile_column
+from token_counter import count_tokens
+
+
+def rows(n):
+    return [{"InvoiceId": i, "InvoiceDate": f"2021-{i % 12 + 1:02d}-01", "BillingCountry": ["USA", "France"][i % 2],
+             "Total": i * 1.5, "Notes": None} for i in range(1, n + 1)]
+
+
+def test_small_results_pass_through_verbatim():
+    results = rows(3)
+    prompt, report = ResultSummarizer(token_budget=1500).summarize(results)
+    assert prompt == results
+    assert report['summarized'] is False and report['summary_tokens'] == report['raw_tokens']
+
+
+def test_small_result_set_is_passed_as_records():
+    columns = ["Name", "Total"]
+    results = ResultSet(columns, [ColumnBatch.from_rows(columns, [("USA", 1.5), ("France", 2)])])
+    prompt, report = ResultSummarizer().summarize(results)
+    assert prompt == [{"Name": "USA", "Total": 1.5}, {"Name": "France", "Total": 2}]
+    assert not report['summarized']
+
+
+def test_large_results_are_summarized_within_the_budget():
+    results = rows(2000)
+    summarizer = ResultSummarizer(token_budget=300)
+    digest, report = summarizer.summarize(results)
+
+    assert report['summarized']
+    assert report['raw_tokens'] > 300
+    assert report['summary_tokens'] == count_tokens(digest) <= 300
+    assert digest.startswith("Result digest: 2000 rows")
+    assert "- Total (numeric): min 1.5, max 3000.0, mean 1500.75" in digest
+    assert "- InvoiceDate (temporal): from 2021-01-01 to 2021-12-01" in digest
+    assert "- BillingCountry (text): 2 distinct; most frequent: France (1000), USA (1000)" in digest
+    assert "- Notes (empty): all null, 2000 nulls" in digest
+
+
+def test_sample_rows_are_dropped_before_the_column_summary():
+    results = rows(2000)
+    generous, _ = ResultSummarizer(token_budget=5000, sample_rows=3).summarize(results * 3)
+    assert "First rows:" in generous and "Last rows:" in generous
+
+    assert generous.count("'InvoiceId'") == 6
+
+    tight, report = ResultSummarizer(token_budget=150, sample_rows=3).summarize(results)
+    assert report['summary_tokens'] <= 150
+    assert tight.count("'InvoiceId'") < 6
+    assert "- Notes (empty): all null, 2000 nulls" in tight
+
+
+def test_profiles_of_numeric_and_null_columns():
+    assert profile_column([1, None, 3]) == {'nulls': 1, 'type': 'numeric', 'min': 1.0, 'max': 3.0, 'mean': 2.0}
+    assert profile_column([None, None]) == {'nulls': 2, 'type': 'empty'}
+    assert profile_column(["b", "a", "b"], top_k=1) == {'nulls': 0, 'type': 'text', 'distinct': 2,
+                                                        'top': [("b", 2)]}
+
+
+def test_truncated_results_say_so():
+    columns = ["Total"]
+    results = ResultSet(columns, [ColumnBatch.from_rows(columns, [(float(i),) for i in range(3000)])])
+    results.truncated = True
+    digest, _ = ResultSummarizer(token_budget=200).summarize(results)
+    assert digest.startswith("Result digest: 3000 rows (truncated by the row limit)")
@@ -0,0 +1,52 @@
+import sqlite3
+
+from conftest import make_database
+from DatabaseManager import DatabaseManager
+from RuntimeSnapshot import load_snapshot, save_snapshot
+
+
+def manager(path, cache_dir):
+    return DatabaseManager(f"sqlite:///{path}", cache_dir=str(cache_dir))
+
+
+def build(path, tmp_path):
+    builder = manager(path, tmp_path / "build")
+    save_snapshot(builder, str(tmp_path / "snapshot"))
+    builder.close()
+
+
+def test_snapshot_is_trusted_on_its_own_database(tmp_path):
+    path = make_database(str(tmp_path / "a.db"))
+    build(path, tmp_path)
+    worker = manager(path, tmp_path / "worker")
+    assert load_snapshot(worker, str(tmp_path / "snapshot"))['trusted'] is True
+    assert "artists" in worker.get_schema()['schema']
+    worker.close()
+
+
+def test_snapshot_of_another_database_is_not_loaded(tmp_path):
+    a = make_database(str(tmp_path / "a.db"))
+    b = str(tmp_path / "b.db")
+    conn = sqlite3.connect(b)
+    conn.execute("CREATE TABLE orders (OrderId INTEGER PRIMARY KEY, Amount REAL)")
+    conn.close()
+    build(a, tmp_path)
+
+    worker = manager(b, tmp_path / "worker")
+    assert load_snapshot(worker, str(tmp_path / "snapshot"))['trusted'] is False
+    assert list(worker.get_schema()['schema']) == ["orders"]
+    worker.close()
+
+
+def test_fingerprint_tells_schemas_apart(tmp_path):
+    # Both databases have had a single schema change, PRAGMA schema_version would report the same value
+    fingerprints = []
+    for name, table in (("a.db", "artists"), ("b.db", "orders")):
+        conn = sqlite3.connect(str(tmp_path / name))
+        conn.execute(f"CREATE TABLE {table} (Id INTEGER PRIMARY KEY)")
+        conn.close()
+        db_manager = manager(tmp_path / name, tmp_path / name.replace(".db", ""))
+        fingerprints.append(db_manager.schema_cache.fingerprint())
+        db_manager.close()
+    assert None not in fingerprints
+    assert fingerprints[0] != fingerprints[1]
@@ -0,0 +1,81 @@
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+
+from SchemaCache import SchemaCache
+
+
+class Loader:
+    """Introspects the table names and counts the introspections."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        conn = sqlite3.connect(self.db_path)
+        tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        conn.close()
+        return {name: {'columns': []} for name in tables}, None
+
+
+@pytest.fixture
+def engine(db_path):
+    engine = create_engine(f"sqlite:///{db_path}")
+    yield engine
+    engine.dispose()
+
+
+def test_unchanged_schema_is_served_without_introspection(engine, db_path):
+    loader = Loader(db_path)
+    cache = SchemaCache(engine, loader, check_interval=0)
+    cache.get()
+    cache.get()
+    assert loader.calls == 1
+
+
+def test_altered_schema_is_introspected_again(engine, db_path):
+    loader = Loader(db_path)
+    cache = SchemaCache(engine, loader, check_interval=0)
+    assert "tracks" not in cache.get_schema()
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE tracks (TrackId INTEGER PRIMARY KEY)")
+    conn.execute("ALTER TABLE artists ADD COLUMN Country TEXT")
+    conn.close()
+    assert "tracks" in cache.get_schema()
+    assert loader.calls == 2
+
+
+def test_snapshot_is_reloaded_from_disk(engine, db_path, tmp_path):
+    SchemaCache(engine, Loader(db_path), cache_dir=str(tmp_path)).get()
+    loader = Loader(db_path)
+    restarted = SchemaCache(engine, loader, cache_dir=str(tmp_path))
+    assert "artists" in restarted.get_schema()
+    assert loader.calls == 0
+
+
+def test_invalidate_forces_introspection(engine, db_path, tmp_path):
+    loader = Loader(db_path)
+    cache = SchemaCache(engine, loader, cache_dir=str(tmp_path))
+    cache.get()
+    cache.invalidate()
+    assert not os.path.exists(cache.snapshot_path)
+    cache.get()
+    assert loader.calls == 2
+
+
+def test_missing_fingerprint_keeps_the_snapshot(engine, db_path):
+    class NoFingerprint(SchemaCache):
+        def fingerprint(self):
+            return None
+
+    loader = Loader(db_path)
+    cache = NoFingerprint(engine, loader, check_interval=0)
+    for _ in range(3):
+        cache.get()
+    assert loader.calls == 1
+    cache.refresh()
+    assert loader.calls == 2
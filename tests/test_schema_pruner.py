@@ -0,0 +1,73 @@
+import sqlite3
+
+import pytest
+
+from DatabaseManager import DatabaseManager
+from SchemaPruner import SchemaPruner, tokenize
+
+QUESTION = "Which customers bought the most songs?"
+
+
+@pytest.fixture
+def schema_and_graph(tmp_path):
+    path = str(tmp_path / "shop.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE customers (CustomerId INTEGER PRIMARY KEY, Name TEXT, Country TEXT, Notes TEXT);
+        CREATE TABLE invoices (InvoiceId INTEGER PRIMARY KEY, CustomerId INTEGER REFERENCES customers (CustomerId),
+                               Total REAL, BillingCity TEXT);
+        CREATE TABLE invoice_items (InvoiceLineId INTEGER PRIMARY KEY, InvoiceId INTEGER REFERENCES invoices (InvoiceId),
+                                    TrackId INTEGER REFERENCES songs (TrackId), Quantity INTEGER);
+        CREATE TABLE songs (TrackId INTEGER PRIMARY KEY, Name TEXT, Composer TEXT, Milliseconds INTEGER);
+        CREATE TABLE genres (GenreId INTEGER PRIMARY KEY, Name TEXT);
+    """)
+    conn.close()
+    manager = DatabaseManager(f"sqlite:///{path}", cache_dir=None)
+    yield manager.get_schema()['schema'], manager.get_schema_graph()['graph']
+    manager.close()
+
+
+def test_tokenize_splits_identifiers_and_plurals():
+    assert tokenize("BillingCountry") == {"billing", "country"}
+    assert tokenize("invoice_items categories") == {"invoice", "item", "category"}
+
+
+def test_join_table_is_kept_through_foreign_keys(schema_and_graph):
+    schema, graph = schema_and_graph
+    pruner = SchemaPruner(hops=1)
+    assert pruner.score_tables(QUESTION, schema)["invoice_items"] == 0
+
+    pruned, report = pruner.prune(QUESTION, schema, graph)
+    assert set(pruned) == {"customers", "songs", "invoice_items", "invoices"}
+    assert report['kept'][:2] == ["customers", "songs"]  # direct matches rank first
+    assert (report['tables_total'], report['tables_dropped'], report['columns_dropped']) == (5, 1, {})
+
+    # Without the hop the join table has nothing in common with the question
+    assert "invoice_items" not in SchemaPruner(hops=0).prune(QUESTION, schema, graph)[0]
+
+
+def test_budget_drops_the_lowest_scored_columns_first(schema_and_graph):
+    schema, graph = schema_and_graph
+    full = SchemaPruner(hops=1).prune(QUESTION, schema, graph)[1]['estimated_tokens']
+
+    pruned, report = SchemaPruner(hops=1, token_budget=full - 1).prune(QUESTION, schema, graph)
+    # The lowest ranked table (the join table, reached through a key) loses its only column that is not a key
+    assert report['kept'][-1] == "invoice_items"
+    assert report['columns_dropped'] == {"invoice_items": ["Quantity"]}
+    assert [col.name for col in pruned["invoice_items"]['columns']] == ["InvoiceLineId", "InvoiceId", "TrackId"]
+    assert len(schema["invoice_items"]['columns']) == 4  # the cached schema is not modified
+    assert report['estimated_tokens'] <= full - 1
+
+
+def test_columns_are_scored_by_the_question_and_the_value_matches(schema_and_graph):
+    schema, _ = schema_and_graph
+    scores = SchemaPruner().column_scores("How many customers per country?", "customers", schema["customers"],
+                                          value_matches=[("customers", "Name")])
+    assert scores == {"CustomerId": None, "Name": 2.0, "Country": 1.0, "Notes": 0}
+
+
+def test_small_budget_drops_whole_tables_but_keeps_one(schema_and_graph):
+    schema, graph = schema_and_graph
+    pruned, report = SchemaPruner(hops=1, token_budget=1).prune(QUESTION, schema, graph)
+    assert list(pruned) == ["customers"]
+    assert report['tables_kept'] == 1
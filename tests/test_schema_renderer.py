@@ -0,0 +1,72 @@
+import socket
+
+import pytest
+
+import token_counter
+from SchemaPruner import SchemaPruner
+from SchemaRenderer import SchemaRenderer
+from token_counter import cached_encoding_path, count_tokens, get_encoding
+
+
+@pytest.fixture
+def schema(db_manager):
+    return db_manager.get_schema()['schema']
+
+
+def test_ddl_rendering(schema):
+    assert SchemaRenderer().render_table("albums", schema["albums"]) == "\n".join([
+        "CREATE TABLE albums (",
+        "  AlbumId INTEGER PRIMARY KEY,",
+        "  Title TEXT,",
+        "  ArtistId INTEGER REFERENCES artists(ArtistId)",
+        ");",
+    ])
+
+
+def test_compact_rendering(schema):
+    renderer = SchemaRenderer(style="compact")
+    assert renderer.render_table("albums", schema["albums"]) == \
+        "albums(AlbumId INTEGER PK, Title TEXT, ArtistId INTEGER -> artists.ArtistId)"
+    assert renderer.render(schema).count("\n") == len(schema) - 1
+
+
+def test_unknown_style_is_rejected():
+    with pytest.raises(ValueError):
+        SchemaRenderer(style="yaml")
+
+
+def test_table_tokens_price_every_column(schema):
+    renderer = SchemaRenderer()
+    tokens = renderer.table_tokens("albums", schema["albums"])
+    assert set(tokens['columns']) == {"AlbumId", "Title", "ArtistId"}
+    assert tokens['fixed'] + sum(tokens['columns'].values()) == \
+        sum(count_tokens(part) for part in renderer.table_parts("albums", schema["albums"])[0])
+
+
+def test_budget_cut_keeps_the_rendered_schema_within_the_budget(db_manager, schema):
+    graph = db_manager.get_schema_graph()['graph']
+    renderer = SchemaRenderer()
+    question = "Which albums has each artist released?"
+    full = sum(count_tokens(renderer.render_table(name, data)) for name, data in schema.items())
+
+    pruned, report = SchemaPruner(hops=0, token_budget=full // 2, renderer=renderer).prune(question, schema, graph)
+    assert report['estimated_tokens'] <= report['token_budget'] == full // 2
+    assert "albums" in pruned
+    assert "invoices" not in pruned
+
+
+def test_missing_encoding_falls_back_to_the_estimate_without_downloading(tmp_path, monkeypatch):
+    monkeypatch.setenv("TIKTOKEN_CACHE_DIR", str(tmp_path))
+    monkeypatch.delenv("EDA_TOKEN_ENCODING", raising=False)
+    monkeypatch.setattr(token_counter, "_encoding", None)
+    monkeypatch.setattr(token_counter, "_encoding_loaded", False)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("the tokenizer tried to download its encoding")
+
+    monkeypatch.setattr(socket, "create_connection", no_network)
+    monkeypatch.setattr(socket.socket, "connect", no_network)
+
+    assert cached_encoding_path("o200k_base").startswith(str(tmp_path))
+    assert get_encoding() is None
+    assert count_tokens("12345678") == 2
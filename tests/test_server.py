@@ -0,0 +1,167 @@
+import asyncio
+import time
+
+import httpx
+
+from server import AdmissionController, QueueFull, QueueTimeout, create_app
+from offload import to_thread
+
+
+class BlockingManager:
+    """A WorkflowManager stand-in whose questions run until release is set."""
+
+    tenant_registry = None
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.batch_parallelism = None
+
+    async def arun_sql_agent(self, question, uuid, tenant=None):
+        await self.release.wait()
+        return {"answer": question}
+
+    async def arun_batch(self, questions, parallelism, uuid_prefix="batch", tenant=None):
+        self.batch_parallelism = parallelism
+        await self.release.wait()
+        return [{"question": question} for question in questions]
+
+
+def client(app):
+    # ASGITransport does not run the lifespan, so the manager is never warmed up
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+async def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        await asyncio.sleep(0.005)
+
+
+def test_full_queue_answers_429():
+    async def scenario():
+        manager = BlockingManager()
+        app = create_app(manager, max_in_flight=1, max_queue=0, queue_timeout=5)
+        async with client(app) as http:
+            first = asyncio.create_task(http.post("/ask", json={"question": "a"}))
+            await wait_until(lambda: app.state.admission.in_flight == 1)
+            second = await http.post("/ask", json={"question": "b"})
+            manager.release.set()
+            return (await first).status_code, second
+
+    first, second = asyncio.run(scenario())
+    assert first == 200
+    assert second.status_code == 429
+    assert second.headers["Retry-After"] == "1"
+
+
+def test_queue_timeout_answers_503_and_zero_is_honoured():
+    async def scenario():
+        manager = BlockingManager()
+        app = create_app(manager, max_in_flight=1, max_queue=4, queue_timeout=0)
+        async with client(app) as http:
+            first = asyncio.create_task(http.post("/ask", json={"question": "a"}))
+            await wait_until(lambda: app.state.admission.in_flight == 1)
+            start = time.perf_counter()
+            second = await http.post("/ask", json={"question": "b"})
+            waited = time.perf_counter() - start
+            manager.release.set()
+            await first
+            return second, waited
+
+    second, waited = asyncio.run(scenario())
+    assert second.status_code == 503
+    assert waited < 1.0  # not the 5 s default
+
+
+def test_unknown_tenant_answers_404(db_url):
+    from LLMManager import LLMManager
+    from StubLLM import StubChatModel
+    from workflow_manager import WorkflowManager
+
+    manager = WorkflowManager(db_url=db_url, llm_manager=LLMManager(cache_dir=None, llm=StubChatModel()),
+                              tenants={})
+
+    async def scenario():
+        async with client(create_app(manager)) as http:
+            return await http.post("/ask", json={"question": "How many artists?", "tenant": "nope"})
+
+    response = asyncio.run(scenario())
+    assert response.status_code == 404
+    assert "nope" in response.json()["error"]
+
+
+def test_batch_takes_one_slot_per_pipeline():
+    async def scenario():
+        manager = BlockingManager()
+        app = create_app(manager, max_in_flight=3, max_queue=0)
+        async with client(app) as http:
+            batch = asyncio.create_task(http.post("/batch", json={"questions": list("abcdef"), "parallelism": 1000}))
+            await wait_until(lambda: app.state.admission.in_flight == 3)
+            rejected = await http.post("/ask", json={"question": "g"})
+            manager.release.set()
+            return (await batch).status_code, rejected.status_code, manager.batch_parallelism
+
+    batch, rejected, parallelism = asyncio.run(scenario())
+    assert (batch, rejected, parallelism) == (200, 429, 3)
+
+
+def test_timed_out_request_keeps_its_slot_until_the_thread_ends():
+    class SlowThreadManager(BlockingManager):
+        async def arun_sql_agent(self, question, uuid, tenant=None):
+            return await to_thread(time.sleep, 0.3)
+
+    async def scenario():
+        app = create_app(SlowThreadManager(), max_in_flight=1, max_queue=0, request_timeout=0.05)
+        async with client(app) as http:
+            start = time.perf_counter()
+            response = await http.post("/ask", json={"question": "a"})
+            return response.status_code, time.perf_counter() - start, app.state.admission.in_flight
+
+    status, elapsed, in_flight = asyncio.run(scenario())
+    assert status == 504
+    assert elapsed >= 0.3
+    assert in_flight == 0
+
+
+def test_admission_grants_slots_in_arrival_order():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=2, max_queue=4, queue_timeout=1)
+        order = []
+
+        async def request(name, slots, hold):
+            async with admission.slot(slots):
+                order.append(name)
+                await asyncio.sleep(hold)
+
+        first = asyncio.create_task(request("first", 1, 0.05))
+        await asyncio.sleep(0)
+        batch = asyncio.create_task(request("batch", 2, 0))
+        await asyncio.sleep(0)
+        single = asyncio.create_task(request("single", 1, 0))  # fits now, but must not overtake the batch
+        await asyncio.gather(first, batch, single)
+        return order, admission.in_flight
+
+    order, in_flight = asyncio.run(scenario())
+    assert order == ["first", "batch", "single"]
+    assert in_flight == 0
+
+
+def test_admission_errors():
+    async def scenario():
+        admission = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.01)
+        async with admission.slot():
+            try:
+                async with admission.slot():
+                    pass
+            except QueueTimeout:
+                timed_out = True
+            admission.max_queue = 0
+            try:
+                async with admission.slot():
+                    pass
+            except QueueFull:
+                full = True
+        return timed_out, full, admission.in_flight, admission.waiting
+
+    assert asyncio.run(scenario()) == (True, True, 0, 0)
@@ -0,0 +1,50 @@
+import pytest
+
+from SQLRepair import SQLRepair, classify_error
+
+
+@pytest.fixture
+def schema(db_manager):
+    return db_manager.get_schema()['schema']
+
+
+def repair(query, error, schema, dialect="sqlite"):
+    result = SQLRepair(dialect).repair(query, error, schema)
+    return result['query'] if result else None
+
+
+def test_misspelled_names_are_repaired(schema):
+    assert repair("SELECT Nme FROM artists", "no such column: Nme", schema) == "SELECT Name FROM artists"
+    assert repair("SELECT a.Name FROM artsts a", "no such table: artsts", schema) == "SELECT a.Name FROM artists a"
+    assert repair("SELECT artsts.Name FROM artsts", "no such table: artsts", schema) == \
+        "SELECT artists.Name FROM artists"
+
+
+def test_different_meanings_are_left_to_the_llm(schema):
+    assert repair("SELECT InvoiceYear FROM invoices", "no such column: InvoiceYear", schema) is None
+    assert repair("SELECT SUM(TotalSales) FROM invoices", "no such column: TotalSales", schema) is None
+
+
+def test_names_are_only_replaced_by_names_of_the_same_kind(schema):
+    # A column reported as a table is not turned into a table name
+    query = "SELECT strftime('%Y', InvoiceDate) FROM invoices"
+    assert repair(query, "no such table: InvoiceDate", schema) is None
+    # A table is not renamed where the same word is used as a column
+    query = "SELECT albms FROM albms"
+    assert repair(query, "no such table: albms", schema) == "SELECT albms FROM albums"
+
+
+def test_ambiguous_column_is_qualified(schema):
+    query = "SELECT ArtistId FROM artists a JOIN albums b ON a.ArtistId = b.ArtistId"
+    assert repair(query, "ambiguous column name: ArtistId", schema) == \
+        "SELECT a.ArtistId FROM artists a JOIN albums b ON a.ArtistId = b.ArtistId"
+
+
+def test_function_of_another_dialect_is_rewritten(schema):
+    assert repair("SELECT YEAR(InvoiceDate) FROM invoices", "no such function: YEAR", schema) == \
+        "SELECT CAST(strftime('%Y', InvoiceDate) AS INTEGER) FROM invoices"
+
+
+def test_classify_error():
+    assert classify_error('column "totl" does not exist') == {'kind': "no_such_column", 'name': "totl"}
+    assert classify_error("Table 'shop.ordrs' doesn't exist") == {'kind': "no_such_table", 'name': "ordrs"}
@@ -0,0 +1,60 @@
+import pytest
+
+from SQLValidator import defined_names, referenced_tables, tokenize_sql
+
+
+def tables(query):
+    return referenced_tables(tokenize_sql(query))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT a.Name FROM artists a JOIN albums AS b ON a.ArtistId = b.ArtistId", ["artists", "albums"]),
+    ("SELECT * FROM main.artists, albums", ["artists", "albums"]),
+    ("WITH top AS (SELECT ArtistId FROM albums) SELECT * FROM top JOIN artists USING (ArtistId)",
+     ["albums", "top", "artists"]),
+    ("SELECT * FROM artists WHERE ArtistId IN (SELECT ArtistId FROM albums)", ["artists", "albums"]),
+    ("SELECT * FROM (SELECT * FROM invoices) AS i", ["invoices"]),
+    ("SELECT EXTRACT(YEAR FROM InvoiceDate) AS y, SUM(Total) FROM invoices GROUP BY y", ["invoices"]),
+    ("SELECT TRIM(BOTH ' ' FROM Name), SUBSTRING(Name FROM 2 FOR 3) FROM artists", ["artists"]),
+    ("SELECT COALESCE((SELECT MAX(Total) FROM invoices), 0) FROM artists", ["invoices", "artists"]),
+    ("SELECT EXTRACT(YEAR FROM (SELECT MAX(InvoiceDate) FROM invoices))", ["invoices"]),
+])
+def test_referenced_tables(query, expected):
+    assert tables(query) == expected
+
+
+def test_function_arguments_are_not_unknown_tables(db_manager):
+    for query in ("SELECT EXTRACT(YEAR FROM InvoiceDate) FROM invoices",
+                  "SELECT TRIM(BOTH ' ' FROM Name) FROM artists"):
+        result = db_manager.check_query(query)
+        # SQLite has no such syntax, but it is EXPLAIN that has to say so
+        assert result['strategy'] == "explain"
+        assert "no such table" not in result['message']
+
+
+def test_static_rejections(db_manager):
+    assert db_manager.check_query("SELECT * FROM nope")['message'] == "no such table: nope"
+    assert db_manager.check_query("DELETE FROM artists")['strategy'] == "static"
+    assert db_manager.check_query("SELECT 1; SELECT 2")['message'] == "Only a single statement is allowed"
+    assert db_manager.check_query("SELECT (1")['strategy'] == "static"
+
+
+def test_valid_query_is_explained(db_manager):
+    result = db_manager.check_query("SELECT Name FROM artists a JOIN albums b ON a.ArtistId = b.ArtistId")
+    assert (result['valid'], result['strategy']) == (True, "explain")
+
+
+def test_cte_column_lists_are_defined():
+    assert defined_names(tokenize_sql("WITH RECURSIVE t(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM t WHERE n < 5) "
+                                      "SELECT n FROM t")) >= {"t", "n"}
+    assert {"top", "artist", "albums_count"} <= defined_names(tokenize_sql(
+        "WITH top (artist, albums_count) AS (SELECT ArtistId, COUNT(*) FROM albums GROUP BY ArtistId) "
+        "SELECT * FROM top"))
+    # A function call followed by an alias is not a CTE
+    assert defined_names(tokenize_sql("SELECT COUNT(Name) AS n FROM artists")) == {"n"}
+
+
+def test_recursive_cte_with_a_column_list_is_valid(db_manager):
+    result = db_manager.check_query("WITH RECURSIVE t(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM t WHERE n < 5) "
+                                    "SELECT `n` FROM t")
+    assert (result['valid'], result['strategy']) == (True, "explain")
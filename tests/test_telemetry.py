@@ -0,0 +1,36 @@
+import json
+import logging
+
+from Telemetry import Telemetry
+
+
+def test_prometheus_values_keep_every_digit():
+    telemetry = Telemetry(buckets=(0.005, 2.5))
+    telemetry.count("eda_llm_prompt_tokens_total", 1234567, model="m")
+    telemetry.observe("eda_db_query_duration_seconds", 1234.5678, status="ok")
+    text = telemetry.render_prometheus(gauges=[("eda_tenant_memory_bytes", {}, 3456789012, "Memory."),
+                                               ("eda_ratio", {}, 0.1 + 0.2, "Ratio.")])
+
+    assert 'eda_llm_prompt_tokens_total{model="m"} 1234567\n' in text
+    assert 'eda_db_query_duration_seconds_sum{status="ok"} 1234.5678\n' in text
+    assert 'eda_db_query_duration_seconds_bucket{status="ok",le="0.005"} 0\n' in text
+    assert "eda_tenant_memory_bytes 3456789012\n" in text
+    assert "eda_ratio 0.30000000000000004\n" in text
+
+
+def test_answering_a_question_prints_nothing(workflow, capsys):
+    workflow.run_sql_agent("Which artists are there?", "q-1")
+    workflow.run_sql_agent("SELECT nothing", "q-2")
+    assert capsys.readouterr().out == ""
+
+
+def test_request_details_are_telemetry_events(workflow, caplog):
+    caplog.set_level(logging.INFO, logger="eda.telemetry")
+    workflow.run_sql_agent("Which artists are there?", "q-1")
+
+    events = [json.loads(record.getMessage()) for record in caplog.records if record.name == "eda.telemetry"]
+    by_name = {event["event"]: event for event in events}
+    assert {"schema_pruning", "sql_validation", "results_summary", "visualization_rules"} <= set(by_name)
+    assert by_name["sql_validation"]["valid"] is True
+    assert by_name["schema_pruning"]["tables_total"] == 3
+    assert all(event["trace_id"] == "q-1" for event in events)
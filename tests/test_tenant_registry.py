@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from TenantRegistry import TenantRegistry, TenantRuntime, UnknownTenant
+
+
+class FakeDatabase:
+    """Stands in for a DatabaseManager: a fixed memory estimate and a closed flag."""
+
+    def __init__(self, size=0):
+        self.size = size
+        self.closed = False
+
+    def memory_bytes(self):
+        return self.size
+
+    def close(self):
+        self.closed = True
+
+
+class FakeAgent:
+    def close(self):
+        pass
+
+
+def registry(sizes=None, delay=0.0, **kwargs):
+    builds = []
+
+    def build(tenant, database, cache_dir):
+        builds.append(tenant)
+        time.sleep(delay)
+        return TenantRuntime(tenant, FakeDatabase((sizes or {}).get(tenant, 0)), FakeAgent(), app=None)
+
+    tenants = {name: f"sqlite:///{name}.db" for name in "abcd"}
+    return TenantRegistry(tenants, build, cache_dir=None, **kwargs), builds
+
+
+def use(tenants, *names):
+    for name in names:
+        tenants.release(tenants.acquire(name))
+
+
+def test_least_recently_used_runtime_is_closed_over_capacity():
+    tenants, _ = registry(max_open=2)
+    use(tenants, "a", "b", "a", "c")
+    assert list(tenants.runtimes) == ["a", "c"]
+    assert tenants.stats['capacity'] == 1
+
+
+def test_leased_runtimes_are_never_closed():
+    tenants, _ = registry(max_open=1)
+    a = tenants.acquire("a")
+    b = tenants.acquire("b")
+    assert set(tenants.runtimes) == {"a", "b"}  # over capacity while both are busy
+    tenants.release(b)
+    assert list(tenants.runtimes) == ["a"]
+    assert not a.db_manager.closed and b.db_manager.closed
+    tenants.release(a)
+
+
+def test_idle_runtimes_are_closed():
+    tenants, _ = registry(idle_timeout=0.05)
+    use(tenants, "a")
+    time.sleep(0.1)
+    assert tenants.evict() == [("a", "idle")]
+    assert not tenants.runtimes
+
+
+def test_memory_budget_keeps_the_last_runtime():
+    tenants, _ = registry(sizes={"a": 60, "b": 60}, max_bytes=100)
+    use(tenants, "a", "b")
+    assert list(tenants.runtimes) == ["b"]
+    assert tenants.stats['memory'] == 1
+    tenants.max_bytes = 10
+    assert tenants.evict() == []
+
+
+def test_concurrent_first_questions_build_once():
+    tenants, builds = registry(delay=0.05)
+    threads = [threading.Thread(target=use, args=(tenants, "a")) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert builds == ["a"]
+    assert tenants.runtimes["a"].leases == 0
+    assert not tenants.building
+
+
+def test_unknown_tenant():
+    tenants, builds = registry()
+    with pytest.raises(UnknownTenant):
+        tenants.acquire("nope")
+    assert not builds and not tenants.building
+
+
+def test_failed_build_is_retried_one_caller_at_a_time():
+    attempts = []
+    running = []
+
+    def build(tenant, database, cache_dir):
+        running.append(tenant)
+        attempts.append(len(running))
+        time.sleep(0.02)
+        running.pop()
+        if len(attempts) == 1:
+            raise RuntimeError("database unavailable")
+        return TenantRuntime(tenant, FakeDatabase(), FakeAgent(), app=None)
+
+    tenants = TenantRegistry({"a": "sqlite:///a.db"}, build, cache_dir=None)
+    errors = []
+
+    def ask():
+        try:
+            use(tenants, "a")
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=ask) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 1
+    assert len(attempts) == 2 and max(attempts) == 1  # never two builds at once
+    assert not tenants.building
@@ -0,0 +1,87 @@
+import sqlite3
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+
+from ValueIndex import ValueIndex
+
+
+@pytest.fixture
+def index(db_path):
+    value_index = ValueIndex(create_engine(f"sqlite:///{db_path}"), refresh_interval=0)
+    yield value_index
+    value_index.close()
+
+
+def values(index, question="Artist 7"):
+    return [value for value, _ in index.lookup(question, "artists", ["Name"], k=50)]
+
+
+def execute(db_path, statement, *params):
+    conn = sqlite3.connect(db_path)
+    conn.execute(statement, params)
+    conn.commit()
+    conn.close()
+
+
+def test_update_in_place_is_detected(index, db_path):
+    assert "Artist 7" in values(index)
+    execute(db_path, "UPDATE artists SET Name = 'Renamed Seven' WHERE ArtistId = 7")
+    found = values(index, "Renamed Seven")
+    assert "Renamed Seven" in found
+    assert "Artist 7" not in values(index)
+
+
+def test_same_length_update_is_detected(index, db_path):
+    values(index)
+    execute(db_path, "UPDATE artists SET Name = 'Artist X' WHERE ArtistId = 7")
+    assert "Artist X" in values(index, "Artist X")
+
+
+def test_appended_rows_are_indexed_incrementally(index, db_path):
+    values(index)
+    execute(db_path, "INSERT INTO artists (Name) VALUES (?)", "Brand New Band")
+    assert "Brand New Band" in values(index, "Brand New Band")
+    row_count = index.conn.execute("SELECT row_count FROM indexed_columns WHERE table_name = 'artists'").fetchone()
+    assert row_count == (51,)
+
+
+def test_append_with_an_update_rebuilds(index, db_path):
+    values(index)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE artists SET Name = 'Changed Name' WHERE ArtistId = 3")
+    conn.execute("INSERT INTO artists (Name) VALUES ('Appended Band')")
+    conn.commit()
+    conn.close()
+    assert "Changed Name" in values(index, "Changed Name")
+    assert "Artist 3" not in values(index, "Artist 3")
+
+
+def test_probe_waits_for_refresh_interval(index, db_path):
+    values(index)
+    index.refresh_interval = 3600
+    execute(db_path, "UPDATE artists SET Name = 'Renamed Seven' WHERE ArtistId = 7")
+    assert "Renamed Seven" not in values(index, "Renamed Seven")
+
+
+def test_slow_probe_does_not_block_other_lookups(db_path):
+    class SlowProbe(ValueIndex):
+        def _probe(self, table_name, column_name, after_rowid=None):
+            if column_name == "Title":
+                probing.set()
+                release.wait(5)
+            return super()._probe(table_name, column_name, after_rowid)
+
+    probing, release = threading.Event(), threading.Event()
+    index = SlowProbe(create_engine(f"sqlite:///{db_path}"), refresh_interval=3600)
+    values(index)
+    scan = threading.Thread(target=index.ensure_indexed, args=("albums", "Title"))
+    scan.start()
+    assert probing.wait(5)
+    # Answered while the albums column is still being probed
+    assert "Artist 7" in values(index)
+    release.set()
+    scan.join()
+    assert index.lookup("Album 12", "albums", ["Title"], ensure=False)
+    index.close()
@@ -0,0 +1,91 @@
+import pytest
+
+from LLMManager import LLMManager
+from StubLLM import StubChatModel
+from VisualizationRules import VisualizationRules, column_label, humanize
+from sql_agent import SQLAgent
+
+
+@pytest.fixture
+def rules():
+    return VisualizationRules()
+
+
+def chart(rules, question, results):
+    return rules.choose(question, results)['visualization']
+
+
+def test_time_and_numeric_make_a_line_chart(rules):
+    dates = [{"InvoiceDate": f"2021-{month:02d}-01", "Total": month * 1.5} for month in range(1, 13)]
+    years = [{"Year": year, "Sales": year - 2000} for year in range(2010, 2020)]
+    assert chart(rules, "What are the sales per month?", dates) == "line"
+    assert chart(rules, "Sales by year", years) == "line"
+    assert rules.choose("", dates)['visualization_confidence'] >= rules.threshold
+
+
+def test_categories_and_numeric_make_a_bar_chart(rules):
+    countries = [{"BillingCountry": f"Country {i}", "Total": i} for i in range(10)]
+    assert chart(rules, "What are the total sales by country?", countries) == "bar"
+    assert chart(rules, "Compare three countries", countries[:3]) == "horizontal_bar"
+    assert chart(rules, "What share of sales comes from each country?", countries[:5]) == "pie"
+
+
+def test_two_numerics_make_a_scatter_plot(rules):
+    results = [{"Milliseconds": i * 1000, "UnitPrice": (i % 7) * 0.5} for i in range(50)]
+    decision = rules.choose("Is the price correlated with the length?", results)
+    assert decision['visualization'] == "scatter"
+    assert decision['visualization_confidence'] == 0.9
+
+
+def test_category_series_over_time_make_a_line_chart(rules):
+    results = [{"Country": country, "Month": f"2021-{month:02d}", "Total": month}
+               for country in ["USA", "France"] for month in range(1, 7)]
+    assert chart(rules, "Sales per country over time", results) == "line"
+
+
+def test_trivial_shapes_need_no_chart(rules):
+    assert chart(rules, "How many artists?", [{"n": 275}]) == "none"
+    assert chart(rules, "List the artists", [{"Name": "A"}, {"Name": "B"}]) == "none"
+    assert chart(rules, "Anything", []) == "none"
+
+
+def test_column_label():
+    assert column_label("total_sales") == "Total Sales"
+    assert column_label("UnitPrice") == "Unit Price"
+    assert column_label("TOTAL_SALES") == "Total Sales"
+    assert column_label("invoices.BillingCountry") == "Billing Country"
+    assert column_label("SUM(Total)") is None
+    assert column_label("column_1") is None
+    assert column_label("?column?") is None
+    assert humanize("`avg_price`") == "Avg Price"
+
+
+@pytest.fixture
+def agent(db_manager, tmp_path):
+    stub = StubChatModel(responses=[("recommends appropriate data visualizations",
+                                     "Recommended Visualization: horizontal_bar\nReason: The LLM read the shape.")])
+    agent = SQLAgent(db_manager=db_manager, llm_manager=LLMManager(cache_dir=None, llm=stub),
+                     plan_cache_dir=str(tmp_path))
+    yield agent, stub
+    agent.close()
+
+
+def test_ambiguous_shapes_are_left_to_the_llm(agent):
+    agent, stub = agent
+    results = [{"a": i, "b": i, "c": i, "d": i} for i in range(5)]
+    decision = agent.choose_visualization({'question': "Show everything", 'results': results, 'sql_query': "SELECT"})
+
+    assert stub.calls == 1
+    assert decision['visualization'] == "horizontal_bar"
+    assert decision['visualization_reason'] == "The LLM read the shape."
+    assert decision['visualization_method'] == "llm"
+
+
+def test_confident_rules_skip_the_llm(agent):
+    agent, stub = agent
+    results = [{"InvoiceDate": f"2021-{month:02d}-01", "Total": month} for month in range(1, 13)]
+    decision = agent.choose_visualization({'question': "Sales per month", 'results': results, 'sql_query': "SELECT"})
+
+    assert stub.calls == 0
+    assert decision['visualization'] == "line"
+    assert decision['visualization_method'] == "rules"
@@ -0,0 +1,71 @@
+import asyncio
+import threading
+
+from workflow_manager import WorkflowManager
+
+
+def count_compiles(workflow):
+    """Counts the graphs built by create_workflow (each one is compiled once)."""
+    compiles = []
+    create_workflow = workflow.create_workflow
+
+    def counting(*args, **kwargs):
+        compiles.append(threading.get_ident())
+        return create_workflow(*args, **kwargs)
+
+    workflow.create_workflow = counting
+    return compiles
+
+
+def test_components_are_built_on_first_use(db_manager):
+    workflow = WorkflowManager(db_manager=db_manager)
+    assert workflow._sql_agent is None and workflow._llm_manager is None and workflow.app is None
+
+
+def test_graph_is_compiled_once_and_reused(workflow, llm_calls):
+    compiles = count_compiles(workflow)
+    barrier = threading.Barrier(8)
+    graphs = []
+
+    def first_request():
+        barrier.wait()
+        graphs.append(workflow.returnGraph())
+
+    threads = [threading.Thread(target=first_request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    workflow.run_sql_agent("Which artists are there?", "q-1")
+    workflow.run_sql_agent("Which albums are there?", "q-2")
+    assert len(compiles) == 1
+    assert all(graph is workflow.app for graph in graphs)
+    assert llm_calls["parse"] == 2
+
+
+def test_warm_up_builds_every_component(workflow):
+    compiles = count_compiles(workflow)
+    timings = workflow.warm_up()
+    assert set(timings) == {"db_manager", "schema", "llm_manager", "sql_agent", "data_formatter", "tokenizer", "graph"}
+    workflow.run_sql_agent("Which artists are there?", "q-1")
+    assert len(compiles) == 1
+
+
+def test_sync_and_async_runs_give_the_same_answer(workflow, llm_calls):
+    questions = ["Which artists are there?", "Which albums are there?"]
+    sync_results = [workflow.run_sql_agent(question, f"sync-{i}") for i, question in enumerate(questions)]
+    workflow.sql_agent.plan_cache.clear()
+    workflow.llm_manager.cache.clear()
+    calls = dict(llm_calls)
+
+    async def answer_all():
+        return await asyncio.gather(*(workflow.arun_sql_agent(question, f"async-{i}")
+                                      for i, question in enumerate(questions)))
+
+    async_results = asyncio.run(answer_all())
+    assert async_results == sync_results
+    assert sync_results[0]["answer"] == "The first artists are Artist 1, Artist 2 and Artist 3."
+    assert sync_results[0]["error_type"] is None
+    # The async path made the same LLM calls
+    assert {task: llm_calls[task] - count for task, count in calls.items()} == calls
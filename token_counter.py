@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Token accounting helpers used to keep prompts under a fixed budget
+# Counts come from the model's tokenizer (tiktoken) when it is installed and its encoding file is in the tiktoken cache,
+# otherwise from a characters-per-token estimate. The encoding is never downloaded here: place the file in
+# TIKTOKEN_CACHE_DIR ahead of time. EDA_TOKEN_ENCODING selects the encoding, "chars" forces the estimate.
+# -----------------------------------------------------------------------------------------------------------------------------
+
+logger = logging.getLogger("eda.token_counter")
+
+CHARS_PER_TOKEN = 4
+DEFAULT_ENCODING = "o200k_base"  # the gpt-4o family
+# Files of the OpenAI encodings; tiktoken caches each one under the SHA-1 of its URL
+ENCODING_URLS = {
+    "o200k_base": "https://openaipublic.blob.core.windows.net/encodings/o200k_base.tiktoken",
+    "cl100k_base": "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken",
+}
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def cached_encoding_path(name):
+    """
+    Returns where tiktoken looks for the file of an encoding (TIKTOKEN_CACHE_DIR, DATA_GYM_CACHE_DIR or its directory
+    in the temp folder), or None for encodings whose file is not known here.
+    """
+    url = ENCODING_URLS.get(name)
+    if url is None:
+        return None
+    cache_dir = os.environ.get("DATA_GYM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "data-gym-cache"))
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", cache_dir)
+    return os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest())
+
+
+def get_encoding():
+    """
+    Returns the tiktoken encoding used for counting, or None if the estimate is used. The encoding is loaded once, on
+    first use or by WorkflowManager.warm_up(). When its file is not in the tiktoken cache the estimate is used without
+    trying to download it; a failure (tiktoken missing, file unreadable) is remembered so that it is only tried once.
+    """
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            name = os.getenv("EDA_TOKEN_ENCODING", DEFAULT_ENCODING)
+            path = cached_encoding_path(name)
+            if name != "chars" and path is not None and not os.path.exists(path):
+                logger.warning("Token counts are estimated, the %s tokenizer is not in the tiktoken cache (%s); "
+                               "set TIKTOKEN_CACHE_DIR to a directory holding it", name, path)
+            elif name != "chars":
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(name)
+                except Exception as e:
+                    logger.warning("Token counts are estimated, the %s tokenizer is unavailable: %s", name,
+                                   e.__class__.__name__)
+            _encoding_loaded = True
+    return _encoding
+
+
+def count_tokens(text) -> int:
+    """
+    Counts the number of tokens the given text (or the str() of an object) occupies in a prompt.
+
+    Args:
+        text: The prompt fragment. Non-string values are converted with str(), which is how they are interpolated
+              into the prompt templates.
+
+    Returns:
+        int: The token count (estimated when no tokenizer is available).
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
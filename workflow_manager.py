@@ -1,56 +1,345 @@
-from langgraph.graph import StateGraph
-from State import InputState, OutputState
-from sql_agent import SQLAgent
-from DataFormatter import DataFormatter
-from langgraph.graph import END
+from BatchRunner import BatchRunner
+from TenantRegistry import TenantRegistry, TenantRuntime, UnknownTenant
+from Telemetry import telemetry
+from token_counter import get_encoding
+from offload import to_thread
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import threading
+import time
+import weakref
+
+# -----------------------------------------------------------------------------------------------------------------------------
+# Importing this module is cheap: langgraph, LangChain, SQLAlchemy and NetworkX are imported, and the database engine,
+# LLM client and agent are built, on first use (or by warm_up()). See benchmarks/profile_startup.py for the cost of each.
+# -----------------------------------------------------------------------------------------------------------------------------
 
 class WorkflowManager:
-    def __init__(self):
-        self.sql_agent = SQLAgent()
-        self.data_formatter = DataFormatter()
+    """
+    Long-lived runtime of the SQL agent workflow.
+
+    One DatabaseManager (engine and connection pool) and one LLMManager (LLM client and response cache) are shared by
+    every node, and the graph is compiled once on first use. A single instance can serve many concurrent requests.
+    The components are built when they are first needed; warm_up() builds them all up front.
+
+    Questions can also name a tenant, which is answered on that tenant's database by a runtime of its own (see
+    TenantRegistry). The LLMManager and DataFormatter are shared with the default database.
+    """
+
+    def __init__(self, db_url="sqlite:///chinook.db", db_manager=None, llm_manager=None, max_concurrency=32,
+                 snapshot=None, tenants=None, max_tenants=16, tenant_memory_bytes=512 * 1024 * 1024,
+                 tenant_idle_timeout=600.0, tenant_cache_dir=".eda_cache"):
+        """
+        Args:
+            snapshot (str): Directory of a runtime snapshot (see RuntimeSnapshot) loaded into the DatabaseManager
+                            when it is built, so that a fresh worker skips schema introspection and value indexing.
+            tenants (dict | callable): Tenant -> database (a db_url or a dict of DatabaseManager arguments), see
+                            TenantRegistry. None answers every question on db_url.
+            max_tenants, tenant_memory_bytes, tenant_idle_timeout, tenant_cache_dir: Limits and cache location of
+                            the tenant runtimes (max_open, max_bytes, idle_timeout and cache_dir of TenantRegistry).
+        """
+        self.db_url = db_url
+        self._db_manager = db_manager
+        self._llm_manager = llm_manager
+        self._sql_agent = None
+        self._data_formatter = None
+        self.snapshot = snapshot
+        self.tenant_registry = None
+        if tenants is not None:
+            self.tenant_registry = TenantRegistry(tenants, self._build_tenant, max_open=max_tenants,
+                                                  max_bytes=tenant_memory_bytes, idle_timeout=tenant_idle_timeout,
+                                                  cache_dir=tenant_cache_dir)
+        self.app = None
+        self.compile_lock = threading.Lock()
+        self.component_lock = threading.RLock()
+        self.max_concurrency = max_concurrency
+        self.semaphores = weakref.WeakKeyDictionary()  # one semaphore per event loop
+
+    # -----------------------------------------------------------------------------------------------------------------------------
+    # Components
+    # Built on first access, under one lock so that concurrent first requests share them
+    # -----------------------------------------------------------------------------------------------------------------------------
+
+    @property
+    def db_manager(self):
+        if self._db_manager is None:
+            with self.component_lock:
+                if self._db_manager is None:
+                    from DatabaseManager import DatabaseManager
+                    db_manager = DatabaseManager(self.db_url)
+                    if self.snapshot:
+                        from RuntimeSnapshot import load_snapshot
+                        load_snapshot(db_manager, self.snapshot)
+                    self._db_manager = db_manager
+        return self._db_manager
+
+    @property
+    def llm_manager(self):
+        if self._llm_manager is None:
+            with self.component_lock:
+                if self._llm_manager is None:
+                    from LLMManager import LLMManager
+                    self._llm_manager = LLMManager()
+        return self._llm_manager
+
+    @property
+    def sql_agent(self):
+        if self._sql_agent is None:
+            with self.component_lock:
+                if self._sql_agent is None:
+                    from sql_agent import SQLAgent
+                    self._sql_agent = SQLAgent(db_manager=self.db_manager, llm_manager=self.llm_manager)
+        return self._sql_agent
+
+    @property
+    def data_formatter(self):
+        if self._data_formatter is None:
+            with self.component_lock:
+                if self._data_formatter is None:
+                    from DataFormatter import DataFormatter
+                    self._data_formatter = DataFormatter(llm_manager=self.llm_manager)
+        return self._data_formatter
+
+    def _build_tenant(self, tenant, database, cache_dir) -> TenantRuntime:
+        """Builds the DatabaseManager, SQLAgent and compiled graph of a tenant (the build of TenantRegistry)."""
+        from DatabaseManager import DatabaseManager
+        from sql_agent import SQLAgent
+
+        options = dict(database)
+        db_url = options.pop('db_url')
+        snapshot = options.pop('snapshot', None)
+        db_manager = DatabaseManager(db_url, cache_dir=cache_dir, **options)
+        try:
+            if snapshot:
+                from RuntimeSnapshot import load_snapshot
+                load_snapshot(db_manager, snapshot)
+            agent = SQLAgent(db_manager=db_manager, llm_manager=self.llm_manager, plan_cache_dir=cache_dir)
+            app = self.create_workflow(agent).compile()
+        except Exception:
+            db_manager.close()
+            raise
+        return TenantRuntime(tenant, db_manager, agent, app)
+
+    @contextmanager
+    def runtime(self, tenant=None):
+        """
+        Holds the runtime (DatabaseManager, SQLAgent and compiled graph) answering for a tenant for the duration of the
+        block. None is the default database.
+
+        Raises:
+            UnknownTenant: If the tenant has no database, or no tenants are configured.
+        """
+        if tenant is None:
+            yield TenantRuntime(None, self.db_manager, self.sql_agent, self.returnGraph())
+            return
+        if self.tenant_registry is None:
+            raise UnknownTenant(tenant)
+        with self.tenant_registry.lease(tenant) as runtime:
+            yield runtime
+
+    @asynccontextmanager
+    async def aruntime(self, tenant=None):
+        """Async variant of runtime(). Building and closing runtimes is offloaded to a thread."""
+        if tenant is None:
+            yield TenantRuntime(None, self.db_manager, self.sql_agent, self.returnGraph())
+            return
+        if self.tenant_registry is None:
+            raise UnknownTenant(tenant)
+        acquired = asyncio.get_running_loop().run_in_executor(None, self.tenant_registry.acquire, tenant)
+        try:
+            runtime = await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # A runtime acquired after the caller gave up must still be handed back
+            await asyncio.wait([acquired])
+            if acquired.exception() is None:
+                await to_thread(self.tenant_registry.release, acquired.result())
+            raise
+        try:
+            yield runtime
+        finally:
+            await to_thread(self.tenant_registry.release, runtime)
+
+    def close_tenants(self):
+        """Closes the runtimes of every tenant, e.g. on shutdown."""
+        if self.tenant_registry is not None:
+            self.tenant_registry.close_all()
+
+    def warm_up(self) -> dict:
+        """
+        Builds every component, loads the tokenizer and compiles the graph, so that the first question pays for none
+        of it.
+
+        Returns:
+            dict: Milliseconds spent on each step.
+        """
+        timings = {}
+        for name, step in (("db_manager", lambda: self.db_manager), ("schema", lambda: self.db_manager.get_schema()),
+                           ("llm_manager", lambda: self.llm_manager), ("sql_agent", lambda: self.sql_agent),
+                           ("data_formatter", lambda: self.data_formatter), ("tokenizer", get_encoding),
+                           ("graph", self.returnGraph)):
+            start = time.perf_counter()
+            step()
+            timings[name] = round((time.perf_counter() - start) * 1000, 3)
+        return timings
 
-    def create_workflow(self) -> StateGraph:
-        """Create and configure the workflow graph."""
-        workflow = StateGraph(input=InputState, output=OutputState)
+    def _add_node(self, workflow, name, sync_func, async_func):
+        """
+        Add a node whose invoke() runs the sync variant and ainvoke() the async one, both instrumented (wall time and
+        outcome per node, see Telemetry).
+        """
+        from langchain_core.runnables import RunnableLambda
+        workflow.add_node(name, RunnableLambda(telemetry.instrument_node(name, sync_func),
+                                               afunc=telemetry.ainstrument_node(name, async_func), name=name))
+
+    def create_workflow(self, agent=None):
+        """
+        Create and configure the workflow graph (a langgraph StateGraph) with the nodes of an SQLAgent, by default the
+        one of the default database.
+        """
+        from langgraph.graph import StateGraph, END
+        from State import InputState, OutputState, OverallState
+
+        workflow = StateGraph(OverallState, input_schema=InputState, output_schema=OutputState)
 
         # Add nodes to the graph
-        workflow.add_node("parse_question", self.sql_agent.parse_question)
-        workflow.add_node("get_unique_nouns", self.sql_agent.get_unique_nouns)
-        workflow.add_node("generate_sql", self.sql_agent.generate_sql)
-        workflow.add_node("validate_sql", self.sql_agent.validator)
-        workflow.add_node("fix_sql", self.sql_agent.fix_sql)
-        workflow.add_node("execute_sql", self.sql_agent.execute_sql)
-        workflow.add_node("format_results", self.sql_agent.format_results)
-        workflow.add_node("choose_visualization", self.sql_agent.choose_visualization)
-        workflow.add_node("format_data_for_visualization", self.data_formatter.format_data_for_visualization)
+        agent = agent if agent is not None else self.sql_agent
+        self._add_node(workflow, "lookup_plan", agent.lookup_plan, agent.alookup_plan)
+        self._add_node(workflow, "retrieve_schema", agent.retrieve_schema, agent.aretrieve_schema)
+        self._add_node(workflow, "parse_question", agent.parse_question, agent.aparse_question)
+        self._add_node(workflow, "get_unique_nouns", agent.get_unique_nouns, agent.aget_unique_nouns)
+        self._add_node(workflow, "generate_sql", agent.generate_sql, agent.agenerate_sql)
+        self._add_node(workflow, "validate_sql", agent.validator, agent.avalidator)
+        self._add_node(workflow, "fix_sql", agent.fix_sql, agent.afix_sql)
+        self._add_node(workflow, "execute_sql", agent.execute_sql, agent.aexecute_sql)
+        self._add_node(workflow, "handle_query_error", agent.handle_query_error, agent.ahandle_query_error)
+        self._add_node(workflow, "summarize_results", agent.summarize_results, agent.asummarize_results)
+        self._add_node(workflow, "format_results", agent.format_results, agent.aformat_results)
+        self._add_node(workflow, "choose_visualization", agent.choose_visualization, agent.achoose_visualization)
+        self._add_node(workflow, "store_plan", agent.store_plan, agent.astore_plan)
+        self._add_node(workflow, "format_data_for_visualization", self.data_formatter.format_data_for_visualization,
+                       self.data_formatter.aformat_data_for_visualization)
         
         # Define edges
+        workflow.add_conditional_edges("lookup_plan",
+                                        lambda x: "hit" if x["plan_cache_hit"] else "miss",
+                                        {"hit": "execute_sql", "miss": "retrieve_schema"})
+        workflow.add_edge("retrieve_schema", "parse_question")
         workflow.add_edge("parse_question", "get_unique_nouns")
         workflow.add_edge("get_unique_nouns", "generate_sql")
         workflow.add_edge("generate_sql", "validate_sql")
         workflow.add_conditional_edges("validate_sql",
                                         lambda x: x["valid"],  # Use the "valid" key from the returned dictionary
-                                        {"valid": "execute_sql", "invalid": "fix_sql"})
+                                        {"valid": "execute_sql", "invalid": "fix_sql", "not_relevant": "execute_sql"})
         workflow.add_edge("fix_sql", "validate_sql")
-        workflow.add_edge("execute_sql", "format_results")
-        workflow.add_edge("execute_sql", "choose_visualization")
-        workflow.add_edge("choose_visualization", "format_data_for_visualization")
+        workflow.add_conditional_edges("execute_sql",
+                                        lambda x: "failed" if x.get("error_type") else "ok",
+                                        {"ok": "summarize_results", "failed": "handle_query_error"})
+        workflow.add_edge("handle_query_error", END)
+        workflow.add_edge("summarize_results", "format_results")
+        workflow.add_edge("summarize_results", "choose_visualization")
+        workflow.add_edge("choose_visualization", "store_plan")
+        workflow.add_edge("store_plan", "format_data_for_visualization")
         workflow.add_edge("format_data_for_visualization", END)
         workflow.add_edge("format_results", END)
-        workflow.set_entry_point("parse_question")
+        workflow.set_entry_point("lookup_plan")
 
         return workflow
     
+    def _pool_gauges(self) -> list:
+        gauges = []
+        for engine, pool in self.db_manager.pool_metrics().items():
+            gauges.append(("eda_db_pool_checked_out", {"engine": engine}, pool['checked_out'],
+                           "Connections currently checked out of the pool."))
+            gauges.append(("eda_db_pool_waits", {"engine": engine}, pool['waits'],
+                           "Connection requests that found the pool exhausted."))
+            gauges.append(("eda_db_pool_wait_seconds", {"engine": engine}, pool['wait_time_ms'] / 1000,
+                           "Total time spent waiting for a pooled connection."))
+        if self.db_manager.result_cache is not None:
+            gauges.append(("eda_result_cache_bytes", {}, self.db_manager.result_cache.memory_bytes,
+                           "Estimated size of the query results held in memory by the result cache."))
+        if self.tenant_registry is not None:
+            tenants = self.tenant_registry.snapshot()
+            gauges.append(("eda_tenants_open", {}, tenants['open'], "Tenant runtimes (database engines) open."))
+            gauges.append(("eda_tenant_memory_bytes", {}, tenants['memory_bytes'],
+                           "Estimated memory held by the open tenant runtimes."))
+        return gauges
+
+    def metrics_text(self) -> str:
+        """Returns the telemetry metrics and the connection pool state in the Prometheus text format."""
+        return telemetry.render_prometheus(self._pool_gauges())
+
+    def write_metrics(self, path: str):
+        """Writes metrics_text() to a file atomically (e.g. for a textfile collector)."""
+        telemetry.write_prometheus(path, self._pool_gauges())
+
+    def pin_plan(self, question: str, pinned: bool = True, tenant: str = None) -> bool:
+        """Protect (or stop protecting) the cached plan of a question from eviction."""
+        with self.runtime(tenant) as runtime:
+            return runtime.sql_agent.plan_cache.pin(question, runtime.db_manager.schema_fingerprint(), pinned)
+
+    def evict_plan(self, question: str, tenant: str = None) -> int:
+        """Remove the cached plans of a question."""
+        with self.runtime(tenant) as runtime:
+            return runtime.sql_agent.plan_cache.evict(question)
+
     def returnGraph(self):
-        return self.create_workflow().compile()
+        """Return the compiled workflow, compiling it on first use only."""
+        if self.app is None:
+            with self.compile_lock:
+                if self.app is None:
+                    self.app = self.create_workflow().compile()
+        return self.app
+
+    def run_sql_agent(self, question: str, uuid: str, tenant: str = None) -> dict:
+        """
+        Run the SQL agent workflow and return the formatted answer and visualization recommendation.
+
+        Args:
+            tenant (str): Answer on the database of this tenant (see TenantRegistry) instead of the default one.
+        """
+        with self.runtime(tenant) as runtime:
+            with telemetry.request(uuid):  # the uuid is the trace ID of every measurement of this question
+                result = runtime.app.invoke({"question": question, "uuid": uuid})
+        return {
+            "answer": result['answer'],
+            "visualization": result['visualization'],
+            "visualization_reason": result['visualization_reason'],
+            "formatted_data_for_visualization": result['formatted_data_for_visualization'],
+            "error_type": result.get('error_type'),
+        }
+
+    def run_batch(self, questions: list[str], parallelism: int = 8, uuid_prefix: str = "batch",
+                  tenant: str = None) -> list[dict]:
+        """
+        Answers a list of questions concurrently (see BatchRunner): duplicates after normalization are answered once,
+        the schema snapshot and value-index refreshes are shared, and the items come back in input order with their
+        result or error and timing.
+        """
+        return BatchRunner(self, parallelism, tenant).run(questions, uuid_prefix)
+
+    async def arun_batch(self, questions: list[str], parallelism: int = 8, uuid_prefix: str = "batch",
+                         tenant: str = None) -> list[dict]:
+        """Async variant of run_batch."""
+        return await BatchRunner(self, parallelism, tenant).arun(questions, uuid_prefix)
+
+    async def arun_sql_agent(self, question: str, uuid: str, tenant: str = None) -> dict:
+        """
+        Async variant of run_sql_agent. At most max_concurrency questions run at once per event loop,
+        further calls wait for a free slot.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.semaphores.setdefault(loop, asyncio.Semaphore(self.max_concurrency))
 
-    def run_sql_agent(self, question: str, uuid: str) -> dict:
-        """Run the SQL agent workflow and return the formatted answer and visualization recommendation."""
-        app = self.create_workflow().compile()
-        result = app.invoke({"question": question, "uuid": uuid})
+        async with semaphore:
+            async with self.aruntime(tenant) as runtime:
+                with telemetry.request(uuid):
+                    result = await runtime.app.ainvoke({"question": question, "uuid": uuid})
         return {
             "answer": result['answer'],
             "visualization": result['visualization'],
             "visualization_reason": result['visualization_reason'],
-            "formatted_data_for_visualization": result['formatted_data_for_visualization']
-        }
\ No newline at end of file
+            "formatted_data_for_visualization": result['formatted_data_for_visualization'],
+            "error_type": result.get('error_type'),
+        }